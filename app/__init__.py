@@ -3,6 +3,12 @@ BillPro Flask Application Factory
 """
 import os
 import json
+import threading
+import time
+
+# Startup is timed from the first import of the app package
+_import_started = time.perf_counter()
+
 from flask import Flask, render_template
 
 # Import db from models.base to avoid duplicate SQLAlchemy instances
@@ -11,6 +17,11 @@ from app.models.base import db
 
 def create_app():
     """Create and configure the Flask application"""
+    global _import_started
+    started = time.perf_counter()
+    # Only the first app created in a process pays for the imports
+    startup = {'imports': started - (_import_started or started)}
+    _import_started = None
     app = Flask(__name__)
     
     # Load configuration
@@ -42,6 +53,7 @@ def create_app():
     app.register_blueprint(payroll_bp, url_prefix='/payroll')
     app.register_blueprint(reports_bp, url_prefix='/reports')
     app.register_blueprint(printing_bp, url_prefix='/printing')
+    startup['blueprints'] = time.perf_counter() - started
     
     # Load company config into app context
     @app.context_processor
@@ -168,14 +180,151 @@ def create_app():
         
         return render_template('settings/company.html', company=company, state_codes=Config.STATE_CODES)
     
+    @app.route('/settings/backups')
+    def backups():
+        from app.services.backup import DatabaseBackup
+        return render_template('backups.html',
+                              backups=DatabaseBackup.backups(),
+                              status=DatabaseBackup.status(),
+                              backup_dir=Config.BACKUP_DIR,
+                              interval_hours=Config.BACKUP_INTERVAL_HOURS,
+                              keep=Config.BACKUP_KEEP,
+                              keep_labelled=Config.BACKUP_KEEP_LABELLED)
+    
+    @app.route('/settings/backups/create', methods=['POST'])
+    def create_backup():
+        from flask import redirect, url_for, flash
+        from app.services.backup import DatabaseBackup
+        
+        if DatabaseBackup.start():
+            flash('Backup started in the background', 'success')
+        else:
+            flash('A backup is already running', 'info')
+        return redirect(url_for('backups'))
+    
+    @app.route('/settings/backups/status')
+    def backup_status():
+        from flask import jsonify
+        from app.services.backup import DatabaseBackup
+        return jsonify(DatabaseBackup.status())
+    
+    @app.route('/settings/backups/<name>')
+    def download_backup(name):
+        from flask import abort, send_file
+        from app.services.backup import DatabaseBackup
+        
+        try:
+            path = DatabaseBackup.path(name)
+        except ValueError:
+            abort(404)
+        return send_file(path, as_attachment=True, download_name=name)
+    
+    @app.route('/settings/backups/<name>/restore', methods=['POST'])
+    def restore_backup(name):
+        from flask import redirect, url_for, flash
+        from app.services.archive import FinancialYearArchive
+        from app.services.backup import DatabaseBackup
+        from app.services.inventory_valuation import InventoryValuation
+        from app.services.financial_statements import FinancialStatements
+        
+        try:
+            db.session.remove()
+            db.engine.dispose()
+            safety = DatabaseBackup.restore(DatabaseBackup.path(name))
+            flash(f'Database restored from {name}' +
+                  (f'; the previous data was saved as {safety}' if safety else ''), 'success')
+        except Exception as e:
+            flash(f'Error restoring backup: {str(e)}', 'error')
+        finally:
+            # The restored data may have a different set of archived years
+            FinancialYearArchive.refresh()
+            InventoryValuation.invalidate()
+            FinancialStatements.clear_cache()
+        return redirect(url_for('backups'))
+    
     # Create tables
     with app.app_context():
+        phase_started = time.perf_counter()
         from app import models
-        db.create_all()
+        from app.models.schema import (upgrade_schema, enable_wal, analyze, schema_version,
+                                       stored_schema_version, stamp_schema_version)
+        enable_wal()
+        
+        # Schema checks inspect every table; skip them while the models are unchanged
+        version = schema_version()
+        if stored_schema_version() != version:
+            db.create_all()
+            upgrade_schema()
+            
+            # Credit documents saved before due dates were tracked
+            from app.services.ageing import AgeingReport
+            AgeingReport.backfill_due_dates()
+            # Stock movements saved before they carried their document date
+            from app.services.stock_snapshots import StockSnapshots
+            from app.services.archive import FinancialYearArchive
+            StockSnapshots.backfill_movement_dates()
+            FinancialYearArchive.upgrade()
+            analyze()
+            stamp_schema_version(version)
         
         # Create default financial year if not exists
         from app.models import FinancialYear
         from app.services.financial_year import get_or_create_current_fy
         get_or_create_current_fy()
+        startup['database'] = time.perf_counter() - phase_started
+        
+        phase_started = time.perf_counter()
+        # Reports read through their own read-only engine; archived
+        # financial years are attached read-only to every connection
+        from app.models.reporting import init_report_engine
+        from app.services.archive import FinancialYearArchive
+        report_engine = init_report_engine(app)
+        FinancialYearArchive.init_app(app, report_engine)
+        
+        from app.services.perf import PerfMonitor
+        from app.services.slow_queries import SlowQueryLog
+        from app.services.metrics import Metrics
+        PerfMonitor.init_app(app, db.engine, report_engine)
+        SlowQueryLog.init_app(app, db.engine, report_engine)
+        Metrics.init_app(app, db.engine, report_engine)
+        
+        from app.services.profiler import RequestProfiler
+        RequestProfiler.init_app(app)
+        
+        from app.services.template_cache import TemplateCache
+        TemplateCache.init_app(app)
+        startup['services'] = time.perf_counter() - phase_started
+    
+    # Backups, month-end stock snapshots and reorder suggestions are kept current in the background
+    if Config.BACKGROUND_JOBS:
+        threading.Thread(target=_daily_jobs, args=(app,), daemon=True).start()
+    
+    startup['total'] = startup['imports'] + time.perf_counter() - started
+    app.extensions['billpro_startup'] = startup
+    for phase, seconds in startup.items():
+        Metrics.set('billpro_startup_seconds', round(seconds, 4), phase)
     
     return app
+
+
+def _daily_jobs(app):
+    """Scheduled backups, month-end stock snapshots and the nightly reorder batch, checked hourly"""
+    from app.services.backup import DatabaseBackup
+    from app.services.stock_snapshots import StockSnapshots
+    from app.services.replenishment import Replenishment
+    while True:
+        with app.app_context():
+            try:
+                if DatabaseBackup.is_due():
+                    DatabaseBackup.create()
+            except Exception as e:
+                app.logger.warning(f'Scheduled backup failed: {e}')
+            try:
+                StockSnapshots.build()
+            except Exception as e:
+                app.logger.warning(f'Stock snapshot build failed: {e}')
+            try:
+                Replenishment.run_if_stale()
+            except Exception as e:
+                app.logger.warning(f'Reorder suggestions failed: {e}')
+        time.sleep(3600)
@@ -1,7 +1,10 @@
 """
 Accounting Routes - Registers, Books, Summaries
 """
-from flask import render_template, request, redirect, url_for, flash
+import csv
+import io
+import sqlite3
+from flask import render_template, request, redirect, url_for, flash, Response, make_response
 from datetime import date, datetime, timedelta
 from decimal import Decimal
 from sqlalchemy import func
@@ -12,7 +15,11 @@ from app.models.invoice import Invoice
 from app.models.purchase import Purchase
 from app.models.accounting import Expense, ExpenseCategory, CashTransaction, BankTransaction, JournalEntry
 from app.models.party import Party
-from app.utils.date_utils import get_month_range, get_fy_date_range
+from app.models.reporting import report_session
+from app.services.archive import FinancialYearArchive
+from app.services.financial_statements import FinancialStatements
+from app.services.financial_year import get_all_financial_years, close_financial_year
+from app.utils.date_utils import get_month_range, get_fy_date_range, parse_date
 
 
 @accounting_bp.route('/')
@@ -23,31 +30,31 @@ def index():
     fy_start, fy_end = get_fy_date_range()
     
     # Current month stats
-    month_sales = db.session.query(func.sum(Invoice.total_amount)).filter(
+    month_sales = report_session.query(func.sum(Invoice.total_amount)).filter(
         Invoice.invoice_date >= month_start,
         Invoice.invoice_date <= month_end,
         Invoice.status == 'ACTIVE'
     ).scalar() or 0
     
-    month_purchases = db.session.query(func.sum(Purchase.total_amount)).filter(
+    month_purchases = report_session.query(func.sum(Purchase.total_amount)).filter(
         Purchase.purchase_date >= month_start,
         Purchase.purchase_date <= month_end,
         Purchase.status == 'ACTIVE'
     ).scalar() or 0
     
-    month_expenses = db.session.query(func.sum(Expense.amount)).filter(
+    month_expenses = report_session.query(func.sum(Expense.amount)).filter(
         Expense.expense_date >= month_start,
         Expense.expense_date <= month_end
     ).scalar() or 0
     
     # FY stats
-    fy_sales = db.session.query(func.sum(Invoice.total_amount)).filter(
+    fy_sales = report_session.query(func.sum(Invoice.total_amount)).filter(
         Invoice.invoice_date >= fy_start,
         Invoice.invoice_date <= fy_end,
         Invoice.status == 'ACTIVE'
     ).scalar() or 0
     
-    fy_purchases = db.session.query(func.sum(Purchase.total_amount)).filter(
+    fy_purchases = report_session.query(func.sum(Purchase.total_amount)).filter(
         Purchase.purchase_date >= fy_start,
         Purchase.purchase_date <= fy_end,
         Purchase.status == 'ACTIVE'
@@ -67,11 +74,12 @@ def sales_register():
     date_from = request.args.get('date_from', date.today().replace(day=1).isoformat())
     date_to = request.args.get('date_to', date.today().isoformat())
     
-    invoices = Invoice.query.filter(
-        Invoice.invoice_date >= date_from,
-        Invoice.invoice_date <= date_to,
-        Invoice.status == 'ACTIVE'
-    ).order_by(Invoice.invoice_date, Invoice.id).all()
+    invoice = FinancialYearArchive.span(Invoice, date_from, date_to)
+    invoices = report_session.query(invoice).filter(
+        invoice.invoice_date >= date_from,
+        invoice.invoice_date <= date_to,
+        invoice.status == 'ACTIVE'
+    ).order_by(invoice.invoice_date, invoice.id).all()
     
     # Totals
     totals = {
@@ -95,11 +103,12 @@ def purchase_register():
     date_from = request.args.get('date_from', date.today().replace(day=1).isoformat())
     date_to = request.args.get('date_to', date.today().isoformat())
     
-    purchases = Purchase.query.filter(
-        Purchase.purchase_date >= date_from,
-        Purchase.purchase_date <= date_to,
-        Purchase.status == 'ACTIVE'
-    ).order_by(Purchase.purchase_date, Purchase.id).all()
+    purchase = FinancialYearArchive.span(Purchase, date_from, date_to)
+    purchases = report_session.query(purchase).filter(
+        purchase.purchase_date >= date_from,
+        purchase.purchase_date <= date_to,
+        purchase.status == 'ACTIVE'
+    ).order_by(purchase.purchase_date, purchase.id).all()
     
     totals = {
         'subtotal': sum(float(p.subtotal or 0) for p in purchases),
@@ -123,16 +132,17 @@ def expense_register():
     date_to = request.args.get('date_to', date.today().isoformat())
     category_id = request.args.get('category')
     
-    query = Expense.query.filter(
-        Expense.expense_date >= date_from,
-        Expense.expense_date <= date_to
+    expense = FinancialYearArchive.span(Expense, date_from, date_to)
+    query = report_session.query(expense).filter(
+        expense.expense_date >= date_from,
+        expense.expense_date <= date_to
     )
     
     if category_id:
-        query = query.filter_by(category_id=category_id)
+        query = query.filter(expense.category_id == category_id)
     
-    expenses = query.order_by(Expense.expense_date.desc()).all()
-    categories = ExpenseCategory.query.order_by(ExpenseCategory.name).all()
+    expenses = query.order_by(expense.expense_date.desc(), expense.id.desc()).all()
+    categories = report_session.query(ExpenseCategory).order_by(ExpenseCategory.name).all()
     
     total = sum(float(e.amount or 0) for e in expenses)
     
@@ -226,10 +236,11 @@ def cash_book():
     date_from = request.args.get('date_from', date.today().replace(day=1).isoformat())
     date_to = request.args.get('date_to', date.today().isoformat())
     
-    transactions = CashTransaction.query.filter(
-        CashTransaction.transaction_date >= date_from,
-        CashTransaction.transaction_date <= date_to
-    ).order_by(CashTransaction.transaction_date, CashTransaction.id).all()
+    cash = FinancialYearArchive.span(CashTransaction, date_from, date_to)
+    transactions = report_session.query(cash).filter(
+        cash.transaction_date >= date_from,
+        cash.transaction_date <= date_to
+    ).order_by(cash.transaction_date, cash.id).all()
     
     # Calculate running balance
     opening_balance = 0  # TODO: Calculate from previous period
@@ -253,10 +264,11 @@ def bank_book():
     date_from = request.args.get('date_from', date.today().replace(day=1).isoformat())
     date_to = request.args.get('date_to', date.today().isoformat())
     
-    transactions = BankTransaction.query.filter(
-        BankTransaction.transaction_date >= date_from,
-        BankTransaction.transaction_date <= date_to
-    ).order_by(BankTransaction.transaction_date, BankTransaction.id).all()
+    bank = FinancialYearArchive.span(BankTransaction, date_from, date_to)
+    transactions = report_session.query(bank).filter(
+        bank.transaction_date >= date_from,
+        bank.transaction_date <= date_to
+    ).order_by(bank.transaction_date, bank.id).all()
     
     opening_balance = 0
     total_deposits = sum(float(t.deposit or 0) for t in transactions)
@@ -278,21 +290,27 @@ def day_book():
     """Day book - all transactions for a day"""
     selected_date = request.args.get('date', date.today().isoformat())
     
+    def span(model):
+        return FinancialYearArchive.span(model, selected_date, selected_date)
+    
     # Get all transactions for the day
-    invoices = Invoice.query.filter(
-        Invoice.invoice_date == selected_date,
-        Invoice.status == 'ACTIVE'
-    ).all()
+    invoice, purchase, expense = span(Invoice), span(Purchase), span(Expense)
+    cash, bank = span(CashTransaction), span(BankTransaction)
     
-    purchases = Purchase.query.filter(
-        Purchase.purchase_date == selected_date,
-        Purchase.status == 'ACTIVE'
-    ).all()
+    invoices = report_session.query(invoice).filter(
+        invoice.invoice_date == selected_date,
+        invoice.status == 'ACTIVE'
+    ).order_by(invoice.id).all()
+    
+    purchases = report_session.query(purchase).filter(
+        purchase.purchase_date == selected_date,
+        purchase.status == 'ACTIVE'
+    ).order_by(purchase.id).all()
     
-    expenses = Expense.query.filter_by(expense_date=selected_date).all()
+    expenses = report_session.query(expense).filter(expense.expense_date == selected_date).order_by(expense.id).all()
     
-    cash_txns = CashTransaction.query.filter_by(transaction_date=selected_date).all()
-    bank_txns = BankTransaction.query.filter_by(transaction_date=selected_date).all()
+    cash_txns = report_session.query(cash).filter(cash.transaction_date == selected_date).order_by(cash.id).all()
+    bank_txns = report_session.query(bank).filter(bank.transaction_date == selected_date).order_by(bank.id).all()
     
     return render_template('accounting/day_book.html',
                           selected_date=selected_date,
@@ -308,31 +326,35 @@ def monthly_summary():
     """Monthly summary report"""
     year = request.args.get('year', date.today().year, type=int)
     
-    # Get monthly totals for each category
-    months_data = []
+    year_start, year_end = date(year, 1, 1), date(year, 12, 31)
+    
+    def monthly_totals(model, date_column, amount_column, *conditions):
+        """{month number: total} in one grouped query"""
+        date_column = getattr(model, date_column)
+        month = func.cast(func.strftime('%m', date_column), db.Integer)
+        return dict(report_session.query(month, func.sum(getattr(model, amount_column))).filter(
+            date_column >= year_start,
+            date_column <= year_end,
+            *conditions
+        ).group_by(month).all())
     
+    invoice = FinancialYearArchive.span(Invoice, year_start, year_end)
+    purchase = FinancialYearArchive.span(Purchase, year_start, year_end)
+    expense = FinancialYearArchive.span(Expense, year_start, year_end)
+    
+    # Monthly totals for each category
+    sales_by_month = monthly_totals(invoice, 'invoice_date', 'total_amount', invoice.status == 'ACTIVE')
+    purchases_by_month = monthly_totals(purchase, 'purchase_date', 'total_amount', purchase.status == 'ACTIVE')
+    expenses_by_month = monthly_totals(expense, 'expense_date', 'amount')
+    
+    months_data = []
     for month in range(1, 13):
-        start, end = get_month_range(year, month)
-        
-        sales = db.session.query(func.sum(Invoice.total_amount)).filter(
-            Invoice.invoice_date >= start,
-            Invoice.invoice_date <= end,
-            Invoice.status == 'ACTIVE'
-        ).scalar() or 0
-        
-        purchases = db.session.query(func.sum(Purchase.total_amount)).filter(
-            Purchase.purchase_date >= start,
-            Purchase.purchase_date <= end,
-            Purchase.status == 'ACTIVE'
-        ).scalar() or 0
-        
-        expenses = db.session.query(func.sum(Expense.amount)).filter(
-            Expense.expense_date >= start,
-            Expense.expense_date <= end
-        ).scalar() or 0
+        sales = sales_by_month.get(month) or 0
+        purchases = purchases_by_month.get(month) or 0
+        expenses = expenses_by_month.get(month) or 0
         
         months_data.append({
-            'month': start.strftime('%B'),
+            'month': date(year, month, 1).strftime('%B'),
             'sales': float(sales),
             'purchases': float(purchases),
             'expenses': float(expenses),
@@ -343,3 +365,145 @@ def monthly_summary():
     return render_template('accounting/monthly_summary.html',
                           months_data=months_data,
                           year=year)
+
+
+def _statement_period():
+    """Read the statement period from the query string (defaults to current FY)"""
+    fy_start, _ = get_fy_date_range()
+    date_from = parse_date(request.args.get('date_from')) or fy_start
+    date_to = parse_date(request.args.get('date_to')) or date.today()
+    return date_from, date_to
+
+
+@accounting_bp.route('/financial-statements')
+def financial_statements():
+    """Trial balance, profit & loss and balance sheet"""
+    date_from, date_to = _statement_period()
+    statements = FinancialStatements.build(date_from, date_to)
+    if statements['difference']:
+        flash(f"The trial balance does not agree: a difference of ₹{abs(statements['difference']):,.2f} "
+              f"is shown as 'Difference in Trial Balance'", 'warning')
+    
+    return render_template('accounting/financial_statements.html',
+                          statements=statements,
+                          date_from=date_from.isoformat(),
+                          date_to=date_to.isoformat())
+
+
+@accounting_bp.route('/financial-statements/csv')
+def financial_statements_csv():
+    """Export one financial statement to CSV"""
+    date_from, date_to = _statement_period()
+    statement = request.args.get('statement', 'trial-balance')
+    if statement not in ('trial-balance', 'profit-loss', 'balance-sheet'):
+        statement = 'trial-balance'
+    
+    statements = FinancialStatements.build(date_from, date_to)
+    
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerows(FinancialStatements.to_csv_rows(statements, statement))
+    output.seek(0)
+    
+    return Response(
+        output.getvalue(),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename={statement}_{date_from}_to_{date_to}.csv'}
+    )
+
+
+@accounting_bp.route('/financial-statements/pdf')
+def financial_statements_pdf():
+    """Export all financial statements to PDF"""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib import colors
+    from reportlab.lib.units import mm
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    
+    date_from, date_to = _statement_period()
+    statements = FinancialStatements.build(date_from, date_to)
+    
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, leftMargin=15*mm, rightMargin=15*mm)
+    
+    elements = []
+    styles = getSampleStyleSheet()
+    title_style = ParagraphStyle('Title', parent=styles['Heading1'], alignment=1)
+    
+    table_style = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 9),
+        ('BACKGROUND', (0, -1), (-1, -1), colors.lightgrey),
+        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+        ('ALIGN', (-1, 1), (-1, -1), 'RIGHT'),
+        ('ALIGN', (-2, 1), (-2, -1), 'RIGHT'),
+    ])
+    
+    titles = [
+        ('trial-balance', 'Trial Balance'),
+        ('profit-loss', 'Profit & Loss Account'),
+        ('balance-sheet', 'Balance Sheet'),
+    ]
+    
+    for i, (statement, title) in enumerate(titles):
+        if i:
+            elements.append(PageBreak())
+        elements.append(Paragraph(title, title_style))
+        elements.append(Paragraph(f'{date_from} to {date_to}', styles['Normal']))
+        elements.append(Spacer(1, 20))
+        
+        rows = FinancialStatements.to_csv_rows(statements, statement)
+        data = [rows[0]] + [
+            [f'{v:,.2f}' if isinstance(v, Decimal) else v for v in row]
+            for row in rows[1:]
+        ]
+        
+        table = Table(data, repeatRows=1)
+        table.setStyle(table_style)
+        elements.append(table)
+    
+    doc.build(elements)
+    buffer.seek(0)
+    
+    response = make_response(buffer.getvalue())
+    response.headers['Content-Type'] = 'application/pdf'
+    response.headers['Content-Disposition'] = f'attachment; filename=financial_statements_{date_from}_to_{date_to}.pdf'
+    
+    return response
+
+
+@accounting_bp.route('/financial-years')
+def financial_years():
+    """Close financial years and move old ones to their archive databases"""
+    years = get_all_financial_years()
+    return render_template('accounting/financial_years.html',
+                          years=years,
+                          blocked={fy.id: FinancialYearArchive.can_archive(fy) for fy in years},
+                          live_from=FinancialYearArchive.live_from())
+
+
+@accounting_bp.route('/financial-years/<int:id>/close', methods=['POST'])
+def close_year(id):
+    """Close or reopen a financial year"""
+    closed = request.form.get('closed') == '1'
+    try:
+        close_financial_year(id, closed)
+        flash('Financial year closed' if closed else 'Financial year reopened', 'success')
+    except ValueError as e:
+        flash(str(e), 'error')
+    return redirect(url_for('accounting.financial_years'))
+
+
+@accounting_bp.route('/financial-years/<int:id>/archive', methods=['POST'])
+def archive_year(id):
+    """Move a closed year's documents to its archive database"""
+    try:
+        counts = FinancialYearArchive.archive_year(id)
+        flash(f'Archived {sum(counts.values())} rows', 'success')
+    except (ValueError, sqlite3.Error) as e:
+        flash(f'Archive failed: {e}', 'error')
+    return redirect(url_for('accounting.financial_years'))
@@ -1,8 +1,8 @@
 """
 Billing Routes - Sales Invoice Management
 """
-from flask import render_template, request, redirect, url_for, flash, jsonify
-from datetime import datetime, date
+from flask import render_template, request, redirect, url_for, flash, jsonify, abort
+from datetime import datetime, date, timedelta
 from decimal import Decimal
 
 from app.billing import billing_bp
@@ -11,7 +11,9 @@ from app.models.invoice import Invoice, InvoiceItem
 from app.models.product import Product
 from app.models.party import Party, PartyTransaction
 from app.models.accounting import CashTransaction, BankTransaction, JournalEntry
-from app.services.financial_year import get_current_fy
+from app.services.archive import ArchivedRecord, FinancialYearArchive
+from app.services.financial_year import get_active_fy, allocate_invoice_number
+from app.services.settlement import SettlementEngine
 from app.services.tax_calculator import TaxCalculator
 from app.services.stock_manager import StockManager
 from app.utils.number_utils import number_to_words
@@ -67,7 +69,7 @@ def new():
 def create():
     """Create new invoice"""
     try:
-        fy = get_current_fy()
+        fy = get_active_fy()
         
         # Get form data
         party_id = request.form.get('party_id', type=int)
@@ -97,7 +99,7 @@ def create():
         is_igst = TaxCalculator.is_interstate(seller_state, buyer_state) if is_gst else False
         
         # Generate invoice number
-        invoice_number = fy.get_next_invoice_number()
+        invoice_number = allocate_invoice_number(fy)
         
         # Create invoice
         invoice = Invoice(
@@ -110,6 +112,8 @@ def create():
             payment_mode=payment_mode,
             notes=notes
         )
+        if payment_mode == 'CREDIT':
+            invoice.due_date = invoice_date + timedelta(days=party.credit_days or 0)
         db.session.add(invoice)
         db.session.flush()  # Get invoice ID
         
@@ -168,7 +172,8 @@ def create():
                 quantity=qty,
                 reference_type='INVOICE',
                 reference_id=invoice.id,
-                notes=f'Sale: {invoice_number}'
+                notes=f'Sale: {invoice_number}',
+                movement_date=invoice_date
             )
         
         # Calculate invoice totals
@@ -177,9 +182,17 @@ def create():
         # Create accounting entries
         _create_sale_accounting_entries(invoice, party)
         
+        # Receipts kept on account settle the new invoice straight away
+        credit_applied = Decimal('0')
+        if payment_mode == 'CREDIT':
+            credit_applied = SettlementEngine.apply_open_credit(party_id, invoice_date)
+        
         db.session.commit()
         
-        flash(f'Invoice {invoice_number} created successfully', 'success')
+        if credit_applied:
+            flash(f'Invoice {invoice_number} created; ₹{credit_applied} on account applied to it', 'success')
+        else:
+            flash(f'Invoice {invoice_number} created successfully', 'success')
         return redirect(url_for('billing.view', id=invoice.id))
     
     except Exception as e:
@@ -250,19 +263,28 @@ def _create_sale_accounting_entries(invoice, party):
         db.session.add(bank_entry)
 
 
+def _get_invoice(id):
+    """A live invoice, or a read-only one from an archived year"""
+    invoice = db.session.get(Invoice, id) or FinancialYearArchive.get_invoice(id)
+    if invoice is None:
+        abort(404)
+    return invoice
+
+
 @billing_bp.route('/<int:id>')
 def view(id):
     """View invoice details"""
-    invoice = Invoice.query.get_or_404(id)
+    invoice = _get_invoice(id)
     amount_words = number_to_words(float(invoice.total_amount))
     
-    return render_template('billing/view.html', invoice=invoice, amount_words=amount_words)
+    return render_template('billing/view.html', invoice=invoice, amount_words=amount_words,
+                          archived=isinstance(invoice, ArchivedRecord))
 
 
 @billing_bp.route('/<int:id>/print')
 def print_invoice(id):
     """Print invoice - A4 format"""
-    invoice = Invoice.query.get_or_404(id)
+    invoice = _get_invoice(id)
     amount_words = number_to_words(float(invoice.total_amount))
     
     import json
@@ -283,7 +305,7 @@ def print_invoice(id):
 @billing_bp.route('/<int:id>/preview-thermal')
 def preview_thermal(id):
     """Preview invoice - Thermal format (on screen)"""
-    invoice = Invoice.query.get_or_404(id)
+    invoice = _get_invoice(id)
     
     import json
     import os
@@ -309,7 +331,7 @@ def preview_thermal(id):
 @billing_bp.route('/<int:id>/print-thermal')
 def print_thermal(id):
     """Print invoice - Thermal format"""
-    invoice = Invoice.query.get_or_404(id)
+    invoice = _get_invoice(id)
     
     from app.printing.printer import ThermalPrinter
     
@@ -366,9 +388,20 @@ def cancel(id):
         db.session.add(reversal)
     
     invoice.status = 'CANCELLED'
+    
+    # Receipts settled against it go back on account and on to other open invoices
+    credit_applied = Decimal('0')
+    if invoice.payment_mode == 'CREDIT':
+        SettlementEngine.release_invoice(invoice.id)
+        credit_applied = SettlementEngine.apply_open_credit(invoice.party_id, date.today())
+    
     db.session.commit()
     
-    flash(f'Invoice {invoice.invoice_number} cancelled', 'success')
+    if credit_applied:
+        flash(f'Invoice {invoice.invoice_number} cancelled; ₹{credit_applied} on account applied '
+              f'to other open invoices', 'success')
+    else:
+        flash(f'Invoice {invoice.invoice_number} cancelled', 'success')
     return redirect(url_for('billing.view', id=id))
 
 
@@ -1,13 +1,22 @@
 """
 Inventory Routes - Product and Stock Management
 """
-from flask import render_template, request, redirect, url_for, flash, jsonify
+from flask import render_template, request, redirect, url_for, flash, jsonify, stream_template, Response
+from datetime import date, timedelta
 from decimal import Decimal
+import csv
+import io
 
 from app.inventory import inventory_bp
 from app.models.base import db
 from app.models.product import Product, ProductCategory, StockMovement
 from app.services.stock_manager import StockManager
+from app.services.inventory_valuation import InventoryValuation
+from app.services.costing import CostingEngine, COSTING_METHODS
+from app.services.stock_snapshots import StockSnapshots
+from app.services.replenishment import Replenishment
+from app.services.importer import BulkImporter, IMPORT_KINDS
+from app.utils.date_utils import get_fy_date_range, parse_date
 from config.settings import Config
 
 
@@ -44,11 +53,7 @@ def index():
     categories = ProductCategory.query.order_by(ProductCategory.name).all()
     
     # Summary stats
-    total_products = Product.query.filter_by(is_active=True).count()
-    low_stock_count = Product.query.filter(
-        Product.is_active == True,
-        Product.current_stock <= Product.low_stock_threshold
-    ).count()
+    total_products, low_stock_count = InventoryValuation.summary()
     inventory_value = StockManager.get_inventory_value()
     
     return render_template('inventory/index.html',
@@ -65,6 +70,9 @@ def add():
     """Add new product"""
     if request.method == 'POST':
         try:
+            opening_stock = Decimal(request.form.get('opening_stock', '0'))
+            costing_method = request.form.get('costing_method', 'WAVG')
+            
             product = Product(
                 name=request.form.get('name'),
                 code=request.form.get('code') or None,
@@ -75,27 +83,31 @@ def add():
                 cost_price=Decimal(request.form.get('cost_price', '0')),
                 selling_price=Decimal(request.form.get('selling_price', '0')),
                 mrp=Decimal(request.form.get('mrp', '0')) or None,
-                current_stock=Decimal(request.form.get('opening_stock', '0')),
+                current_stock=Decimal('0'),
                 low_stock_threshold=Decimal(request.form.get('low_stock_threshold', '10')),
-                unit=request.form.get('unit', 'PCS')
+                unit=request.form.get('unit', 'PCS'),
+                costing_method=costing_method if costing_method in COSTING_METHODS else 'WAVG'
             )
             
             db.session.add(product)
-            db.session.commit()
+            db.session.flush()
             
-            # Create opening stock movement
-            if product.current_stock > 0:
+            # Create opening stock movement, costed at the entered cost price
+            if opening_stock > 0:
                 movement = StockMovement(
                     product_id=product.id,
                     movement_type='ADJUSTMENT',
-                    quantity=product.current_stock,
+                    quantity=opening_stock,
                     reference_type='OPENING',
                     stock_before=0,
-                    stock_after=product.current_stock,
+                    stock_after=opening_stock,
                     notes='Opening stock'
                 )
+                CostingEngine.record(product, movement, product.cost_price)
                 db.session.add(movement)
-                db.session.commit()
+                product.current_stock = opening_stock
+            
+            db.session.commit()
             
             flash(f'Product "{product.name}" added successfully', 'success')
             return redirect(url_for('inventory.index'))
@@ -139,8 +151,17 @@ def edit(id):
             product.unit = request.form.get('unit', 'PCS')
             product.is_active = request.form.get('is_active') == 'on'
             
+            costing_method = request.form.get('costing_method', product.costing_method or 'WAVG')
+            method_changed = costing_method in COSTING_METHODS and costing_method != product.costing_method
+            if method_changed:
+                product.costing_method = costing_method
+            
             db.session.commit()
             
+            # Re-cost the product's history under the new method
+            if method_changed:
+                CostingEngine.rebuild([product.id])
+            
             flash('Product updated successfully', 'success')
             return redirect(url_for('inventory.view', id=id))
         
@@ -218,6 +239,41 @@ def delete_category(id):
     return redirect(url_for('inventory.categories'))
 
 
+# Bulk import
+@inventory_bp.route('/import', methods=['GET', 'POST'])
+def import_data():
+    """Import products or opening stock from CSV/XLSX"""
+    kind = request.values.get('kind', 'products')
+    if kind not in ('products', 'stock'):
+        kind = 'products'
+    
+    if request.args.get('template'):
+        return Response(
+            BulkImporter.template_csv(kind),
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename={kind}_import.csv'}
+        )
+    
+    result = None
+    if request.method == 'POST':
+        file = request.files.get('file')
+        if not file or not file.filename:
+            flash('Choose a CSV or XLSX file to import', 'error')
+        else:
+            try:
+                result = BulkImporter.import_file(kind, file, dry_run=bool(request.form.get('dry_run')))
+            except Exception as e:
+                flash(f'Error importing file: {str(e)}', 'error')
+    
+    return render_template('import.html',
+                          kinds=[('products', 'Products'), ('stock', 'Opening Stock')],
+                          kind=kind,
+                          columns=IMPORT_KINDS[kind],
+                          result=result,
+                          action=url_for('inventory.import_data'),
+                          back=url_for('inventory.index'))
+
+
 # Low stock report
 @inventory_bp.route('/low-stock')
 def low_stock():
@@ -226,23 +282,120 @@ def low_stock():
     return render_template('inventory/low_stock.html', products=products)
 
 
+# Reorder suggestions
+@inventory_bp.route('/reorder')
+def reorder():
+    """Reorder suggestions by supplier from the last batch run"""
+    show_all = request.args.get('all') == '1'
+    groups = Replenishment.by_supplier(include_all=show_all)
+    
+    if request.args.get('format') == 'csv':
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(['Supplier', 'Product', 'Code', 'Stock', 'Unit', 'Avg Daily Sales',
+                         'Smoothed Daily Sales', 'Days of Cover', 'Reorder Point',
+                         'Suggested Qty', 'Est. Cost'])
+        for group in groups:
+            for item in group['items']:
+                s = item['suggestion']
+                writer.writerow([group['supplier'], item['name'], item['code'] or '',
+                                 s.current_stock, item['unit'], s.avg_daily_sales,
+                                 s.smoothed_daily_sales,
+                                 '' if s.days_of_cover is None else s.days_of_cover,
+                                 s.reorder_point, s.suggested_quantity, item['value']])
+        
+        return Response(
+            output.getvalue(),
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename=reorder_{date.today()}.csv'}
+        )
+    
+    return render_template('inventory/reorder.html',
+                          groups=groups,
+                          show_all=show_all,
+                          total_value=sum((g['value'] for g in groups), Decimal('0')),
+                          item_count=sum(len(g['items']) for g in groups),
+                          computed_at=Replenishment.last_run(),
+                          history_days=Config.REORDER_HISTORY_DAYS,
+                          lead_days=Config.REORDER_LEAD_DAYS,
+                          cover_days=Config.REORDER_COVER_DAYS)
+
+
+@inventory_bp.route('/reorder/recalculate', methods=['POST'])
+def recalculate_reorder():
+    """Run the reorder batch now"""
+    try:
+        count = Replenishment.compute()
+        flash(f'Reorder suggestions recalculated for {count} products', 'success')
+    except Exception as e:
+        flash(f'Error calculating reorder suggestions: {str(e)}', 'error')
+    
+    return redirect(url_for('inventory.reorder'))
+
+
 # Stock valuation report
 @inventory_bp.route('/valuation')
 def valuation():
     """Stock valuation report"""
-    products = Product.query.filter_by(is_active=True).order_by(Product.name).all()
+    categories = InventoryValuation.by_category()
+    total_value = sum((c['value'] for c in categories), Decimal('0'))
+    total_products = sum(c['products'] for c in categories)
     
-    total_value = Decimal('0')
-    items = []
-    for p in products:
-        value = Decimal(str(p.current_stock or 0)) * Decimal(str(p.cost_price or 0))
-        items.append({
-            'product': p,
-            'value': value
-        })
-        total_value += value
+    return stream_template('inventory/valuation.html',
+                           items=InventoryValuation.detail(),
+                           categories=categories,
+                           total_products=total_products,
+                           total_value=total_value)
+
+
+@inventory_bp.route('/costing/rebuild', methods=['POST'])
+def rebuild_costing():
+    """Re-cost all stock movements from the movement history"""
+    try:
+        count = CostingEngine.rebuild()
+        flash(f'Stock costing rebuilt for {count} products', 'success')
+    except Exception as e:
+        flash(f'Error rebuilding stock costing: {str(e)}', 'error')
     
-    return render_template('inventory/valuation.html', items=items, total_value=total_value)
+    return redirect(url_for('inventory.valuation'))
+
+
+# Stock as on a date
+@inventory_bp.route('/stock-as-of')
+def stock_as_of():
+    """Closing stock statement as on a date"""
+    as_of = parse_date(request.args.get('date')) or date.today()
+    
+    rows = StockSnapshots.statement(as_of)
+    
+    if request.args.get('format') == 'csv':
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(['Category', 'Product', 'Code', 'HSN', 'Quantity', 'Unit', 'Unit Cost', 'Value'])
+        for r in rows:
+            writer.writerow([r['category'], r['name'], r['code'] or '', r['hsn_code'] or '',
+                             r['quantity'], r['unit'], r['unit_cost'], r['value']])
+        writer.writerow(['TOTAL', '', '', '', '', '', '', sum(r['value'] for r in rows)])
+        
+        return Response(
+            output.getvalue(),
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename=closing_stock_{as_of}.csv'}
+        )
+    
+    categories = {}
+    for r in rows:
+        categories[r['category']] = categories.get(r['category'], Decimal('0')) + r['value']
+    
+    fy_start, _ = get_fy_date_range()
+    
+    return render_template('inventory/stock_as_of.html',
+                          rows=rows,
+                          categories=categories,
+                          total_value=sum(categories.values(), Decimal('0')),
+                          as_of=as_of.isoformat(),
+                          last_month_end=(date.today().replace(day=1) - timedelta(days=1)).isoformat(),
+                          last_fy_end=(fy_start - timedelta(days=1)).isoformat())
 
 
 # API
@@ -268,3 +421,21 @@ def api_search():
         'unit': p.unit,
         'stock': float(p.current_stock or 0)
     } for p in products])
+
+
+@inventory_bp.route('/api/stock-as-of')
+def api_stock_as_of():
+    """Stock quantity and value of products as on a date"""
+    as_of = parse_date(request.args.get('date')) or date.today()
+    product_ids = request.args.getlist('product_id', type=int)
+    
+    positions = StockSnapshots.positions(as_of, product_ids or None)
+    
+    return jsonify({
+        'date': as_of.isoformat(),
+        'products': [{
+            'id': product_id,
+            'quantity': float(quantity),
+            'value': float(value)
+        } for product_id, (quantity, value) in positions.items()]
+    })
@@ -11,6 +11,9 @@ from app.ledgers import ledgers_bp
 from app.models.base import db
 from app.models.party import Party, PartyTransaction
 from app.models.accounting import CashTransaction, BankTransaction
+from app.services.archive import FinancialYearArchive
+from app.services.settlement import SettlementEngine
+from app.services.importer import BulkImporter, IMPORT_KINDS
 from config.settings import Config
 
 
@@ -113,6 +116,36 @@ def add():
     return render_template('ledgers/add.html', state_codes=Config.STATE_CODES)
 
 
+@ledgers_bp.route('/import', methods=['GET', 'POST'])
+def import_parties():
+    """Import customers and suppliers from CSV/XLSX"""
+    if request.args.get('template'):
+        return Response(
+            BulkImporter.template_csv('parties'),
+            mimetype='text/csv',
+            headers={'Content-Disposition': 'attachment; filename=parties_import.csv'}
+        )
+    
+    result = None
+    if request.method == 'POST':
+        file = request.files.get('file')
+        if not file or not file.filename:
+            flash('Choose a CSV or XLSX file to import', 'error')
+        else:
+            try:
+                result = BulkImporter.import_file('parties', file, dry_run=bool(request.form.get('dry_run')))
+            except Exception as e:
+                flash(f'Error importing file: {str(e)}', 'error')
+    
+    return render_template('import.html',
+                          kinds=[('parties', 'Customers & Suppliers')],
+                          kind='parties',
+                          columns=IMPORT_KINDS['parties'],
+                          result=result,
+                          action=url_for('ledgers.import_parties'),
+                          back=url_for('ledgers.index'))
+
+
 @ledgers_bp.route('/<int:id>')
 def view(id):
     """View party ledger"""
@@ -122,17 +155,26 @@ def view(id):
     date_from = request.args.get('date_from')
     date_to = request.args.get('date_to')
     
-    query = PartyTransaction.query.filter_by(party_id=id)
+    ledger = FinancialYearArchive.span(PartyTransaction, date_from, date_to)
+    query = db.session.query(ledger).filter(ledger.party_id == id)
     
     if date_from:
-        query = query.filter(PartyTransaction.transaction_date >= date_from)
+        query = query.filter(ledger.transaction_date >= date_from)
     if date_to:
-        query = query.filter(PartyTransaction.transaction_date <= date_to)
+        query = query.filter(ledger.transaction_date <= date_to)
+    
+    transactions = query.order_by(ledger.transaction_date.desc(), 
+                                  ledger.id.desc()).all()
     
-    transactions = query.order_by(PartyTransaction.transaction_date.desc(), 
-                                  PartyTransaction.id.desc()).all()
+    open_invoices = []
+    if party.party_type == 'customer':
+        open_invoices = SettlementEngine.open_invoices(id)
     
-    return render_template('ledgers/view.html', party=party, transactions=transactions)
+    return render_template('ledgers/view.html',
+                          party=party,
+                          transactions=transactions,
+                          open_invoices=open_invoices,
+                          today=date.today().isoformat())
 
 
 @ledgers_bp.route('/<int:id>/edit', methods=['GET', 'POST'])
@@ -199,6 +241,13 @@ def receive_payment(id):
             narration=notes or f'Payment received via {payment_mode}'
         )
         db.session.add(txn)
+        db.session.flush()
+        
+        # Settle open invoices (FIFO unless specific invoices were picked)
+        invoice_ids = request.form.getlist('invoice_ids', type=int)
+        allocated, unallocated = SettlementEngine.allocate_receipt(
+            id, txn.id, amount, payment_date, invoice_ids=invoice_ids
+        )
         
         # Update party balance
         party.update_balance(amount, 'credit')
@@ -229,7 +278,10 @@ def receive_payment(id):
         
         db.session.commit()
         
-        flash(f'Payment of ₹{amount} received successfully', 'success')
+        if unallocated > 0:
+            flash(f'Payment of ₹{amount} received; ₹{unallocated} kept on account', 'success')
+        else:
+            flash(f'Payment of ₹{amount} received successfully', 'success')
     
     except Exception as e:
         db.session.rollback()
@@ -305,6 +357,23 @@ def make_payment(id):
     return redirect(url_for('ledgers.view', id=id))
 
 
+@ledgers_bp.route('/reallocate-receipts', methods=['POST'])
+def reallocate_receipts():
+    """Rebuild receipt-to-invoice settlement from ledger history"""
+    party_id = request.form.get('party_id', type=int)
+    
+    try:
+        count = SettlementEngine.reallocate([party_id] if party_id else None)
+        flash(f'Receipts re-allocated for {count} customer(s)', 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error re-allocating receipts: {str(e)}', 'error')
+    
+    if party_id:
+        return redirect(url_for('ledgers.view', id=party_id))
+    return redirect(url_for('ledgers.index', type='customer'))
+
+
 @ledgers_bp.route('/<int:id>/export')
 def export_ledger(id):
     """Export party ledger to CSV"""
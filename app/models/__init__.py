@@ -4,7 +4,7 @@ BillPro Database Models
 from app.models.base import db
 from app.models.product import Product, ProductCategory
 from app.models.party import Party, PartyTransaction
-from app.models.invoice import Invoice, InvoiceItem
+from app.models.invoice import Invoice, InvoiceItem, PaymentAllocation
 from app.models.purchase import Purchase, PurchaseItem
 from app.models.accounting import (
     Expense, ExpenseCategory, JournalEntry, 
@@ -17,7 +17,7 @@ __all__ = [
     'db',
     'Product', 'ProductCategory',
     'Party', 'PartyTransaction',
-    'Invoice', 'InvoiceItem',
+    'Invoice', 'InvoiceItem', 'PaymentAllocation',
     'Purchase', 'PurchaseItem',
     'Expense', 'ExpenseCategory', 'JournalEntry',
     'CashTransaction', 'BankTransaction',
@@ -19,6 +19,7 @@ class FinancialYear(db.Model):
     
     is_active = db.Column(db.Boolean, default=False)
     is_closed = db.Column(db.Boolean, default=False)
+    archived_at = db.Column(db.DateTime)  # Documents moved to the FY archive database
     
     # Counter for invoice numbering
     invoice_counter = db.Column(db.Integer, default=0)
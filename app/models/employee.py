@@ -2,10 +2,64 @@
 Employee and Payroll Models
 """
 from datetime import datetime
-from decimal import Decimal
+from decimal import Decimal, ROUND_HALF_UP
 from app.models.base import db
 
 
+def calculate_salary_components(emp, total_working_days, days_worked, days_absent,
+                                overtime=0, bonus=0, loan_deduction=0, tds=0):
+    """
+    Calculate salary slip amounts from employee master values.
+    emp can be an Employee or any row with the same salary columns.
+    Uses exact Decimal arithmetic rounded to paise.
+    """
+    def d(value):
+        return Decimal(str(value or 0))
+    
+    def paise(value):
+        return value.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    
+    total_days = Decimal(total_working_days)
+    worked = Decimal(days_worked)
+    
+    # Prorated amounts based on days worked
+    def prorate(value):
+        return paise(d(value) * worked / total_days)
+    
+    basic_salary = prorate(emp.basic_salary)
+    hra = prorate(emp.hra)
+    da = prorate(emp.da)
+    other_allowances = prorate(emp.other_allowances)
+    
+    gross_salary = basic_salary + hra + da + other_allowances + d(overtime) + d(bonus)
+    
+    # Deductions
+    pf_deduction = prorate(emp.pf_deduction)
+    esi_deduction = prorate(emp.esi_deduction)
+    other_deductions = d(loan_deduction) + d(emp.other_deductions)
+    
+    # Absent deduction at the full-month day rate
+    master_gross = d(emp.basic_salary) + d(emp.hra) + d(emp.da) + d(emp.other_allowances)
+    absent_deduction = paise(Decimal(days_absent) * master_gross / total_days)
+    
+    total_deductions = (pf_deduction + esi_deduction + d(tds) + other_deductions +
+                        absent_deduction)
+    
+    return {
+        'basic_salary': basic_salary,
+        'hra': hra,
+        'da': da,
+        'other_allowances': other_allowances,
+        'gross_salary': gross_salary,
+        'pf_deduction': pf_deduction,
+        'esi_deduction': esi_deduction,
+        'other_deductions': other_deductions,
+        'absent_deduction': absent_deduction,
+        'total_deductions': total_deductions,
+        'net_salary': gross_salary - total_deductions,
+    }
+
+
 class Employee(db.Model):
     """Employee master"""
     __tablename__ = 'employees'
@@ -86,6 +140,9 @@ class Employee(db.Model):
 class SalarySlip(db.Model):
     """Monthly salary slips"""
     __tablename__ = 'salary_slips'
+    __table_args__ = (
+        db.Index('ix_salary_slips_period', 'salary_year', 'salary_month'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     
@@ -129,6 +186,7 @@ class SalarySlip(db.Model):
     
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     def __repr__(self):
         return f'<SalarySlip {self.employee.name} {self.salary_month}/{self.salary_year}>'
@@ -144,31 +202,10 @@ class SalarySlip(db.Model):
         if emp is None:
             return
         
-        # Calculate day rate
-        day_rate = float(emp.gross_salary) / self.total_working_days
-        
-        # Prorated amounts based on days worked
-        ratio = self.days_worked / self.total_working_days
-        
-        self.basic_salary = Decimal(str(float(emp.basic_salary or 0) * ratio))
-        self.hra = Decimal(str(float(emp.hra or 0) * ratio))
-        self.da = Decimal(str(float(emp.da or 0) * ratio))
-        self.other_allowances = Decimal(str(float(emp.other_allowances or 0) * ratio))
-        
-        self.gross_salary = self.basic_salary + self.hra + self.da + self.other_allowances + \
-                           Decimal(str(self.overtime or 0)) + Decimal(str(self.bonus or 0))
-        
-        # Deductions
-        self.pf_deduction = Decimal(str(float(emp.pf_deduction or 0) * ratio))
-        self.esi_deduction = Decimal(str(float(emp.esi_deduction or 0) * ratio))
-        self.other_deductions = Decimal(str(self.loan_deduction or 0)) + \
-                               Decimal(str(emp.other_deductions or 0))
-        
-        # Absent deduction
-        self.absent_deduction = Decimal(str(self.days_absent * day_rate))
-        
-        self.total_deductions = (self.pf_deduction + self.esi_deduction + 
-                                Decimal(str(self.tds or 0)) + self.other_deductions +
-                                self.absent_deduction)
-        
-        self.net_salary = self.gross_salary - self.total_deductions
+        values = calculate_salary_components(
+            emp, self.total_working_days, self.days_worked, self.days_absent,
+            overtime=self.overtime, bonus=self.bonus,
+            loan_deduction=self.loan_deduction, tds=self.tds
+        )
+        for key, value in values.items():
+            setattr(self, key, value)
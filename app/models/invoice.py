@@ -9,6 +9,14 @@ from app.models.base import db
 class Invoice(db.Model):
     """Sales invoice header"""
     __tablename__ = 'invoices'
+    __table_args__ = (
+        # Open items: only unpaid invoices are indexed, so outstanding
+        # lookups stay cheap however many paid invoices accumulate
+        db.Index('ix_invoices_open_items', 'party_id', 'invoice_date',
+                 sqlite_where=db.text("amount_due > 0 AND status = 'ACTIVE'")),
+        # Period reports start from the invoices dated in the period
+        db.Index('ix_invoices_date', 'invoice_date'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     
@@ -162,3 +170,26 @@ class InvoiceItem(db.Model):
             self.igst_amount = 0
         
         self.total_amount = taxable + self.cgst_amount + self.sgst_amount + self.igst_amount
+
+
+class PaymentAllocation(db.Model):
+    """Receipt amounts applied against sales invoices"""
+    __tablename__ = 'payment_allocations'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    
+    # Receipt (party ledger credit) and the invoice it settles
+    party_transaction_id = db.Column(db.Integer, db.ForeignKey('party_transactions.id'),
+                                     nullable=False, index=True)
+    invoice_id = db.Column(db.Integer, db.ForeignKey('invoices.id'), nullable=False, index=True)
+    party_id = db.Column(db.Integer, db.ForeignKey('parties.id'), nullable=False, index=True)
+    
+    amount = db.Column(db.Numeric(15, 2), nullable=False)
+    allocation_date = db.Column(db.Date, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    invoice = db.relationship('Invoice', backref=db.backref('allocations', lazy='dynamic'))
+    
+    def __repr__(self):
+        return f'<PaymentAllocation {self.invoice_id} Rs.{self.amount}>'
@@ -85,6 +85,10 @@ class Party(db.Model):
 class PartyTransaction(db.Model):
     """Ledger entries for parties"""
     __tablename__ = 'party_transactions'
+    __table_args__ = (
+        # Receipts still on account are looked up per party when invoicing
+        db.Index('ix_party_transactions_party', 'party_id', 'transaction_type'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     party_id = db.Column(db.Integer, db.ForeignKey('parties.id'), nullable=False)
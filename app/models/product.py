@@ -1,7 +1,7 @@
 """
 Product and Inventory Models
 """
-from datetime import datetime
+from datetime import date, datetime
 from app.models.base import db
 
 
@@ -47,6 +47,11 @@ class Product(db.Model):
     low_stock_threshold = db.Column(db.Numeric(12, 3), default=10)  # Alert threshold
     unit = db.Column(db.String(20), default='PCS')  # UOM: PCS, KG, LTR, etc.
     
+    # Costing
+    costing_method = db.Column(db.String(10), default='WAVG')  # WAVG, FIFO
+    average_cost = db.Column(db.Numeric(12, 4))  # Cost per unit of stock on hand
+    cost_value = db.Column(db.Numeric(15, 4))  # Stock on hand at cost
+    
     # Status
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -67,6 +72,8 @@ class Product(db.Model):
     @property
     def stock_value(self):
         """Calculate inventory value at cost"""
+        if self.cost_value is not None:
+            return float(self.cost_value)
         return float(self.current_stock or 0) * float(self.cost_price or 0)
     
     def adjust_stock(self, quantity, operation='add'):
@@ -84,6 +91,13 @@ class Product(db.Model):
 class StockMovement(db.Model):
     """Track all stock movements for audit"""
     __tablename__ = 'stock_movements'
+    __table_args__ = (
+        db.Index('ix_stock_movements_product', 'product_id', 'id'),
+        # Sale costs are joined to their invoices by reference
+        db.Index('ix_stock_movements_reference', 'reference_type', 'reference_id'),
+        # Stock positions are summed by product over a range of document dates
+        db.Index('ix_stock_movements_product_date', 'product_id', 'movement_date'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
@@ -98,7 +112,13 @@ class StockMovement(db.Model):
     stock_before = db.Column(db.Numeric(12, 3))
     stock_after = db.Column(db.Numeric(12, 3))
     
+    # Costing: rate of the movement and its signed value (COGS for sales)
+    unit_cost = db.Column(db.Numeric(12, 4))
+    cost_amount = db.Column(db.Numeric(15, 4))
+    
     notes = db.Column(db.Text)
+    # Local date of the source document; created_at is when it was keyed in (UTC)
+    movement_date = db.Column(db.Date, default=date.today)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationship
@@ -106,3 +126,63 @@ class StockMovement(db.Model):
     
     def __repr__(self):
         return f'<StockMovement {self.movement_type} {self.quantity}>'
+
+
+class CostLayer(db.Model):
+    """Open FIFO cost layers (receipts not yet fully issued)"""
+    __tablename__ = 'cost_layers'
+    __table_args__ = (
+        db.Index('ix_cost_layers_product', 'product_id', 'id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    quantity = db.Column(db.Numeric(12, 3), nullable=False)  # Quantity remaining
+    unit_cost = db.Column(db.Numeric(12, 4), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<CostLayer {self.product_id} {self.quantity} @ {self.unit_cost}>'
+
+
+class StockSnapshot(db.Model):
+    """Per-product stock at month ends (only non-zero positions are stored)"""
+    __tablename__ = 'stock_snapshots'
+    __table_args__ = (
+        db.Index('ix_stock_snapshots_date_product', 'snapshot_date', 'product_id', unique=True),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    snapshot_date = db.Column(db.Date, nullable=False)
+    quantity = db.Column(db.Numeric(12, 3), nullable=False)
+    value = db.Column(db.Numeric(15, 4), nullable=False)  # Stock value at cost
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<StockSnapshot {self.product_id} {self.snapshot_date} {self.quantity}>'
+
+
+class ReorderSuggestion(db.Model):
+    """Replenishment figures per product from the last reorder batch"""
+    __tablename__ = 'reorder_suggestions'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False, unique=True)
+    supplier_id = db.Column(db.Integer, db.ForeignKey('parties.id'))  # Last supplier purchased from
+    
+    avg_daily_sales = db.Column(db.Numeric(12, 4), default=0)  # Simple average over the window
+    smoothed_daily_sales = db.Column(db.Numeric(12, 4), default=0)  # Exponentially smoothed
+    current_stock = db.Column(db.Numeric(12, 3), default=0)
+    days_of_cover = db.Column(db.Numeric(10, 1))  # None when nothing is selling
+    reorder_point = db.Column(db.Numeric(12, 3), default=0)
+    suggested_quantity = db.Column(db.Numeric(12, 3), default=0)
+    
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    product = db.relationship('Product')
+    supplier = db.relationship('Party')
+    
+    def __repr__(self):
+        return f'<ReorderSuggestion {self.product_id} {self.suggested_quantity}>'
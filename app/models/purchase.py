@@ -9,12 +9,17 @@ from app.models.base import db
 class Purchase(db.Model):
     """Purchase invoice header"""
     __tablename__ = 'purchases'
+    __table_args__ = (
+        db.Index('ix_purchases_open_items', 'party_id', 'purchase_date',
+                 sqlite_where=db.text("amount_due > 0 AND status = 'ACTIVE'")),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     
     # Purchase Info
     purchase_number = db.Column(db.String(50), unique=True, nullable=False)
     purchase_date = db.Column(db.Date, nullable=False, default=datetime.utcnow().date)
+    due_date = db.Column(db.Date)
     
     # Supplier Invoice
     supplier_invoice_number = db.Column(db.String(50))
@@ -0,0 +1,38 @@
+"""
+Read-only reporting database
+Reports read through their own small pool of read-only connections, so a
+long report never holds a connection or lock the billing path needs.
+"""
+from urllib.request import pathname2url
+
+from sqlalchemy import create_engine, exc
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+
+# Session for report queries; bound to the read-only engine in create_app
+report_session = scoped_session(sessionmaker())
+
+
+def init_report_engine(app):
+    """
+    Create the read-only engine over the live database file. With WAL its
+    readers never block writers; the pool caps how many reports run at once.
+    """
+    uri = 'file:' + pathname2url(app.config['DATABASE_PATH'])
+    engine = create_engine(
+        f'sqlite:///{uri}?mode=ro&uri=true',
+        pool_size=app.config['REPORT_POOL_SIZE'],
+        max_overflow=0,
+        pool_timeout=app.config['REPORT_POOL_TIMEOUT'],
+    )
+    report_session.configure(bind=engine)
+
+    @app.teardown_appcontext
+    def remove_report_session(exception=None):
+        report_session.remove()
+
+    @app.errorhandler(exc.TimeoutError)
+    def reports_busy(error):
+        return 'Too many reports are running. Please try again shortly.', 503
+
+    return engine
@@ -0,0 +1,89 @@
+"""
+Schema upgrades for existing databases
+db.create_all() only creates missing tables; this adds the columns and
+indexes introduced since a database file was first created.
+
+The models' fingerprint is kept in the database's user_version, so the
+checks only run when the models or the database file have changed.
+"""
+import zlib
+
+from sqlalchemy import inspect, text
+
+from app.models.base import db
+
+
+def _column_ddl(column, dialect):
+    """Build the column definition used by ALTER TABLE ADD COLUMN"""
+    ddl = f'{column.name} {column.type.compile(dialect=dialect)}'
+    default = column.default
+    if default is not None and default.is_scalar:
+        value = default.arg
+        if isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, str):
+            value = "'" + value.replace("'", "''") + "'"
+        ddl += f' DEFAULT {value}'
+    return ddl
+
+
+def enable_wal():
+    """Use write-ahead logging so readers, including backups, never block writers"""
+    with db.engine.connect() as conn:
+        conn.exec_driver_sql('PRAGMA journal_mode=WAL')
+
+
+def analyze():
+    """Refresh the planner's statistics so new indexes are actually chosen"""
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql('ANALYZE')
+
+
+def schema_version():
+    """A fingerprint of the models' tables, columns and indexes"""
+    dialect = db.engine.dialect
+    parts = []
+    for table in db.metadata.sorted_tables:
+        parts.append(table.name)
+        parts += sorted(f'{c.name} {c.type.compile(dialect=dialect)}' for c in table.columns)
+        parts += sorted(index.name for index in table.indexes)
+    # user_version is a signed 32-bit integer and 0 means never stamped
+    return zlib.crc32('\n'.join(parts).encode()) & 0x7fffffff or 1
+
+
+def stored_schema_version():
+    with db.engine.connect() as conn:
+        return conn.exec_driver_sql('PRAGMA user_version').scalar()
+
+
+def stamp_schema_version(version):
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql(f'PRAGMA user_version = {int(version)}')
+
+
+def upgrade_schema(engine=None, tables=None):
+    """
+    Add missing columns and indexes to tables that already exist, in the
+    live database or in another engine's database (e.g. a FY archive)
+    """
+    engine = engine or db.engine
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+
+    with engine.begin() as conn:
+        for table in tables or db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+
+            existing_columns = {c['name'] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns or column.primary_key or column.unique:
+                    continue
+                conn.execute(text(
+                    f'ALTER TABLE {table.name} ADD COLUMN {_column_ddl(column, engine.dialect)}'
+                ))
+
+            existing_indexes = {i['name'] for i in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(conn, checkfirst=True)
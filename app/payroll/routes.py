@@ -1,14 +1,18 @@
 """
 Payroll Routes - Employee and Salary Management
 """
-from flask import render_template, request, redirect, url_for, flash
+from flask import (render_template, request, redirect, url_for, flash, jsonify, Response,
+                   stream_with_context, send_file, current_app)
 from datetime import date, datetime
 from decimal import Decimal
+import csv
+import io
 
 from app.payroll import payroll_bp
 from app.models.base import db
 from app.models.employee import Employee, SalarySlip
-from app.models.accounting import Expense, CashTransaction, BankTransaction
+from app.services.payroll import PayrollProcessor, SalaryDisbursement
+from app.services.salary_slip_pdf import SalarySlipPrinter
 
 
 @payroll_bp.route('/')
@@ -139,41 +143,34 @@ def process_payroll():
         year = int(request.form.get('year', today.year))
         total_days = int(request.form.get('total_days', 30))
         
-        employees = Employee.query.filter_by(is_active=True).all()
-        processed = 0
-        
-        for emp in employees:
-            # Check if already processed
-            existing = SalarySlip.query.filter_by(
-                employee_id=emp.id,
-                salary_month=month,
-                salary_year=year
-            ).first()
-            
-            if existing:
+        # Per-employee attendance entries from the form (one pass over the fields)
+        attendance = {}
+        for key, value in request.form.items():
+            field, _, emp_id = key.rpartition('_')
+            if not emp_id.isdigit() or not value:
                 continue
-            
-            days_worked = int(request.form.get(f'days_{emp.id}', total_days))
-            bonus = Decimal(request.form.get(f'bonus_{emp.id}', '0'))
-            loan_deduction = Decimal(request.form.get(f'loan_{emp.id}', '0'))
-            
-            slip = SalarySlip(
-                employee_id=emp.id,
-                salary_month=month,
-                salary_year=year,
-                total_working_days=total_days,
-                days_worked=days_worked,
-                days_absent=total_days - days_worked,
-                bonus=bonus,
-                loan_deduction=loan_deduction
+            entry = attendance.setdefault(int(emp_id), {})
+            if field == 'days':
+                entry['days_worked'] = int(value)
+            elif field == 'bonus':
+                entry['bonus'] = Decimal(value)
+            elif field in ('loan', 'deduction'):
+                entry['loan_deduction'] = Decimal(value)
+        
+        # Only the ticked employees when the form carries per-employee rows
+        employee_ids = request.form.getlist('employee_ids', type=int) if attendance else None
+        
+        try:
+            processed, skipped = PayrollProcessor.process_month(
+                month, year, total_days,
+                attendance=attendance,
+                employee_ids=employee_ids
             )
-            
-            slip.calculate_salary()
-            db.session.add(slip)
-            processed += 1
+            flash(f'Payroll processed for {processed} employees', 'success')
+        except Exception as e:
+            flash(f'Error processing payroll: {str(e)}', 'error')
+            return redirect(url_for('payroll.process_payroll'))
         
-        db.session.commit()
-        flash(f'Payroll processed for {processed} employees', 'success')
         return redirect(url_for('payroll.salary_slips', month=month, year=year))
     
     employees = Employee.query.filter_by(is_active=True).order_by(Employee.name).all()
@@ -184,6 +181,15 @@ def process_payroll():
                           current_year=today.year)
 
 
+@payroll_bp.route('/process/status')
+def process_status():
+    """Progress of the payroll run for a month"""
+    today = date.today()
+    month = request.args.get('month', today.month, type=int)
+    year = request.args.get('year', today.year, type=int)
+    return jsonify(PayrollProcessor.get_progress(month, year))
+
+
 @payroll_bp.route('/salary-slips')
 def salary_slips():
     """View salary slips"""
@@ -205,6 +211,46 @@ def salary_slips():
                           total_paid=total_paid)
 
 
+def _export_args():
+    """Month, year and format of a salary slip export request"""
+    today = date.today()
+    values = request.values
+    fmt = values.get('format', 'zip')
+    if fmt not in SalarySlipPrinter.FORMATS:
+        fmt = 'zip'
+    return (values.get('month', today.month, type=int),
+            values.get('year', today.year, type=int),
+            fmt)
+
+
+@payroll_bp.route('/salary-slips/export', methods=['POST'])
+def export_salary_slips():
+    """Start rendering all of a month's salary slips to PDF"""
+    month, year, fmt = _export_args()
+    return jsonify(SalarySlipPrinter.start(current_app._get_current_object(), month, year, fmt))
+
+
+@payroll_bp.route('/salary-slips/export/status')
+def export_salary_slips_status():
+    """Progress of a salary slip export"""
+    month, year, fmt = _export_args()
+    return jsonify(SalarySlipPrinter.status(month, year, fmt))
+
+
+@payroll_bp.route('/salary-slips/export/download')
+def download_salary_slips():
+    """Download the rendered salary slips"""
+    month, year, fmt = _export_args()
+    path = SalarySlipPrinter.output(month, year, fmt)
+    
+    if not path:
+        flash('Salary slip export is not ready or the slips have changed since', 'warning')
+        return redirect(url_for('payroll.salary_slips', month=month, year=year))
+    
+    return send_file(path, as_attachment=True,
+                     download_name=f'salary_slips_{year}_{month:02d}.{fmt}')
+
+
 @payroll_bp.route('/salary-slips/<int:id>')
 def view_salary_slip(id):
     """View individual salary slip"""
@@ -239,53 +285,68 @@ def pay_salary(id):
         return redirect(url_for('payroll.view_salary_slip', id=id))
     
     try:
-        payment_mode = request.form.get('payment_mode', 'BANK')
-        reference = request.form.get('reference', '')
-        
-        slip.is_paid = True
-        slip.payment_date = date.today()
-        slip.payment_mode = payment_mode
-        slip.payment_reference = reference
-        
-        # Create expense entry
-        expense = Expense(
-            expense_date=date.today(),
-            description=f'Salary - {slip.employee.name} ({slip.salary_month}/{slip.salary_year})',
-            amount=slip.net_salary,
-            payment_mode=payment_mode,
-            reference_number=reference,
-            vendor_name=slip.employee.name
+        paid, _ = SalaryDisbursement.pay_slips(
+            [slip.id],
+            payment_mode=request.form.get('payment_mode', 'BANK'),
+            reference=request.form.get('reference', '')
         )
-        db.session.add(expense)
-        
-        # Create cash/bank entry
-        if payment_mode == 'CASH':
-            cash = CashTransaction(
-                transaction_date=date.today(),
-                transaction_type='PAYMENT',
-                description=f'Salary payment - {slip.employee.name}',
-                payment=slip.net_salary,
-                reference_type='SALARY',
-                reference_id=slip.id
-            )
-            db.session.add(cash)
+        if paid:
+            flash(f'Salary of ₹{slip.net_salary} paid to {slip.employee.name}', 'success')
         else:
-            bank = BankTransaction(
-                transaction_date=date.today(),
-                transaction_type='WITHDRAWAL',
-                description=f'Salary payment - {slip.employee.name}',
-                withdrawal=slip.net_salary,
-                reference_type='SALARY',
-                reference_id=slip.id
-            )
-            db.session.add(bank)
-        
-        db.session.commit()
-        
-        flash(f'Salary of ₹{slip.net_salary} paid to {slip.employee.name}', 'success')
+            flash('Salary already paid', 'warning')
     
     except Exception as e:
-        db.session.rollback()
         flash(f'Error processing payment: {str(e)}', 'error')
     
     return redirect(url_for('payroll.view_salary_slip', id=id))
+
+
+@payroll_bp.route('/salary-slips/pay', methods=['POST'])
+def pay_salaries():
+    """Pay the selected salary slips in one go"""
+    month = request.form.get('month', type=int)
+    year = request.form.get('year', type=int)
+    slip_ids = request.form.getlist('slip_ids', type=int)
+    
+    if not slip_ids:
+        flash('Select the salary slips to pay', 'warning')
+        return redirect(url_for('payroll.salary_slips', month=month, year=year))
+    
+    try:
+        paid, total = SalaryDisbursement.pay_slips(
+            slip_ids,
+            payment_mode=request.form.get('payment_mode', 'BANK'),
+            reference=request.form.get('reference', '')
+        )
+        flash(f'Paid ₹{total} salary to {paid} employees', 'success')
+    
+    except Exception as e:
+        flash(f'Error processing payment: {str(e)}', 'error')
+    
+    return redirect(url_for('payroll.salary_slips', month=month, year=year))
+
+
+@payroll_bp.route('/salary-slips/bank-file')
+def salary_bank_file():
+    """Download the NEFT/RTGS bulk upload file for a month"""
+    today = date.today()
+    month = request.args.get('month', today.month, type=int)
+    year = request.args.get('year', today.year, type=int)
+    slip_ids = request.args.getlist('slip_ids', type=int)
+    
+    def generate():
+        output = io.StringIO()
+        writer = csv.writer(output)
+        for row in SalaryDisbursement.bank_transfer_rows(month, year, slip_ids):
+            writer.writerow(row)
+            if output.tell() > 65536:
+                yield output.getvalue()
+                output.seek(0)
+                output.truncate()
+        yield output.getvalue()
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename=salary_transfer_{year}_{month:02d}.csv'}
+    )
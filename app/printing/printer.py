@@ -6,6 +6,7 @@ import json
 import os
 from datetime import datetime
 from config.settings import Config
+from app.services.metrics import Metrics
 
 
 class ThermalPrinter:
@@ -112,12 +113,15 @@ class ThermalPrinter:
             company = self._load_company()
             
             if isinstance(printer, WindowsPrinter):
-                return self._print_invoice_windows(printer, invoice, company)
+                result = self._print_invoice_windows(printer, invoice, company)
             else:
-                return self._print_invoice_escpos(printer, invoice, company)
+                result = self._print_invoice_escpos(printer, invoice, company)
         except Exception as e:
             print(f"Print error: {str(e)}")
-            return False
+            result = False
+        
+        Metrics.inc('billpro_print_jobs_total', 'ok' if result else 'failed')
+        return result
     
     def _print_invoice_escpos(self, p, invoice, company):
         """Print invoice using ESC/POS commands"""
@@ -5,18 +5,27 @@ import csv
 import io
 from datetime import date
 from flask import render_template, request, Response, make_response
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.lib.units import inch, mm
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 
 from app.reports import reports_bp
-from app.models.base import db
 from app.models.invoice import Invoice
 from app.models.purchase import Purchase
 from app.models.party import Party, PartyTransaction
 from app.models.product import Product
+from app.models.reporting import report_session
+from app.services.ageing import AgeingReport
+from app.services.archive import FinancialYearArchive
+from app.services.costing import CostingEngine
+from app.utils.date_utils import parse_date
+
+
+def _sales_invoices(date_from, date_to):
+    """Active invoices in a period, including archived years"""
+    invoice = FinancialYearArchive.span(Invoice, date_from, date_to)
+    return report_session.query(invoice).filter(
+        invoice.invoice_date >= date_from,
+        invoice.invoice_date <= date_to,
+        invoice.status == 'ACTIVE'
+    ).order_by(invoice.invoice_date, invoice.id).all()
 
 
 @reports_bp.route('/')
@@ -31,11 +40,7 @@ def sales_report():
     date_from = request.args.get('date_from', date.today().replace(day=1).isoformat())
     date_to = request.args.get('date_to', date.today().isoformat())
     
-    invoices = Invoice.query.filter(
-        Invoice.invoice_date >= date_from,
-        Invoice.invoice_date <= date_to,
-        Invoice.status == 'ACTIVE'
-    ).order_by(Invoice.invoice_date).all()
+    invoices = _sales_invoices(date_from, date_to)
     
     totals = {
         'count': len(invoices),
@@ -57,11 +62,7 @@ def sales_report_csv():
     date_from = request.args.get('date_from', date.today().replace(day=1).isoformat())
     date_to = request.args.get('date_to', date.today().isoformat())
     
-    invoices = Invoice.query.filter(
-        Invoice.invoice_date >= date_from,
-        Invoice.invoice_date <= date_to,
-        Invoice.status == 'ACTIVE'
-    ).order_by(Invoice.invoice_date).all()
+    invoices = _sales_invoices(date_from, date_to)
     
     output = io.StringIO()
     writer = csv.writer(output)
@@ -95,14 +96,16 @@ def sales_report_csv():
 @reports_bp.route('/sales-report/pdf')
 def sales_report_pdf():
     """Export sales report to PDF"""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib import colors
+    from reportlab.lib.units import mm
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    
     date_from = request.args.get('date_from', date.today().replace(day=1).isoformat())
     date_to = request.args.get('date_to', date.today().isoformat())
     
-    invoices = Invoice.query.filter(
-        Invoice.invoice_date >= date_from,
-        Invoice.invoice_date <= date_to,
-        Invoice.status == 'ACTIVE'
-    ).order_by(Invoice.invoice_date).all()
+    invoices = _sales_invoices(date_from, date_to)
     
     buffer = io.BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=A4, leftMargin=15*mm, rightMargin=15*mm)
@@ -179,11 +182,12 @@ def gst_report():
     date_to = request.args.get('date_to', date.today().isoformat())
     
     # Sales GST
-    sales = Invoice.query.filter(
-        Invoice.invoice_date >= date_from,
-        Invoice.invoice_date <= date_to,
-        Invoice.status == 'ACTIVE',
-        Invoice.is_gst_invoice == True
+    invoice = FinancialYearArchive.span(Invoice, date_from, date_to)
+    sales = report_session.query(invoice).filter(
+        invoice.invoice_date >= date_from,
+        invoice.invoice_date <= date_to,
+        invoice.status == 'ACTIVE',
+        invoice.is_gst_invoice == True
     ).all()
     
     sales_summary = {
@@ -195,11 +199,12 @@ def gst_report():
     }
     
     # Purchase GST (Input Credit)
-    purchases = Purchase.query.filter(
-        Purchase.purchase_date >= date_from,
-        Purchase.purchase_date <= date_to,
-        Purchase.status == 'ACTIVE',
-        Purchase.is_gst_invoice == True
+    purchase = FinancialYearArchive.span(Purchase, date_from, date_to)
+    purchases = report_session.query(purchase).filter(
+        purchase.purchase_date >= date_from,
+        purchase.purchase_date <= date_to,
+        purchase.status == 'ACTIVE',
+        purchase.is_gst_invoice == True
     ).all()
     
     purchase_summary = {
@@ -229,7 +234,7 @@ def gst_report():
 @reports_bp.route('/receivables')
 def receivables_report():
     """Receivables (Debtors) Report"""
-    customers = Party.query.filter(
+    customers = report_session.query(Party).filter(
         Party.party_type == 'customer',
         Party.is_active == True,
         Party.current_balance > 0
@@ -245,7 +250,7 @@ def receivables_report():
 @reports_bp.route('/payables')
 def payables_report():
     """Payables (Creditors) Report"""
-    suppliers = Party.query.filter(
+    suppliers = report_session.query(Party).filter(
         Party.party_type == 'supplier',
         Party.is_active == True,
         Party.current_balance > 0
@@ -258,6 +263,61 @@ def payables_report():
                           total=total)
 
 
+def _ageing_csv(ageing, party_label, filename):
+    """Build a CSV response for an ageing report"""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    
+    writer.writerow([party_label, 'Phone', 'GSTIN', 'Documents'] + ageing['labels'] + ['Total', 'Oldest (days)'])
+    for p in ageing['parties']:
+        writer.writerow([p['name'], p['phone'] or '', p['gstin'] or '', p['documents']] +
+                        [float(b) for b in p['buckets']] + [float(p['total']), p['oldest_days']])
+    writer.writerow(['TOTAL', '', '', ''] + [float(b) for b in ageing['totals']['buckets']] +
+                    [float(ageing['totals']['total']), ''])
+    
+    output.seek(0)
+    
+    return Response(
+        output.getvalue(),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}_{ageing["as_of"]}.csv'}
+    )
+
+
+@reports_bp.route('/receivables/ageing')
+def receivables_ageing():
+    """Receivables ageing by customer"""
+    as_of = parse_date(request.args.get('as_of')) or date.today()
+    ageing = AgeingReport.receivables(as_of)
+    
+    if request.args.get('format') == 'csv':
+        return _ageing_csv(ageing, 'Customer', 'receivables_ageing')
+    
+    return render_template('reports/ageing.html',
+                          ageing=ageing,
+                          title='Receivables Ageing',
+                          party_label='Customer',
+                          endpoint='reports.receivables_ageing',
+                          as_of=as_of.isoformat())
+
+
+@reports_bp.route('/payables/ageing')
+def payables_ageing():
+    """Payables ageing by supplier"""
+    as_of = parse_date(request.args.get('as_of')) or date.today()
+    ageing = AgeingReport.payables(as_of)
+    
+    if request.args.get('format') == 'csv':
+        return _ageing_csv(ageing, 'Supplier', 'payables_ageing')
+    
+    return render_template('reports/ageing.html',
+                          ageing=ageing,
+                          title='Payables Ageing',
+                          party_label='Supplier',
+                          endpoint='reports.payables_ageing',
+                          as_of=as_of.isoformat())
+
+
 @reports_bp.route('/product-sales')
 def product_sales_report():
     """Product-wise sales report"""
@@ -267,21 +327,28 @@ def product_sales_report():
     from app.models.invoice import InvoiceItem
     from sqlalchemy import func
     
+    invoice = FinancialYearArchive.span(Invoice, date_from, date_to)
+    item = FinancialYearArchive.span(InvoiceItem, date_from, date_to)
+    
     # Product-wise sales
-    results = db.session.query(
+    results = report_session.query(
+        Product.id,
         Product.name,
         Product.hsn_code,
-        func.sum(InvoiceItem.quantity).label('total_qty'),
-        func.sum(InvoiceItem.taxable_amount).label('total_amount')
-    ).join(InvoiceItem, Product.id == InvoiceItem.product_id)\
-     .join(Invoice, InvoiceItem.invoice_id == Invoice.id)\
+        func.sum(item.quantity).label('total_qty'),
+        func.sum(item.taxable_amount).label('total_amount')
+    ).join(item, Product.id == item.product_id)\
+     .join(invoice, item.invoice_id == invoice.id)\
      .filter(
-        Invoice.invoice_date >= date_from,
-        Invoice.invoice_date <= date_to,
-        Invoice.status == 'ACTIVE'
-    ).group_by(Product.id).order_by(func.sum(InvoiceItem.taxable_amount).desc()).all()
+        invoice.invoice_date >= date_from,
+        invoice.invoice_date <= date_to,
+        invoice.status == 'ACTIVE'
+    ).group_by(Product.id).order_by(func.sum(item.taxable_amount).desc()).all()
+    
+    cogs = CostingEngine.cogs_by_product(date_from, date_to)
     
     return render_template('reports/product_sales.html',
                           results=results,
+                          cogs=cogs,
                           date_from=date_from,
                           date_to=date_to)
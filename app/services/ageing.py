@@ -0,0 +1,127 @@
+"""
+Ageing Service
+Receivables and payables ageing from open invoice balances
+"""
+from datetime import date
+from decimal import Decimal
+from sqlalchemy import func, case, select, text
+
+from app.models.base import db
+from app.models.reporting import report_session
+from app.models.invoice import Invoice, PaymentAllocation
+from app.models.purchase import Purchase
+from app.models.party import Party
+
+
+# Bucket label, lower bound, upper bound (days past due; not-yet-due counts as 0-30)
+AGEING_BUCKETS = (
+    ('0-30', None, 30),
+    ('31-60', 31, 60),
+    ('61-90', 61, 90),
+    ('90+', 91, None),
+)
+
+# Written as literal SQL so SQLite can match them against the partial
+# open-items indexes (bound parameters would prevent that)
+OPEN_INVOICES = text("invoices.amount_due > 0 AND invoices.status = 'ACTIVE'")
+OPEN_PURCHASES = text("purchases.amount_due > 0 AND purchases.status = 'ACTIVE'")
+
+
+class AgeingReport:
+    """Outstanding balances per party split into ageing buckets"""
+
+    @staticmethod
+    def backfill_due_dates():
+        """Set due_date on credit documents saved before due dates were tracked"""
+        for table, date_column in (('invoices', 'invoice_date'), ('purchases', 'purchase_date')):
+            db.session.execute(text(f"""
+                UPDATE {table}
+                SET due_date = date({date_column}, '+' || COALESCE(
+                    (SELECT credit_days FROM parties WHERE parties.id = {table}.party_id), 0
+                ) || ' days')
+                WHERE due_date IS NULL AND payment_mode = 'CREDIT'
+            """))
+        db.session.commit()
+
+    @classmethod
+    def receivables(cls, as_of=None):
+        """
+        Customer ageing from open sales invoices. For a past date the balance
+        is rebuilt from the receipts allocated on or before it, since
+        amount_due already reflects later ones.
+        """
+        if as_of is None or as_of >= date.today():
+            return cls._ageing(Invoice, Invoice.invoice_date, OPEN_INVOICES, as_of)
+
+        paid = select(func.coalesce(func.sum(PaymentAllocation.amount), 0)).where(
+            PaymentAllocation.invoice_id == Invoice.id,
+            PaymentAllocation.allocation_date <= as_of
+        ).scalar_subquery()
+        credit_invoices = db.and_(Invoice.status == 'ACTIVE', Invoice.payment_mode == 'CREDIT')
+        return cls._ageing(Invoice, Invoice.invoice_date, credit_invoices, as_of,
+                           balance=Invoice.total_amount - paid)
+
+    @classmethod
+    def payables(cls, as_of=None):
+        """Supplier ageing from open purchase invoices (purchases are settled only when saved)"""
+        return cls._ageing(Purchase, Purchase.purchase_date, OPEN_PURCHASES, as_of)
+
+    @staticmethod
+    def _ageing(model, date_column, open_filter, as_of, balance=None):
+        """One grouped query over the open items of a document table"""
+        as_of = as_of or date.today()
+        if balance is None:
+            balance = model.amount_due
+        else:
+            open_filter = db.and_(open_filter, balance > 0)
+        days = func.julianday(as_of.isoformat()) - \
+            func.julianday(func.coalesce(model.due_date, date_column))
+
+        bucket_sums = []
+        for _, low, high in AGEING_BUCKETS:
+            conditions = []
+            if low is not None:
+                conditions.append(days >= low)
+            if high is not None:
+                conditions.append(days <= high)
+            bucket_sums.append(func.sum(case((db.and_(*conditions), balance), else_=0)))
+
+        rows = report_session.query(
+            Party.id,
+            Party.name,
+            Party.phone,
+            Party.gstin,
+            func.count(model.id),
+            func.sum(balance),
+            func.max(days),
+            *bucket_sums
+        ).join(Party, model.party_id == Party.id)\
+         .filter(open_filter, date_column <= as_of)\
+         .group_by(Party.id)\
+         .order_by(func.sum(balance).desc()).all()
+
+        parties = []
+        totals = {'total': Decimal('0'), 'buckets': [Decimal('0')] * len(AGEING_BUCKETS)}
+
+        for party_id, name, phone, gstin, count, total, max_days, *buckets in rows:
+            buckets = [Decimal(str(b or 0)) for b in buckets]
+            total = Decimal(str(total or 0))
+            parties.append({
+                'party_id': party_id,
+                'name': name,
+                'phone': phone,
+                'gstin': gstin,
+                'documents': count,
+                'total': total,
+                'oldest_days': max(int(max_days or 0), 0),
+                'buckets': buckets,
+            })
+            totals['total'] += total
+            totals['buckets'] = [t + b for t, b in zip(totals['buckets'], buckets)]
+
+        return {
+            'as_of': as_of,
+            'labels': [label for label, _, _ in AGEING_BUCKETS],
+            'parties': parties,
+            'totals': totals,
+        }
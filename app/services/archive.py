@@ -0,0 +1,391 @@
+"""
+Financial Year Archive Service
+Moves a closed financial year's documents into its own SQLite file, which is
+attached read-only so reports can still span every year
+"""
+import os
+import sqlite3
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta
+from urllib.request import pathname2url
+
+from flask import current_app
+from sqlalchemy import MetaData, create_engine, event, select, union_all
+from sqlalchemy.orm import aliased
+
+from app.models.base import db
+from app.models.config import FinancialYear
+from app.models.invoice import Invoice, InvoiceItem, PaymentAllocation
+from app.models.purchase import Purchase, PurchaseItem
+from app.models.party import PartyTransaction
+from app.models.product import StockMovement
+from app.models.accounting import Expense, CashTransaction, BankTransaction, JournalEntry
+from app.services.financial_year import get_fy_from_date
+from app.utils.date_utils import parse_date
+from config.settings import Config
+
+
+# Tables whose rows move to the archive
+ARCHIVED_MODELS = (
+    Invoice, InvoiceItem, Purchase, PurchaseItem, PaymentAllocation,
+    PartyTransaction, StockMovement, Expense, CashTransaction,
+    BankTransaction, JournalEntry,
+)
+
+# Tables archived wholesale by the date of each row
+DATED_TABLES = {
+    'stock_movements': 'movement_date',
+    'expenses': 'expense_date',
+    'cash_transactions': 'transaction_date',
+    'bank_transactions': 'transaction_date',
+    'journal_entries': 'entry_date',
+}
+
+# SQLite's default limit on attached databases
+MAX_ATTACHED = 10
+
+ArchivedYear = namedtuple('ArchivedYear', ['code', 'name', 'schema', 'path', 'start_date', 'end_date'])
+
+_archives = ()
+_archives_lock = threading.Lock()
+
+# Engines whose connections attach the archives
+_engines = []
+
+# Copies of the archived tables qualified with each archive's schema name
+_archive_metadata = MetaData()
+_archive_tables = {}
+
+
+def _archive_path(code):
+    return os.path.join(Config.ARCHIVE_DIR, f'fy_{code}.db')
+
+
+def _attach_archives(dbapi_connection, connection_record):
+    """Attach every registered archive read-only to a new connection"""
+    for archive in _archives:
+        uri = 'file:' + pathname2url(archive.path) + '?mode=ro'
+        dbapi_connection.execute(f'ATTACH DATABASE ? AS {archive.schema}', (uri,))
+
+
+def _archived_table(table, schema):
+    """table as it appears in the archive attached as schema"""
+    key = (schema, table.name)
+    if key not in _archive_tables:
+        _archive_tables[key] = table.to_metadata(_archive_metadata, schema=schema)
+    return _archive_tables[key]
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    return parse_date(value)
+
+
+def _select_ids(conn, fy):
+    """
+    Ids of the rows to archive, per table, read on a connection to the live
+    database. Open invoices and purchases stay live, and so does anything
+    allocated across the boundary: a receipt with money still to apply, or
+    one settling an invoice that stays, keeps its invoices live and the other
+    way round. A table's newest row is never archived, since SQLite would
+    hand its id out again.
+    """
+    start, end = fy.start_date.isoformat(), fy.end_date.isoformat()
+
+    def ids(sql, *params):
+        return {row[0] for row in conn.execute(sql, params)}
+
+    newest = {
+        model.__tablename__: conn.execute(f'SELECT MAX(id) FROM {model.__tablename__}').fetchone()[0]
+        for model in ARCHIVED_MODELS
+    }
+
+    invoices = ids("SELECT id FROM invoices WHERE invoice_date BETWEEN ? AND ? "
+                   "AND (status != 'ACTIVE' OR COALESCE(amount_due, 0) <= 0)", start, end)
+    purchases = ids("SELECT id FROM purchases WHERE purchase_date BETWEEN ? AND ? "
+                    "AND (status != 'ACTIVE' OR COALESCE(amount_due, 0) <= 0)", start, end)
+    ledger = ids("SELECT id FROM party_transactions WHERE transaction_date BETWEEN ? AND ? "
+                 "AND transaction_type != 'RECEIPT'", start, end)
+    receipts = ids("SELECT id FROM party_transactions WHERE transaction_date BETWEEN ? AND ? "
+                   "AND transaction_type = 'RECEIPT'", start, end)
+    receipts -= ids("SELECT pt.id FROM party_transactions pt "
+                    "LEFT JOIN payment_allocations pa ON pa.party_transaction_id = pt.id "
+                    "WHERE pt.transaction_date BETWEEN ? AND ? AND pt.transaction_type = 'RECEIPT' "
+                    "GROUP BY pt.id HAVING COALESCE(SUM(pa.amount), 0) < COALESCE(pt.credit, 0) - 0.005",
+                    start, end)
+
+    invoices.discard(newest['invoices'])
+    purchases.discard(newest['purchases'])
+    ledger.discard(newest['party_transactions'])
+    receipts.discard(newest['party_transactions'])
+
+    allocations = conn.execute(
+        'SELECT id, party_transaction_id, invoice_id FROM payment_allocations '
+        'WHERE invoice_id IN (SELECT id FROM invoices WHERE invoice_date BETWEEN ? AND ?) '
+        'OR party_transaction_id IN (SELECT id FROM party_transactions WHERE transaction_date BETWEEN ? AND ?)',
+        (start, end, start, end)
+    ).fetchall()
+    changed = True
+    while changed:
+        changed = False
+        for _, receipt_id, invoice_id in allocations:
+            if (receipt_id in receipts) != (invoice_id in invoices):
+                receipts.discard(receipt_id)
+                invoices.discard(invoice_id)
+                changed = True
+
+    selected = {
+        'invoices': invoices,
+        'invoice_items': {item_id for item_id, invoice_id in conn.execute(
+            'SELECT id, invoice_id FROM invoice_items WHERE invoice_id IN '
+            '(SELECT id FROM invoices WHERE invoice_date BETWEEN ? AND ?)', (start, end)
+        ) if invoice_id in invoices},
+        'purchases': purchases,
+        'purchase_items': {item_id for item_id, purchase_id in conn.execute(
+            'SELECT id, purchase_id FROM purchase_items WHERE purchase_id IN '
+            '(SELECT id FROM purchases WHERE purchase_date BETWEEN ? AND ?)', (start, end)
+        ) if purchase_id in purchases},
+        'payment_allocations': {allocation_id for allocation_id, _, invoice_id in allocations
+                                if invoice_id in invoices},
+        'party_transactions': ledger | receipts,
+    }
+    for table, column in DATED_TABLES.items():
+        selected[table] = ids(f'SELECT id FROM {table} WHERE {column} BETWEEN ? AND ?',
+                              start, end)
+
+    for table, table_ids in selected.items():
+        table_ids.discard(newest[table])
+    return selected
+
+
+def _fill_ids(conn, selected):
+    """Load the chosen ids into a temp table on conn"""
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS archive_ids '
+                 '(name TEXT NOT NULL, id INTEGER NOT NULL, PRIMARY KEY (name, id))')
+    conn.executemany('INSERT INTO temp.archive_ids VALUES (?, ?)',
+                     ((name, row_id) for name, ids in selected.items() for row_id in ids))
+
+
+class ArchivedRecord:
+    """
+    Read-only view of an archived row. Its child rows are loaded from the
+    same archive, since the model's relationships would query the live tables.
+    """
+
+    def __init__(self, row, archive, **children):
+        self._row = row
+        self.archive = archive
+        self.__dict__.update(children)
+
+    def __getattr__(self, name):
+        return getattr(self._row, name)
+
+
+class FinancialYearArchive:
+    """Closed financial years kept in their own read-only databases"""
+
+    @classmethod
+    def init_app(cls, app, *engines):
+        """Bring archive schemas up to date and attach archives to every
+        connection of the app's engine and any extra engines"""
+        for engine in (db.engine,) + engines:
+            if not event.contains(engine, 'connect', _attach_archives):
+                event.listen(engine, 'connect', _attach_archives)
+                _engines.append(engine)
+        cls.refresh()
+        for archive in _archives:
+            cls._create_tables(archive.path)
+
+    @staticmethod
+    def archives():
+        """Archived years currently attached, newest first"""
+        return _archives
+
+    @staticmethod
+    def refresh():
+        """Reload the archive registry and reconnect so new archives are attached"""
+        global _archives
+        archives = []
+        for fy in FinancialYear.query.filter(FinancialYear.archived_at.isnot(None))\
+                .order_by(FinancialYear.start_date.desc()):
+            path = _archive_path(fy.code)
+            if not os.path.exists(path):
+                current_app.logger.warning(f'Archive for FY {fy.name} is missing: {path}')
+                continue
+            archives.append(ArchivedYear(fy.code, fy.name, f'fy_{fy.code}', path,
+                                         fy.start_date, fy.end_date))
+        if len(archives) > MAX_ATTACHED:
+            current_app.logger.warning(
+                f'Only the newest {MAX_ATTACHED} of {len(archives)} FY archives can be attached')
+            archives = archives[:MAX_ATTACHED]
+
+        with _archives_lock:
+            _archives = tuple(archives)
+        for engine in _engines or [db.engine]:
+            engine.dispose()
+
+    @staticmethod
+    def span(model, date_from=None, date_to=None):
+        """
+        The model itself, or an alias of it over the live table and the
+        archives overlapping date_from..date_to, for querying across years
+        """
+        archived = FinancialYearArchive.archived_tables(model, date_from, date_to)
+        if not archived:
+            return model
+
+        table = model.__table__
+        parts = [select(*table.c)] + [select(*t.c) for t in archived]
+        return aliased(model, union_all(*parts).subquery(f'{table.name}_all'))
+
+    @staticmethod
+    def archived_tables(model, date_from=None, date_to=None):
+        """The model's table in each archive overlapping date_from..date_to"""
+        date_from, date_to = _as_date(date_from), _as_date(date_to)
+        return [_archived_table(model.__table__, a.schema) for a in _archives
+                if (date_from is None or a.end_date >= date_from)
+                and (date_to is None or a.start_date <= date_to)]
+
+    @staticmethod
+    def get_invoice(invoice_id):
+        """An archived invoice with its items and allocations, or None"""
+        def rows(model, archive, column, value):
+            table = _archived_table(model.__table__, archive.schema)
+            return db.session.query(aliased(model, table, adapt_on_names=True))\
+                .filter(table.c[column] == value).order_by(table.c.id)
+
+        for archive in _archives:
+            invoice = rows(Invoice, archive, 'id', invoice_id).first()
+            if invoice is not None:
+                return ArchivedRecord(
+                    invoice, archive,
+                    items=rows(InvoiceItem, archive, 'invoice_id', invoice_id).all(),
+                    allocations=rows(PaymentAllocation, archive, 'invoice_id', invoice_id).all(),
+                )
+        return None
+
+    @staticmethod
+    def live_from():
+        """Start of the previous financial year; everything before it can be archived"""
+        current = get_fy_from_date()
+        return get_fy_from_date(current['start_date'] - timedelta(days=1))['start_date']
+
+    @classmethod
+    def can_archive(cls, fy):
+        """Why a year cannot be archived, or None when it can"""
+        if fy.archived_at:
+            return f'{fy.name} is already archived'
+        if not fy.is_closed:
+            return f'Close {fy.name} before archiving it'
+        if fy.end_date >= cls.live_from():
+            return f'{fy.name} is still kept live; only years before the previous one are archived'
+        if len(_archives) >= MAX_ATTACHED:
+            return f'At most {MAX_ATTACHED} financial years can be archived'
+        return None
+
+    @staticmethod
+    def _create_tables(path):
+        """Create or upgrade the archived tables in an archive file"""
+        from app.models.schema import upgrade_schema
+
+        tables = [model.__table__ for model in ARCHIVED_MODELS]
+        engine = create_engine(f'sqlite:///{path}')
+        try:
+            db.metadata.create_all(engine, tables=tables)
+            upgrade_schema(engine, tables)
+        finally:
+            engine.dispose()
+
+    @classmethod
+    def upgrade(cls):
+        """Bring archives written by an older version up to the current tables"""
+        from app.services.stock_snapshots import StockSnapshots
+
+        for fy in FinancialYear.query.filter(FinancialYear.archived_at.isnot(None)):
+            path = _archive_path(fy.code)
+            if not os.path.exists(path):
+                continue
+            cls._create_tables(path)
+            engine = create_engine(f'sqlite:///{path}')
+            try:
+                StockSnapshots.backfill_movement_dates(engine)
+            finally:
+                engine.dispose()
+
+    @classmethod
+    def archive_year(cls, fy_id):
+        """
+        Move a closed year's settled documents and ledger rows into its
+        archive database. The live database is backed up first and holds
+        the write lock throughout, so nothing changes under the copy; the
+        archive is complete before any live row is deleted.
+        Returns {table: rows moved}.
+        """
+        from app.services.backup import DatabaseBackup
+        from app.services.financial_statements import FinancialStatements
+
+        fy = db.session.get(FinancialYear, fy_id)
+        if fy is None:
+            raise ValueError('Financial year not found')
+        reason = cls.can_archive(fy)
+        if reason:
+            raise ValueError(reason)
+
+        DatabaseBackup.create(label=f'pre-archive-{fy.code}')
+
+        os.makedirs(Config.ARCHIVE_DIR, exist_ok=True)
+        path = _archive_path(fy.code)
+        if os.path.exists(path):
+            # Left by an archive run that never reached the live database
+            os.remove(path)
+        cls._create_tables(path)
+
+        tables = [model.__table__ for model in ARCHIVED_MODELS]
+        counts = {}
+        live = sqlite3.connect(Config.DATABASE_PATH, timeout=30, isolation_level=None)
+        try:
+            live.execute('BEGIN IMMEDIATE')
+            try:
+                selected = _select_ids(live, fy)
+
+                archive = sqlite3.connect(path, timeout=30, isolation_level=None)
+                try:
+                    archive.execute('ATTACH DATABASE ? AS live', (Config.DATABASE_PATH,))
+                    _fill_ids(archive, selected)
+                    archive.execute('BEGIN')
+                    for table in tables:
+                        columns = ', '.join(c.name for c in table.columns)
+                        archive.execute(
+                            f'INSERT INTO main.{table.name} ({columns}) SELECT {columns} '
+                            f'FROM live.{table.name} WHERE id IN '
+                            f'(SELECT id FROM temp.archive_ids WHERE name = ?)', (table.name,))
+                    archive.execute('COMMIT')
+                finally:
+                    archive.close()
+
+                _fill_ids(live, selected)
+                for table in tables:
+                    counts[table.name] = live.execute(
+                        f'DELETE FROM {table.name} WHERE id IN '
+                        f'(SELECT id FROM temp.archive_ids WHERE name = ?)', (table.name,)).rowcount
+                live.execute('UPDATE financial_years SET archived_at = ? WHERE id = ?',
+                             (datetime.utcnow().isoformat(sep=' '), fy.id))
+                live.execute('COMMIT')
+            except BaseException:
+                live.execute('ROLLBACK')
+                raise
+
+            try:
+                live.execute('VACUUM')
+            except sqlite3.OperationalError as e:
+                # VACUUM needs the database to itself; the next one reclaims the space
+                current_app.logger.warning(f'VACUUM after archiving FY {fy.name} skipped: {e}')
+        finally:
+            live.close()
+
+        db.session.expire_all()
+        cls.refresh()
+        FinancialStatements.clear_cache()
+        return counts
@@ -0,0 +1,219 @@
+"""
+Backup Service
+Online backups of the SQLite database with rotation, compression and restore
+"""
+import gzip
+import os
+import re
+import shutil
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+from config.settings import Config
+
+
+BACKUP_PREFIX = 'billpro-'
+BACKUP_SUFFIXES = ('.db', '.db.gz')
+# billpro-<date>-<time>[-<microseconds>][-<label>].db[.gz]; older names have no microseconds
+BACKUP_NAME = re.compile(r'^billpro-\d{8}-\d{6}(?:-\d{6})?(?:-(?P<label>.+?))?\.db(?:\.gz)?$')
+
+_state = {'running': False, 'last': None, 'error': None}
+_state_lock = threading.Lock()
+
+
+def _db_modified(path):
+    """Last write to the database file or its WAL"""
+    times = [os.path.getmtime(p) for p in (path, path + '-wal') if os.path.exists(p)]
+    return datetime.fromtimestamp(max(times)) if times else None
+
+
+def _copy_database(source_path, target_path):
+    """
+    Copy a database with the SQLite backup API in one pass. The copy reads a
+    single snapshot; with the database in WAL mode writers carry on meanwhile
+    (copying in steps would restart every time another connection wrote).
+    """
+    source = sqlite3.connect(source_path, timeout=30)
+    target = sqlite3.connect(target_path, timeout=30)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+def _check(path):
+    """Raise if a database file fails SQLite's quick integrity check"""
+    connection = sqlite3.connect(path)
+    try:
+        result = connection.execute('PRAGMA quick_check').fetchone()[0]
+    finally:
+        connection.close()
+    if result != 'ok':
+        raise ValueError(f'Backup failed integrity check: {result}')
+
+
+class DatabaseBackup:
+    """Hot backups of billpro.db"""
+
+    @staticmethod
+    def backups():
+        """Backups on disk, newest first, as dicts of name, label, size and created time"""
+        if not os.path.isdir(Config.BACKUP_DIR):
+            return []
+        rows = []
+        for name in os.listdir(Config.BACKUP_DIR):
+            if name.startswith(BACKUP_PREFIX) and name.endswith(BACKUP_SUFFIXES):
+                path = os.path.join(Config.BACKUP_DIR, name)
+                match = BACKUP_NAME.match(name)
+                rows.append({
+                    'name': name,
+                    'label': match.group('label') if match else None,
+                    'size': os.path.getsize(path),
+                    'created_at': datetime.fromtimestamp(os.path.getmtime(path)),
+                })
+        return sorted(rows, key=lambda r: r['created_at'], reverse=True)
+
+    @staticmethod
+    def path(name):
+        """Full path of a backup, refusing anything outside the backup folder"""
+        if os.path.basename(name) != name or not name.startswith(BACKUP_PREFIX) \
+                or not name.endswith(BACKUP_SUFFIXES):
+            raise ValueError(f'Not a backup file: {name}')
+        path = os.path.join(Config.BACKUP_DIR, name)
+        if not os.path.exists(path):
+            raise ValueError(f'Backup not found: {name}')
+        return path
+
+    @classmethod
+    def create(cls, compress=None, label=''):
+        """
+        Take a consistent copy of the live database, verify it, compress it
+        and prune old backups. Returns the backup file name.
+        """
+        compress = Config.BACKUP_COMPRESS if compress is None else compress
+        os.makedirs(Config.BACKUP_DIR, exist_ok=True)
+
+        # Creating the partial file exclusively claims the name, so backups
+        # started in the same instant never write to the same file
+        while True:
+            stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+            name = f"{BACKUP_PREFIX}{stamp}{'-' + label if label else ''}.db"
+            partial = os.path.join(Config.BACKUP_DIR, name + '.partial')
+            try:
+                open(partial, 'x').close()
+                break
+            except FileExistsError:
+                continue
+
+        try:
+            _copy_database(Config.DATABASE_PATH, partial)
+            _check(partial)
+
+            if compress:
+                name += '.gz'
+                with open(partial, 'rb') as source, \
+                        gzip.open(os.path.join(Config.BACKUP_DIR, name), 'wb', compresslevel=6) as target:
+                    shutil.copyfileobj(source, target, 1024 * 1024)
+                os.remove(partial)
+            else:
+                os.replace(partial, os.path.join(Config.BACKUP_DIR, name))
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+
+        cls.rotate()
+        return name
+
+    @classmethod
+    def rotate(cls, keep=None, keep_labelled=None):
+        """
+        Delete all but the newest `keep` routine backups and the newest
+        `keep_labelled` labelled safety copies (pre-restore, pre-archive);
+        returns files removed
+        """
+        keep = Config.BACKUP_KEEP if keep is None else keep
+        keep_labelled = Config.BACKUP_KEEP_LABELLED if keep_labelled is None else keep_labelled
+        backups = cls.backups()
+        routine = [b for b in backups if not b['label']]
+        labelled = [b for b in backups if b['label']]
+        removed = 0
+        for backup in routine[keep:] + labelled[keep_labelled:]:
+            os.remove(os.path.join(Config.BACKUP_DIR, backup['name']))
+            removed += 1
+        return removed
+
+    @classmethod
+    def is_due(cls):
+        """Whether the schedule calls for a backup: the newest one is older
+        than the interval and the database has changed since it was taken"""
+        if not Config.BACKUP_INTERVAL_HOURS or not os.path.exists(Config.DATABASE_PATH):
+            return False
+        backups = cls.backups()
+        if not backups:
+            return True
+        newest = backups[0]['created_at']
+        if datetime.now() - newest < timedelta(hours=Config.BACKUP_INTERVAL_HOURS):
+            return False
+        modified = _db_modified(Config.DATABASE_PATH)
+        return modified is None or modified > newest
+
+    @staticmethod
+    def status():
+        """State of the background backup"""
+        with _state_lock:
+            return dict(_state)
+
+    @classmethod
+    def start(cls, compress=None):
+        """Take a backup in a background thread; False if one is already running"""
+        with _state_lock:
+            if _state['running']:
+                return False
+            _state.update(running=True, error=None)
+        threading.Thread(target=cls._run, args=(compress,), daemon=True).start()
+        return True
+
+    @classmethod
+    def _run(cls, compress):
+        name, error = None, None
+        try:
+            name = cls.create(compress)
+        except Exception as e:
+            error = str(e)
+        with _state_lock:
+            _state.update(running=False, error=error, last=name or _state['last'])
+
+    @classmethod
+    def restore(cls, path):
+        """
+        Replace the live database with a backup. The current database is
+        backed up first; callers must drop pooled connections afterwards.
+        Returns the name of that safety backup.
+        """
+        if not os.path.exists(path):
+            raise ValueError(f'Backup not found: {path}')
+
+        os.makedirs(Config.BACKUP_DIR, exist_ok=True)
+        staged = os.path.join(Config.BACKUP_DIR, 'restore.partial')
+        try:
+            if path.endswith('.gz'):
+                with gzip.open(path, 'rb') as source, open(staged, 'wb') as target:
+                    shutil.copyfileobj(source, target, 1024 * 1024)
+            else:
+                shutil.copyfile(path, staged)
+            _check(staged)
+
+            safety = None
+            if os.path.exists(Config.DATABASE_PATH):
+                safety = cls.create(label='pre-restore')
+
+            # Copying into the live file through SQLite keeps other
+            # connections consistent, unlike replacing the file on disk
+            _copy_database(staged, Config.DATABASE_PATH)
+        finally:
+            if os.path.exists(staged):
+                os.remove(staged)
+
+        return safety
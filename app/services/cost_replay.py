@@ -0,0 +1,157 @@
+"""
+Cost Replay
+The cost arithmetic shared by live postings and rebuilds. Rebuilds replay
+products in spawned worker processes; importing this module there also
+imports the app package (Flask and the models) but never run.py, so it
+must not call create_app or query the database itself.
+"""
+from collections import deque
+from decimal import Decimal
+
+
+# Receipts whose rate is known when they are posted; other receipts
+# (adjustments, found stock) come in at the running average
+COSTED_RECEIPTS = ('PURCHASE', 'OPENING')
+
+FOUR_PLACES = Decimal('0.0001')
+
+
+def _to_decimal(value):
+    return Decimal(str(value or 0))
+
+
+class _Layer:
+    """In-memory FIFO layer used when replaying movements"""
+    __slots__ = ('quantity', 'unit_cost')
+
+    def __init__(self, quantity, unit_cost):
+        self.quantity = quantity
+        self.unit_cost = unit_cost
+
+
+class CostState:
+    """
+    Running cost position of one product.
+    Layers are any objects with quantity and unit_cost attributes (CostLayer
+    rows for live postings, _Layer when replaying).
+    """
+
+    def __init__(self, method, quantity, value, fallback_cost, layers=(), new_layer=_Layer):
+        self.method = method
+        self.quantity = _to_decimal(quantity)
+        self.value = _to_decimal(value).quantize(FOUR_PLACES)
+        self.fallback_cost = _to_decimal(fallback_cost)
+        self.layers = deque(layers)
+        self.consumed = []
+        self.new_layer = new_layer
+
+    @property
+    def average_cost(self):
+        if self.quantity > 0:
+            return (self.value / self.quantity).quantize(FOUR_PLACES)
+        return self.fallback_cost
+
+    def receive(self, quantity, unit_cost=None):
+        """Bring quantity in at unit_cost (current average if not given); returns the change in value"""
+        unit_cost = self.average_cost if unit_cost is None else _to_decimal(unit_cost)
+        if unit_cost:
+            self.fallback_cost = unit_cost
+
+        if self.method == 'FIFO':
+            # Receipts first fill any backorder, the rest becomes a layer
+            layer_quantity = quantity + min(self.quantity, 0)
+            if layer_quantity > 0:
+                self.layers.append(self.new_layer(layer_quantity, unit_cost))
+
+        value_before = self.value
+        self.quantity += quantity
+        self._revalue(self.value + quantity * unit_cost)
+        return self.value - value_before
+
+    def issue(self, quantity):
+        """Take quantity out; returns its cost (the fall in stock value)"""
+        if self.method == 'FIFO':
+            cost = Decimal('0')
+            remaining = quantity
+            while remaining > 0 and self.layers:
+                layer = self.layers[0]
+                layer_quantity = _to_decimal(layer.quantity)
+                take = min(remaining, layer_quantity)
+                cost += take * _to_decimal(layer.unit_cost)
+                layer.quantity = layer_quantity - take
+                remaining -= take
+                if layer.quantity <= 0:
+                    self.consumed.append(self.layers.popleft())
+            # Stock issued beyond the open layers is costed at the last known rate
+            cost += remaining * self.fallback_cost
+        else:
+            cost = quantity * self.average_cost
+
+        value_before = self.value
+        self.quantity -= quantity
+        self._revalue(self.value - cost)
+        return value_before - self.value
+
+    def _revalue(self, value):
+        if self.method == 'FIFO':
+            value = sum((_to_decimal(l.quantity) * _to_decimal(l.unit_cost) for l in self.layers), Decimal('0'))
+        if self.quantity <= 0:
+            # Nothing on hand (or backordered): value what is owed at the last rate
+            value = self.quantity * self.fallback_cost
+        self.value = value.quantize(FOUR_PLACES)
+
+
+def _replay(products):
+    """
+    Replay movements for a chunk of products. products is a list of
+    (product_id, method, cost_price, opening_stock, movements) with movements
+    as (id, quantity, reference_type, reference_id, unit_cost) tuples.
+    Stock held before the first movement is valued at the cost price.
+    Returns movement updates, product updates and open FIFO layers.
+    """
+    movement_rows = []
+    product_rows = []
+    layer_rows = []
+
+    for product_id, method, cost_price, opening_stock, movements in products:
+        opening_stock = _to_decimal(opening_stock)
+        cost_price = _to_decimal(cost_price)
+        layers = [_Layer(opening_stock, cost_price)] if method == 'FIFO' and opening_stock > 0 else []
+        state = CostState(method, opening_stock, opening_stock * cost_price, cost_price, layers)
+        state._revalue(state.value)
+        sale_costs = {}
+
+        for movement_id, quantity, reference_type, reference_id, unit_cost in movements:
+            quantity = _to_decimal(quantity)
+            if quantity >= 0:
+                if reference_type == 'INVOICE_CANCEL' and reference_id in sale_costs:
+                    unit_cost = sale_costs[reference_id]
+                elif reference_type not in COSTED_RECEIPTS:
+                    unit_cost = None
+                amount = state.receive(quantity, unit_cost)
+                rate = amount / quantity if quantity else state.average_cost
+            else:
+                amount = -state.issue(-quantity)
+                rate = amount / quantity
+                if reference_type == 'INVOICE':
+                    sale_costs[reference_id] = rate.quantize(FOUR_PLACES)
+
+            movement_rows.append({
+                'id': movement_id,
+                'unit_cost': rate.quantize(FOUR_PLACES),
+                'cost_amount': amount,
+            })
+
+        product_rows.append({
+            'id': product_id,
+            'average_cost': state.average_cost,
+            'cost_value': state.value.quantize(FOUR_PLACES),
+        })
+        if method == 'FIFO':
+            layer_rows.extend({
+                'product_id': product_id,
+                'quantity': layer.quantity,
+                'unit_cost': layer.unit_cost,
+            } for layer in state.layers)
+
+    return movement_rows, product_rows, layer_rows
@@ -0,0 +1,273 @@
+"""
+Costing Service
+Weighted-average and FIFO stock costing over StockMovement
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import func, select, insert, update, delete, bindparam
+
+from app.models.base import db
+from app.models.reporting import report_session
+from app.models.product import Product, StockMovement, CostLayer, StockSnapshot
+from app.services.archive import FinancialYearArchive
+from app.services.cost_replay import (
+    FOUR_PLACES, CostState, _Layer, _replay, _to_decimal
+)
+from app.services.inventory_valuation import InventoryValuation
+
+
+COSTING_METHODS = ('WAVG', 'FIFO')
+
+
+class CostingEngine:
+    """Keeps product cost positions in step with stock movements"""
+
+    CHUNK_SIZE = 500
+    MAX_WORKERS = min(4, os.cpu_count() or 1)
+
+    @staticmethod
+    def _state(product):
+        """Cost position of a product as stored"""
+        method = product.costing_method or 'WAVG'
+        quantity = _to_decimal(product.current_stock)
+        value = product.cost_value
+        if value is None:
+            value = quantity * _to_decimal(product.cost_price)
+
+        layers = []
+        if method == 'FIFO':
+            layers = CostLayer.query.filter(
+                CostLayer.product_id == product.id,
+                CostLayer.quantity > 0
+            ).order_by(CostLayer.id).all()
+
+        def new_layer(quantity, unit_cost):
+            layer = CostLayer(product_id=product.id, quantity=quantity, unit_cost=unit_cost)
+            db.session.add(layer)
+            return layer
+
+        return CostState(method, quantity, value, product.average_cost or product.cost_price,
+                         layers, new_layer)
+
+    @classmethod
+    def record(cls, product, movement, unit_cost=None):
+        """
+        Cost a movement before it is saved and update the product's position.
+        Call before product.current_stock is changed for the movement.
+        unit_cost is the purchase rate for inward stock; returns reuse the
+        original sale cost and other receipts come in at the current average.
+        """
+        state = cls._state(product)
+        quantity = _to_decimal(movement.quantity)
+
+        if quantity >= 0:
+            if unit_cost is None and movement.reference_type == 'INVOICE_CANCEL':
+                unit_cost = cls._sale_cost(product.id, movement.reference_id)
+            amount = state.receive(quantity, unit_cost)
+            movement.unit_cost = (amount / quantity).quantize(FOUR_PLACES) if quantity else state.average_cost
+        else:
+            amount = -state.issue(-quantity)
+            movement.unit_cost = (amount / quantity).quantize(FOUR_PLACES)
+
+        movement.cost_amount = amount
+        product.average_cost = state.average_cost
+        product.cost_value = state.value.quantize(FOUR_PLACES)
+
+        for layer in state.consumed:
+            db.session.delete(layer)
+
+        return amount
+
+    @staticmethod
+    def post_receipts(receipts, reference_type='OPENING', notes=None):
+        """
+        Bring stock in for many products with bulk statements.
+        receipts is a list of (product_id, quantity, unit_cost) with at most
+        one entry per product; unit_cost None means the current average.
+        Writes the costed movements, product positions and FIFO layers but
+        leaves the commit (and valuation cache) to the caller.
+        """
+        if not receipts:
+            return 0
+
+        product_ids = [product_id for product_id, _, _ in receipts]
+        products = {row[0]: row[1:] for row in db.session.query(
+            Product.id, Product.costing_method, Product.current_stock,
+            Product.cost_value, Product.cost_price, Product.average_cost
+        ).filter(Product.id.in_(product_ids))}
+
+        open_layers = {}
+        for product_id, quantity, unit_cost in db.session.query(
+            CostLayer.product_id, CostLayer.quantity, CostLayer.unit_cost
+        ).filter(CostLayer.product_id.in_(product_ids), CostLayer.quantity > 0)\
+         .order_by(CostLayer.id):
+            open_layers.setdefault(product_id, []).append(_Layer(quantity, unit_cost))
+
+        movement_rows = []
+        product_rows = []
+        layer_rows = []
+
+        for product_id, quantity, unit_cost in receipts:
+            method, stock, value, cost_price, average_cost = products[product_id]
+            method = method or 'WAVG'
+            stock = _to_decimal(stock)
+            quantity = _to_decimal(quantity)
+            if value is None:
+                value = stock * _to_decimal(cost_price)
+
+            def new_layer(layer_quantity, layer_cost, product_id=product_id):
+                layer_rows.append({'product_id': product_id, 'quantity': layer_quantity,
+                                   'unit_cost': layer_cost})
+                return _Layer(layer_quantity, layer_cost)
+
+            state = CostState(method, stock, value, average_cost or cost_price,
+                              open_layers.get(product_id, ()), new_layer)
+            amount = state.receive(quantity, unit_cost)
+
+            movement_rows.append({
+                'product_id': product_id,
+                'movement_type': 'ADJUSTMENT',
+                'quantity': quantity,
+                'reference_type': reference_type,
+                'stock_before': stock,
+                'stock_after': stock + quantity,
+                'unit_cost': (amount / quantity).quantize(FOUR_PLACES) if quantity else state.average_cost,
+                'cost_amount': amount,
+                'notes': notes,
+            })
+            product_rows.append({
+                'product_id': product_id,
+                'stock': stock + quantity,
+                'average': state.average_cost,
+                'value': state.value.quantize(FOUR_PLACES),
+            })
+
+        # Core statements: plain executemany without per-row ORM bookkeeping
+        products_table = Product.__table__
+        db.session.execute(insert(StockMovement.__table__), movement_rows)
+        db.session.execute(
+            update(products_table).where(products_table.c.id == bindparam('product_id')).values(
+                current_stock=bindparam('stock'),
+                average_cost=bindparam('average'),
+                cost_value=bindparam('value')
+            ),
+            product_rows
+        )
+        if layer_rows:
+            db.session.execute(insert(CostLayer.__table__), layer_rows)
+
+        return len(movement_rows)
+
+    @staticmethod
+    def _sale_cost(product_id, invoice_id):
+        """Unit cost the product left at on an invoice"""
+        return db.session.query(StockMovement.unit_cost).filter(
+            StockMovement.product_id == product_id,
+            StockMovement.reference_type == 'INVOICE',
+            StockMovement.reference_id == invoice_id,
+            StockMovement.quantity < 0
+        ).order_by(StockMovement.id.desc()).limit(1).scalar()
+
+    @classmethod
+    def rebuild(cls, product_ids=None):
+        """
+        Recompute every movement's cost and each product's position by
+        replaying its movements. Products are split into chunks that are
+        replayed in parallel worker processes. Returns products rebuilt.
+        """
+        products = db.session.query(
+            Product.id, Product.costing_method, Product.cost_price, Product.current_stock
+        )
+        if product_ids:
+            products = products.filter(Product.id.in_(product_ids))
+        products = {row[0]: row[1:] for row in products}
+
+        # Archived years are replayed too but their movements are left as stored
+        movement = FinancialYearArchive.span(StockMovement)
+        movements = db.session.query(
+            movement.product_id,
+            movement.stock_before,
+            movement.id,
+            movement.quantity,
+            movement.reference_type,
+            movement.reference_id,
+            movement.unit_cost
+        ).order_by(movement.product_id, movement.id)
+        if product_ids:
+            movements = movements.filter(movement.product_id.in_(product_ids))
+        
+        archived = set()
+        for table in FinancialYearArchive.archived_tables(StockMovement):
+            query = select(table.c.id)
+            if product_ids:
+                query = query.where(table.c.product_id.in_(product_ids))
+            archived.update(db.session.execute(query).scalars())
+
+        # Opening stock is what the product held before its first movement
+        opening = {pid: current_stock for pid, (_, _, current_stock) in products.items()}
+        by_product = {pid: [] for pid in products}
+        for product_id, stock_before, *movement in movements.yield_per(5000):
+            if product_id not in by_product:
+                continue
+            if not by_product[product_id]:
+                opening[product_id] = stock_before
+            by_product[product_id].append(tuple(movement))
+
+        work = [(pid, method or 'WAVG', cost_price, opening[pid], by_product[pid])
+                for pid, (method, cost_price, _) in products.items()]
+        chunks = [work[i:i + cls.CHUNK_SIZE] for i in range(0, len(work), cls.CHUNK_SIZE)]
+
+        if len(chunks) > 1 and cls.MAX_WORKERS > 1:
+            # Spawned, not forked: rebuilds run beside the web server's threads
+            with ProcessPoolExecutor(max_workers=cls.MAX_WORKERS,
+                                     mp_context=multiprocessing.get_context('spawn')) as pool:
+                results = list(pool.map(_replay, chunks))
+        else:
+            results = [_replay(chunk) for chunk in chunks]
+
+        try:
+            for chunk, (movement_rows, product_rows, layer_rows) in zip(chunks, results):
+                chunk_ids = [pid for pid, *_ in chunk]
+                if archived:
+                    movement_rows = [row for row in movement_rows if row['id'] not in archived]
+                if movement_rows:
+                    db.session.execute(update(StockMovement), movement_rows)
+                if product_rows:
+                    db.session.execute(update(Product), product_rows)
+                db.session.execute(delete(CostLayer).where(CostLayer.product_id.in_(chunk_ids)))
+                if layer_rows:
+                    db.session.execute(insert(CostLayer), layer_rows)
+            # Snapshot values were built from the old movement costs
+            db.session.execute(delete(StockSnapshot))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            InventoryValuation.invalidate()
+
+        return len(work)
+
+    @staticmethod
+    def cogs_by_product(date_from, date_to):
+        """Cost of goods sold per product on active invoices dated in the period"""
+        from app.models.invoice import Invoice
+
+        invoice = FinancialYearArchive.span(Invoice, date_from, date_to)
+        # Movements are archived by when they were written, which can be after the invoice date
+        movement = FinancialYearArchive.span(StockMovement, date_from)
+
+        rows = report_session.query(
+            movement.product_id,
+            func.sum(movement.cost_amount)
+        ).join(invoice, db.and_(
+            movement.reference_type == 'INVOICE',
+            movement.reference_id == invoice.id
+        )).filter(
+            invoice.invoice_date >= date_from,
+            invoice.invoice_date <= date_to,
+            invoice.status == 'ACTIVE'
+        ).group_by(movement.product_id).all()
+
+        return {product_id: -_to_decimal(amount) for product_id, amount in rows}
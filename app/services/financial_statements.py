@@ -0,0 +1,387 @@
+"""
+Financial Statements Service
+Trial balance, profit & loss and balance sheet for any period
+"""
+import threading
+from decimal import Decimal
+from itertools import chain
+from sqlalchemy import event, func, case
+from sqlalchemy.orm import Session
+
+from app.models.base import db
+from app.models.reporting import report_session
+from app.models.invoice import Invoice
+from app.models.purchase import Purchase
+from app.models.party import Party, PartyTransaction
+from app.models.accounting import (
+    Expense, ExpenseCategory, JournalEntry,
+    CashTransaction, BankTransaction
+)
+from app.models.config import FinancialYear
+from app.services.archive import FinancialYearArchive
+from app.services.metrics import Metrics
+
+
+# Journal entries posted automatically by billing/purchases/expenses duplicate
+# the source documents, so only manual journals are added on top of them.
+AUTO_JOURNAL_REFERENCES = ('INVOICE', 'PURCHASE', 'EXPENSE')
+
+# Manual journal account types and where they land in the statements
+JOURNAL_ACCOUNT_GROUPS = {
+    'SALES': 'income',
+    'PURCHASE': 'expense',
+    'EXPENSE': 'expense',
+    'CASH': 'asset',
+    'BANK': 'asset',
+    'RECEIVABLE': 'asset',
+    'PAYABLE': 'liability',
+}
+
+# Writes to these tables change the statements, so they drop cached ones
+STATEMENT_MODELS = (
+    Invoice, Purchase, Party, PartyTransaction, Expense, ExpenseCategory,
+    JournalEntry, CashTransaction, BankTransaction,
+)
+STATEMENT_TABLES = frozenset(model.__tablename__ for model in STATEMENT_MODELS)
+
+ZERO = Decimal('0')
+
+
+def _d(value):
+    """Convert an aggregate result to Decimal"""
+    return Decimal(str(value or 0)).quantize(Decimal('0.01'))
+
+
+def _split_sums(date_column, date_from, columns):
+    """
+    Build period and cumulative SUM() expressions for each column.
+    Period covers date_from onwards; cumulative covers everything (the
+    query itself is bounded by date_to).
+    """
+    exprs = []
+    for column in columns:
+        exprs.append(func.sum(case((date_column >= date_from, column), else_=0)))
+        exprs.append(func.sum(column))
+    return exprs
+
+
+def _unpack(row, names, offset=0):
+    """Turn a row built by _split_sums into {name: (period, cumulative)}"""
+    result = {}
+    for i, name in enumerate(names):
+        result[name] = (_d(row[offset + 2 * i]), _d(row[offset + 2 * i + 1]))
+    return result
+
+
+class FinancialStatements:
+    """Financial statements built from one grouped query per source table"""
+
+    _cache = {}
+    _cache_lock = threading.Lock()
+
+    @classmethod
+    def build(cls, date_from, date_to):
+        """
+        Build trial balance, P&L and balance sheet for a period.
+        Results for closed periods are cached in-process until a commit
+        writes to one of the tables they are built from.
+        """
+        key = (date_from, date_to)
+        with cls._cache_lock:
+            cached = cls._cache.get(key)
+        if cached is not None:
+            Metrics.inc('billpro_cache_hits_total', 'financial_statements')
+            return cached
+
+        Metrics.inc('billpro_cache_misses_total', 'financial_statements')
+        statements = cls._compute(date_from, date_to)
+
+        if cls.is_closed_period(date_to):
+            with cls._cache_lock:
+                cls._cache[key] = statements
+
+        return statements
+
+    @classmethod
+    def clear_cache(cls):
+        """Drop cached statements (after writes the session cannot see, e.g. a restore)"""
+        with cls._cache_lock:
+            cls._cache.clear()
+
+    @staticmethod
+    def is_closed_period(date_to):
+        """
+        A period is closed when date_to falls inside a closed financial year
+        and no open financial year starts on or before date_to.
+        """
+        open_before = report_session.query(FinancialYear).filter(
+            FinancialYear.is_closed == False,
+            FinancialYear.start_date <= date_to
+        ).count()
+        if open_before:
+            return False
+
+        return report_session.query(FinancialYear).filter(
+            FinancialYear.is_closed == True,
+            FinancialYear.start_date <= date_to,
+            FinancialYear.end_date >= date_to
+        ).count() > 0
+
+    @classmethod
+    def _compute(cls, date_from, date_to):
+        """Run the aggregation queries and assemble the statements"""
+        accounts = []  # (account, group, signed amount: debit positive)
+
+        def add(account, group, amount):
+            if amount != 0:
+                accounts.append((account, group, amount))
+
+        # Balances run from the first entry, so archived years are included
+        invoice = FinancialYearArchive.span(Invoice, date_to=date_to)
+        purchase = FinancialYearArchive.span(Purchase, date_to=date_to)
+        expense = FinancialYearArchive.span(Expense, date_to=date_to)
+        cash = FinancialYearArchive.span(CashTransaction, date_to=date_to)
+        bank = FinancialYearArchive.span(BankTransaction, date_to=date_to)
+        ledger = FinancialYearArchive.span(PartyTransaction, date_to=date_to)
+        journal = FinancialYearArchive.span(JournalEntry, date_to=date_to)
+
+        # Sales invoices
+        inv_cols = ['subtotal', 'cgst', 'sgst', 'igst', 'discount', 'round_off']
+        row = report_session.query(*_split_sums(invoice.invoice_date, date_from, [
+            invoice.subtotal, invoice.cgst_amount, invoice.sgst_amount,
+            invoice.igst_amount, invoice.discount_amount, invoice.round_off
+        ])).filter(
+            invoice.status == 'ACTIVE',
+            invoice.invoice_date <= date_to
+        ).one()
+        inv = _unpack(row, inv_cols)
+
+        # Purchases
+        row = report_session.query(*_split_sums(purchase.purchase_date, date_from, [
+            purchase.subtotal, purchase.cgst_amount, purchase.sgst_amount,
+            purchase.igst_amount, purchase.discount_amount, purchase.round_off
+        ])).filter(
+            purchase.status == 'ACTIVE',
+            purchase.purchase_date <= date_to
+        ).one()
+        pur = _unpack(row, inv_cols)
+
+        # Expenses grouped by category
+        expense_gst = case((expense.is_gst_expense == True, expense.gst_amount), else_=0)
+        expense_rows = report_session.query(
+            ExpenseCategory.name,
+            *_split_sums(expense.expense_date, date_from, [expense.amount, expense_gst])
+        ).select_from(expense).outerjoin(ExpenseCategory, expense.category_id == ExpenseCategory.id)\
+         .filter(expense.expense_date <= date_to)\
+         .group_by(ExpenseCategory.name).all()
+
+        # Cash and bank books
+        row = report_session.query(
+            func.sum(cash.receipt), func.sum(cash.payment)
+        ).filter(cash.transaction_date <= date_to).one()
+        cash_balance = _d(row[0]) - _d(row[1])
+
+        row = report_session.query(
+            func.sum(bank.deposit), func.sum(bank.withdrawal)
+        ).filter(bank.transaction_date <= date_to).one()
+        bank_balance = _d(row[0]) - _d(row[1])
+
+        # Party ledgers grouped by party type
+        party_rows = report_session.query(
+            Party.party_type,
+            func.sum(ledger.debit),
+            func.sum(ledger.credit)
+        ).select_from(ledger).join(Party, ledger.party_id == Party.id)\
+         .filter(ledger.transaction_date <= date_to)\
+         .group_by(Party.party_type).all()
+
+        # Manual journal entries grouped by account
+        journal_rows = report_session.query(
+            journal.account_type,
+            journal.account_name,
+            *_split_sums(journal.entry_date, date_from, [
+                journal.debit, journal.credit
+            ])
+        ).filter(
+            journal.entry_date <= date_to,
+            db.or_(
+                journal.reference_type.is_(None),
+                journal.reference_type.notin_(AUTO_JOURNAL_REFERENCES)
+            )
+        ).group_by(journal.account_type, journal.account_name).all()
+
+        # Nominal accounts (period) and the profit they made before the period
+        prior_profit = ZERO
+
+        def add_nominal(account, group, amounts):
+            nonlocal prior_profit
+            period, cumulative = amounts
+            add(account, group, period)
+            prior_profit -= cumulative - period
+
+        add_nominal('Sales', 'income', tuple(-v for v in inv['subtotal']))
+        add_nominal('Discount Allowed', 'expense', inv['discount'])
+        add_nominal('Round Off on Sales', 'income', tuple(-v for v in inv['round_off']))
+        add_nominal('Purchases', 'expense', pur['subtotal'])
+        add_nominal('Discount Received', 'income', tuple(-v for v in pur['discount']))
+        add_nominal('Round Off on Purchases', 'expense', pur['round_off'])
+
+        input_gst_on_expenses = ZERO
+        for category, amount_p, amount_c, gst_p, gst_c in expense_rows:
+            amount_p, amount_c, gst_p, gst_c = _d(amount_p), _d(amount_c), _d(gst_p), _d(gst_c)
+            add_nominal(f'Expenses - {category or "Uncategorised"}', 'expense',
+                        (amount_p - gst_p, amount_c - gst_c))
+            input_gst_on_expenses += gst_c
+
+        # Real accounts (cumulative up to date_to)
+        add('Cash in Hand', 'asset', cash_balance)
+        add('Bank Accounts', 'asset', bank_balance)
+
+        for party_type, debit, credit in party_rows:
+            balance = _d(debit) - _d(credit)
+            if party_type == 'supplier':
+                add('Sundry Creditors', 'liability', balance)
+            else:
+                add('Sundry Debtors', 'asset', balance)
+
+        add('Output CGST', 'liability', -inv['cgst'][1])
+        add('Output SGST', 'liability', -inv['sgst'][1])
+        add('Output IGST', 'liability', -inv['igst'][1])
+        add('Input CGST', 'asset', pur['cgst'][1])
+        add('Input SGST', 'asset', pur['sgst'][1])
+        add('Input IGST', 'asset', pur['igst'][1])
+        add('Input GST on Expenses', 'asset', input_gst_on_expenses)
+
+        for account_type, account_name, debit_p, debit_c, credit_p, credit_c in journal_rows:
+            group = JOURNAL_ACCOUNT_GROUPS.get(account_type, 'liability')
+            name = f'{account_name or account_type.title()} (Journal)'
+            if group in ('income', 'expense'):
+                add_nominal(name, group, (_d(debit_p) - _d(credit_p), _d(debit_c) - _d(credit_c)))
+            else:
+                add(name, group, _d(debit_c) - _d(credit_c))
+
+        add('Profit & Loss A/c (Previous Periods)', 'capital', -prior_profit)
+
+        # Entries without a counter-entry, such as party opening balances,
+        # are shown as a difference rather than hidden in capital
+        difference = sum((amount for _, _, amount in accounts), ZERO)
+        add('Difference in Trial Balance', 'suspense', -difference)
+
+        statements = cls._assemble(accounts, date_from, date_to)
+        statements['difference'] = difference
+        return statements
+
+    @staticmethod
+    def _assemble(accounts, date_from, date_to):
+        """Lay the signed account balances out as the three statements"""
+        trial_balance = []
+        for account, group, amount in accounts:
+            trial_balance.append({
+                'account': account,
+                'group': group,
+                'debit': amount if amount > 0 else ZERO,
+                'credit': -amount if amount < 0 else ZERO,
+            })
+
+        income = [{'account': a, 'amount': -amt} for a, g, amt in accounts if g == 'income']
+        expenses = [{'account': a, 'amount': amt} for a, g, amt in accounts if g == 'expense']
+        total_income = sum((i['amount'] for i in income), ZERO)
+        total_expenses = sum((e['amount'] for e in expenses), ZERO)
+        net_profit = total_income - total_expenses
+
+        assets = [{'account': a, 'amount': amt} for a, g, amt in accounts if g == 'asset']
+        liabilities = [{'account': a, 'amount': -amt} for a, g, amt in accounts
+                       if g in ('liability', 'suspense')]
+        capital = [{'account': a, 'amount': -amt} for a, g, amt in accounts if g == 'capital']
+        if net_profit:
+            capital.append({'account': 'Profit & Loss A/c (Current Period)', 'amount': net_profit})
+
+        return {
+            'date_from': date_from,
+            'date_to': date_to,
+            'trial_balance': {
+                'rows': trial_balance,
+                'total_debit': sum((r['debit'] for r in trial_balance), ZERO),
+                'total_credit': sum((r['credit'] for r in trial_balance), ZERO),
+            },
+            'profit_loss': {
+                'income': income,
+                'expenses': expenses,
+                'total_income': total_income,
+                'total_expenses': total_expenses,
+                'net_profit': net_profit,
+            },
+            'balance_sheet': {
+                'assets': assets,
+                'liabilities': liabilities,
+                'capital': capital,
+                'total_assets': sum((a['amount'] for a in assets), ZERO),
+                'total_liabilities': sum((l['amount'] for l in liabilities), ZERO)
+                                     + sum((c['amount'] for c in capital), ZERO),
+            },
+        }
+
+    @staticmethod
+    def to_csv_rows(statements, statement):
+        """Flatten one statement into CSV rows (header first); amounts stay Decimal"""
+        if statement == 'trial-balance':
+            tb = statements['trial_balance']
+            rows = [['Account', 'Group', 'Debit', 'Credit']]
+            for r in tb['rows']:
+                rows.append([r['account'], r['group'], r['debit'], r['credit']])
+            rows.append(['TOTAL', '', tb['total_debit'], tb['total_credit']])
+            return rows
+
+        if statement == 'profit-loss':
+            pl = statements['profit_loss']
+            rows = [['Section', 'Account', 'Amount']]
+            for i in pl['income']:
+                rows.append(['Income', i['account'], i['amount']])
+            rows.append(['Income', 'Total Income', pl['total_income']])
+            for e in pl['expenses']:
+                rows.append(['Expenses', e['account'], e['amount']])
+            rows.append(['Expenses', 'Total Expenses', pl['total_expenses']])
+            rows.append(['', 'Net Profit', pl['net_profit']])
+            return rows
+
+        bs = statements['balance_sheet']
+        rows = [['Section', 'Account', 'Amount']]
+        for c in bs['capital']:
+            rows.append(['Capital', c['account'], c['amount']])
+        for l in bs['liabilities']:
+            rows.append(['Liabilities', l['account'], l['amount']])
+        rows.append(['', 'Total Capital & Liabilities', bs['total_liabilities']])
+        for a in bs['assets']:
+            rows.append(['Assets', a['account'], a['amount']])
+        rows.append(['', 'Total Assets', bs['total_assets']])
+        return rows
+
+
+@event.listens_for(Session, 'before_flush')
+def _track_statement_writes(session, flush_context, instances):
+    """Note ORM writes to the statement tables until commit"""
+    if any(isinstance(obj, STATEMENT_MODELS)
+           for obj in chain(session.new, session.dirty, session.deleted)):
+        session.info['statements_stale'] = True
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _track_bulk_statement_writes(orm_execute_state):
+    """Bulk INSERT/UPDATE/DELETE statements bypass the flush"""
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update
+            or orm_execute_state.is_delete):
+        return
+    table = getattr(orm_execute_state.statement, 'table', None)
+    if table is not None and table.name in STATEMENT_TABLES:
+        orm_execute_state.session.info['statements_stale'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _clear_stale_statements(session):
+    if session.info.pop('statements_stale', False):
+        FinancialStatements.clear_cache()
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_statement_writes(session, previous_transaction):
+    session.info.pop('statements_stale', None)
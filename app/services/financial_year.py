@@ -1,9 +1,28 @@
 """
 Financial Year Service
 """
+import threading
+from collections import namedtuple
 from datetime import date
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
 from app.models.base import db
 from app.models.config import FinancialYear
+from app.services.metrics import Metrics
+from config.settings import Config
+
+
+# Lightweight snapshot of the active FY so the invoice path never has to
+# load the FinancialYear row into the session
+ActiveFinancialYear = namedtuple('ActiveFinancialYear', [
+    'id', 'name', 'code', 'start_date', 'end_date', 'invoice_prefix'
+])
+
+_active_fy = None
+_active_fy_lock = threading.Lock()
+
+# Serialises creating the new FY when requests arrive together at rollover
+_create_fy_lock = threading.Lock()
 
 
 def get_fy_from_date(d=None):
@@ -39,7 +58,15 @@ def get_or_create_current_fy():
     fy_info = get_fy_from_date()
     
     fy = FinancialYear.query.filter_by(code=fy_info['code']).first()
-    if not fy:
+    if fy:
+        return fy
+    
+    with _create_fy_lock:
+        # Another request may have created it while this one waited
+        fy = FinancialYear.query.filter_by(code=fy_info['code']).first()
+        if fy:
+            return fy
+        
         # Create new FY
         fy = FinancialYear(
             name=fy_info['name'],
@@ -50,12 +77,17 @@ def get_or_create_current_fy():
         )
         db.session.add(fy)
         
-        # Deactivate other FYs
-        FinancialYear.query.filter(FinancialYear.code != fy_info['code']).update(
-            {'is_active': False}
-        )
-        
-        db.session.commit()
+        try:
+            # Deactivate other FYs
+            FinancialYear.query.filter(FinancialYear.code != fy_info['code']).update(
+                {'is_active': False}
+            )
+            db.session.commit()
+        except IntegrityError:
+            # Created by another process in the meantime (code is unique)
+            db.session.rollback()
+            return FinancialYear.query.filter_by(code=fy_info['code']).one()
+        invalidate_fy_cache()
     
     return fy
 
@@ -71,3 +103,94 @@ def get_current_fy():
 def get_all_financial_years():
     """Get all financial years ordered by date"""
     return FinancialYear.query.order_by(FinancialYear.start_date.desc()).all()
+
+
+def invalidate_fy_cache():
+    """Forget the cached active FY (call after creating, activating or closing a FY)"""
+    global _active_fy
+    with _active_fy_lock:
+        _active_fy = None
+
+
+def get_active_fy():
+    """
+    Get a cached snapshot of the active financial year.
+    Rolls over to the new FY automatically once the cached one has ended.
+    """
+    global _active_fy
+    
+    with _active_fy_lock:
+        cached = _active_fy
+    
+    if cached is not None and cached.end_date >= date.today():
+        Metrics.inc('billpro_cache_hits_total', 'active_fy')
+        return cached
+    
+    Metrics.inc('billpro_cache_misses_total', 'active_fy')
+    fy = get_current_fy()
+    if fy.end_date < date.today():
+        fy = get_or_create_current_fy()
+        if not fy.is_active:
+            activate_financial_year(fy.id)
+    
+    snapshot = ActiveFinancialYear(
+        id=fy.id,
+        name=fy.name,
+        code=fy.code,
+        start_date=fy.start_date,
+        end_date=fy.end_date,
+        invoice_prefix=Config.INVOICE_PREFIX
+    )
+    
+    with _active_fy_lock:
+        _active_fy = snapshot
+    
+    return snapshot
+
+
+def activate_financial_year(fy_id):
+    """Make the given FY the only active one"""
+    FinancialYear.query.filter(FinancialYear.id != fy_id).update({'is_active': False})
+    FinancialYear.query.filter(FinancialYear.id == fy_id).update({'is_active': True})
+    db.session.commit()
+    invalidate_fy_cache()
+
+
+def close_financial_year(fy_id, closed=True):
+    """Close (or reopen) a financial year; archived years stay closed"""
+    from app.services.financial_statements import FinancialStatements
+    
+    fy = db.session.get(FinancialYear, fy_id)
+    if fy is None:
+        raise ValueError('Financial year not found')
+    if not closed and fy.archived_at:
+        raise ValueError(f'{fy.name} is archived and cannot be reopened')
+    
+    FinancialYear.query.filter(FinancialYear.id == fy_id).update({'is_closed': closed})
+    db.session.commit()
+    invalidate_fy_cache()
+    FinancialStatements.clear_cache()
+
+
+def _allocate_counter(fy_id, counter_column):
+    """
+    Increment a FY counter in a single UPDATE and read it back.
+    The UPDATE takes SQLite's write lock, so two counters can never
+    receive the same number.
+    """
+    db.session.execute(
+        update(FinancialYear)
+        .where(FinancialYear.id == fy_id)
+        .values({counter_column: counter_column + 1})
+        .execution_options(synchronize_session=False)
+    )
+    return db.session.execute(
+        select(counter_column).where(FinancialYear.id == fy_id)
+    ).scalar_one()
+
+
+def allocate_invoice_number(fy):
+    """Allocate the next invoice number for an ActiveFinancialYear"""
+    counter = _allocate_counter(fy.id, FinancialYear.invoice_counter)
+    return f"{fy.invoice_prefix}/{fy.code}/{str(counter).zfill(4)}"
+
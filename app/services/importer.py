@@ -0,0 +1,436 @@
+"""
+Bulk Import Service
+Streaming CSV/XLSX import of products, parties and opening stock
+"""
+import csv
+import io
+import re
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import insert, update
+
+from config.settings import Config
+from app.models.base import db
+from app.models.party import Party, PartyTransaction
+from app.models.product import Product, ProductCategory, StockMovement, CostLayer
+from app.services.archive import FinancialYearArchive
+from app.services.costing import CostingEngine, CostState, COSTING_METHODS, FOUR_PLACES
+from app.services.inventory_valuation import InventoryValuation
+from app.services.metrics import Metrics
+from app.services.tax_calculator import TaxCalculator
+
+
+IMPORT_KINDS = {
+    'products': ('code', 'name', 'hsn_code', 'gst_percent', 'cost_price', 'selling_price', 'mrp',
+                 'unit', 'low_stock_threshold', 'category', 'costing_method', 'description',
+                 'opening_stock'),
+    'parties': ('code', 'name', 'party_type', 'gstin', 'pan', 'contact_person', 'phone', 'email',
+                'address_line1', 'address_line2', 'city', 'state', 'state_code', 'pincode',
+                'opening_balance', 'credit_limit', 'credit_days'),
+    'stock': ('code', 'quantity', 'unit_cost'),
+}
+
+PARTY_TYPES = ('customer', 'supplier')
+
+HSN_PATTERN = re.compile(r'^[0-9]{4,8}$')
+PAN_PATTERN = re.compile(r'^[A-Z]{5}[0-9]{4}[A-Z]$')
+# State code, PAN, entity number, 'Z', check character; stricter than the
+# format check used when a party is keyed in
+GSTIN_PATTERN = re.compile(r'^[0-9]{2}[A-Z]{5}[0-9]{4}[A-Z][1-9A-Z]Z[0-9A-Z]$')
+
+
+class RowError(ValueError):
+    """A row that cannot be imported"""
+
+
+def _header(name):
+    return (name or '').strip().lower().replace(' ', '_')
+
+
+def _text(row, key, max_length=None):
+    value = row.get(key)
+    if value is None:
+        return None
+    value = str(value).strip()
+    if not value:
+        return None
+    if max_length and len(value) > max_length:
+        raise RowError(f'{key} is longer than {max_length} characters')
+    return value
+
+
+def _decimal(row, key, minimum=None):
+    value = _text(row, key)
+    if value is None:
+        return None
+    try:
+        number = Decimal(value.replace(',', ''))
+    except InvalidOperation:
+        raise RowError(f'{key} "{value}" is not a number')
+    if not number.is_finite():
+        raise RowError(f'{key} "{value}" is not a number')
+    if minimum is not None and number < minimum:
+        raise RowError(f'{key} must be at least {minimum}')
+    return number
+
+
+def _present(values):
+    """Drop empty cells so they leave existing values unchanged on update"""
+    return {key: value for key, value in values.items() if value is not None}
+
+
+class BulkImporter:
+    """Validates rows in chunks and upserts them by code with bulk statements"""
+
+    CHUNK_SIZE = 1000
+    MAX_ERRORS = 500
+
+    @staticmethod
+    def read_rows(file):
+        """
+        Yield (line_number, row) from an uploaded CSV or XLSX file, with
+        headers normalised to lower_case names.
+        """
+        filename = (file.filename or '').lower()
+
+        if filename.endswith('.xlsx'):
+            try:
+                from openpyxl import load_workbook
+            except ImportError:
+                raise ValueError('Excel import needs the openpyxl package; save the sheet as CSV instead')
+
+            workbook = load_workbook(file.stream, read_only=True, data_only=True)
+            try:
+                rows = workbook.active.iter_rows(values_only=True)
+                header = [_header(str(cell) if cell is not None else '') for cell in next(rows, ())]
+                for line, values in enumerate(rows, start=2):
+                    if any(cell is not None for cell in values):
+                        yield line, dict(zip(header, values))
+            finally:
+                workbook.close()
+            return
+
+        reader = csv.reader(io.TextIOWrapper(file.stream, encoding='utf-8-sig', newline=''))
+        header = [_header(cell) for cell in next(reader, [])]
+        for line, values in enumerate(reader, start=2):
+            if any(cell.strip() for cell in values):
+                yield line, dict(zip(header, values))
+
+    @classmethod
+    def import_file(cls, kind, file, dry_run=False):
+        """Import an uploaded CSV or XLSX file"""
+        return cls.run(kind, cls.read_rows(file), dry_run)
+
+    @staticmethod
+    def template_csv(kind):
+        """Header row for a blank import file"""
+        output = io.StringIO()
+        csv.writer(output).writerow(IMPORT_KINDS[kind])
+        return output.getvalue()
+
+    @classmethod
+    def run(cls, kind, rows, dry_run=False):
+        """
+        Import rows of the given kind. Valid rows are written and invalid
+        ones reported; with dry_run everything is validated and rolled back.
+        Returns a dict of counts and (line, code, message) errors.
+        """
+        if kind not in IMPORT_KINDS:
+            raise ValueError(f'Unknown import type: {kind}')
+
+        handler = getattr(cls, f'_import_{kind}')
+        result = {'rows': 0, 'inserted': 0, 'updated': 0, 'error_count': 0, 'errors': []}
+        context = {'seen': set()}
+        started = datetime.utcnow()
+
+        try:
+            chunk = []
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) >= cls.CHUNK_SIZE:
+                    handler(chunk, result, context)
+                    chunk = []
+            if chunk:
+                handler(chunk, result, context)
+
+            if dry_run:
+                db.session.rollback()
+            else:
+                db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            InventoryValuation.invalidate()
+
+        result['seconds'] = (datetime.utcnow() - started).total_seconds()
+        return result
+
+    @classmethod
+    def _error(cls, result, line, code, message):
+        result['error_count'] += 1
+        if len(result['errors']) < cls.MAX_ERRORS:
+            result['errors'].append((line, code or '', message))
+
+    @classmethod
+    def _codes(cls, chunk, result, context):
+        """Rows with a code not seen earlier in the file, as (line, code, row)"""
+        rows = []
+        for line, row in chunk:
+            result['rows'] += 1
+            try:
+                code = _text(row, 'code', 50)
+            except RowError as e:
+                cls._error(result, line, None, str(e))
+                continue
+            if not code:
+                cls._error(result, line, None, 'code is required')
+            elif code in context['seen']:
+                cls._error(result, line, code, 'code appears more than once in the file')
+            else:
+                context['seen'].add(code)
+                rows.append((line, code, row))
+        return rows
+
+    @staticmethod
+    def _existing(model, codes):
+        return dict(db.session.query(model.code, model.id).filter(model.code.in_(codes)))
+
+    @classmethod
+    def _write(cls, model, inserts, updates, result):
+        if inserts:
+            db.session.execute(insert(model), inserts)
+        if updates:
+            db.session.execute(update(model), updates)
+        result['inserted'] += len(inserts)
+        result['updated'] += len(updates)
+
+    # Products
+
+    @classmethod
+    def _import_products(cls, chunk, result, context):
+        rows = cls._codes(chunk, result, context)
+        existing = cls._existing(Product, [code for _, code, _ in rows])
+
+        if 'categories' not in context:
+            context['categories'] = {name.lower(): category_id for category_id, name in
+                                     db.session.query(ProductCategory.id, ProductCategory.name)}
+        categories = context['categories']
+
+        inserts, updates, opening = [], [], {}
+        for line, code, row in rows:
+            try:
+                values = cls._product_values(row)
+                category = _text(row, 'category', 100)
+                opening_stock = _decimal(row, 'opening_stock', 0)
+                if code not in existing and not values.get('name'):
+                    raise RowError('name is required for a new product')
+                if code in existing and opening_stock:
+                    raise RowError('opening_stock is only accepted for new products')
+            except RowError as e:
+                cls._error(result, line, code, str(e))
+                continue
+
+            if category:
+                if category.lower() not in categories:
+                    new_category = ProductCategory(name=category)
+                    db.session.add(new_category)
+                    db.session.flush()
+                    categories[category.lower()] = new_category.id
+                values['category_id'] = categories[category.lower()]
+
+            if code in existing:
+                updates.append(dict(values, id=existing[code]))
+                continue
+
+            values['code'] = code
+            if opening_stock:
+                # New products start from nothing, so their cost position is
+                # known before they are written and needs no second update
+                state = CostState(values.get('costing_method', 'WAVG'), 0, 0, values.get('cost_price'))
+                amount = state.receive(opening_stock, values.get('cost_price') or Decimal('0'))
+                values.update(current_stock=opening_stock, average_cost=state.average_cost,
+                              cost_value=state.value)
+                opening[code] = (opening_stock, amount, state.layers)
+            inserts.append(values)
+
+        cls._write(Product, inserts, updates, result)
+
+        if opening:
+            new_ids = cls._existing(Product, list(opening))
+            movements, layers = [], []
+            for code, (quantity, amount, open_layers) in opening.items():
+                movements.append({
+                    'product_id': new_ids[code],
+                    'movement_type': 'ADJUSTMENT',
+                    'quantity': quantity,
+                    'reference_type': 'OPENING',
+                    'stock_before': Decimal('0'),
+                    'stock_after': quantity,
+                    'unit_cost': (amount / quantity).quantize(FOUR_PLACES),
+                    'cost_amount': amount,
+                    'notes': 'Opening stock (import)',
+                })
+                layers.extend({'product_id': new_ids[code], 'quantity': layer.quantity,
+                               'unit_cost': layer.unit_cost} for layer in open_layers)
+
+            db.session.execute(insert(StockMovement.__table__), movements)
+            Metrics.on_commit(db.session, 'billpro_stock_movements_total', 'ADJUSTMENT',
+                              amount=len(movements))
+            if layers:
+                db.session.execute(insert(CostLayer.__table__), layers)
+
+    @staticmethod
+    def _product_values(row):
+        values = _present({
+            'name': _text(row, 'name', 200),
+            'description': _text(row, 'description'),
+            'hsn_code': _text(row, 'hsn_code', 8),
+            'gst_percent': _decimal(row, 'gst_percent', 0),
+            'cost_price': _decimal(row, 'cost_price', 0),
+            'selling_price': _decimal(row, 'selling_price', 0),
+            'mrp': _decimal(row, 'mrp', 0),
+            'unit': _text(row, 'unit', 20),
+            'low_stock_threshold': _decimal(row, 'low_stock_threshold', 0),
+            'costing_method': _text(row, 'costing_method'),
+        })
+
+        if 'hsn_code' in values and not HSN_PATTERN.match(values['hsn_code']):
+            raise RowError(f'HSN code "{values["hsn_code"]}" must be 4 to 8 digits')
+        if 'gst_percent' in values and values['gst_percent'] not in Config.DEFAULT_GST_RATES:
+            raise RowError(f'GST rate {values["gst_percent"]} is not one of '
+                           f'{", ".join(str(r) for r in Config.DEFAULT_GST_RATES)}')
+        if 'unit' in values:
+            values['unit'] = values['unit'].upper()
+        if 'costing_method' in values:
+            values['costing_method'] = values['costing_method'].upper()
+            if values['costing_method'] not in COSTING_METHODS:
+                raise RowError(f'costing method must be one of {", ".join(COSTING_METHODS)}')
+        return values
+
+    # Parties
+
+    @classmethod
+    def _import_parties(cls, chunk, result, context):
+        rows = cls._codes(chunk, result, context)
+        existing = cls._existing(Party, [code for _, code, _ in rows])
+
+        inserts, updates, opening = [], [], {}
+        for line, code, row in rows:
+            try:
+                values = cls._party_values(row)
+                opening_balance = _decimal(row, 'opening_balance')
+                if code not in existing:
+                    if not values.get('name'):
+                        raise RowError('name is required for a new party')
+                    if not values.get('party_type'):
+                        raise RowError('party_type is required for a new party')
+            except RowError as e:
+                cls._error(result, line, code, str(e))
+                continue
+
+            if code in existing:
+                # Balances are only set when a party is created
+                updates.append(dict(values, id=existing[code]))
+            else:
+                inserts.append(dict(values, code=code,
+                                    opening_balance=opening_balance or Decimal('0'),
+                                    current_balance=opening_balance or Decimal('0')))
+                if opening_balance:
+                    opening[code] = opening_balance
+
+        cls._write(Party, inserts, updates, result)
+
+        if opening:
+            new_ids = cls._existing(Party, list(opening))
+            db.session.execute(insert(PartyTransaction), [{
+                'party_id': new_ids[code],
+                'transaction_date': date.today(),
+                'transaction_type': 'OPENING',
+                'reference_type': 'OPENING',
+                'debit': balance if balance > 0 else 0,
+                'credit': abs(balance) if balance < 0 else 0,
+                'balance': balance,
+                'narration': 'Opening Balance',
+            } for code, balance in opening.items()])
+
+    @staticmethod
+    def _party_values(row):
+        values = _present({
+            'name': _text(row, 'name', 200),
+            'party_type': _text(row, 'party_type'),
+            'gstin': _text(row, 'gstin'),
+            'pan': _text(row, 'pan'),
+            'contact_person': _text(row, 'contact_person', 100),
+            'phone': _text(row, 'phone', 15),
+            'email': _text(row, 'email', 100),
+            'address_line1': _text(row, 'address_line1', 200),
+            'address_line2': _text(row, 'address_line2', 200),
+            'city': _text(row, 'city', 100),
+            'state': _text(row, 'state', 100),
+            'state_code': _text(row, 'state_code'),
+            'pincode': _text(row, 'pincode', 10),
+            'credit_limit': _decimal(row, 'credit_limit', 0),
+            'credit_days': _decimal(row, 'credit_days', 0),
+        })
+
+        if 'party_type' in values:
+            values['party_type'] = values['party_type'].lower()
+            if values['party_type'] not in PARTY_TYPES:
+                raise RowError('party_type must be customer or supplier')
+        if 'credit_days' in values:
+            values['credit_days'] = int(values['credit_days'])
+        if 'state_code' in values:
+            values['state_code'] = values['state_code'].zfill(2)
+            if values['state_code'] not in Config.STATE_CODES:
+                raise RowError(f'unknown state code {values["state_code"]}')
+        if 'pan' in values:
+            values['pan'] = values['pan'].upper()
+            if not PAN_PATTERN.match(values['pan']):
+                raise RowError(f'PAN "{values["pan"]}" is not valid')
+
+        if 'gstin' in values:
+            gstin = values['gstin'] = values['gstin'].upper()
+            valid, message = TaxCalculator.validate_gstin(gstin)
+            if not valid:
+                raise RowError(f'{gstin}: {message}')
+            if not GSTIN_PATTERN.match(gstin):
+                raise RowError(f'{gstin}: GSTIN does not contain a valid PAN and entity code')
+            if values.setdefault('state_code', gstin[:2]) != gstin[:2]:
+                raise RowError(f'state code {values["state_code"]} does not match GSTIN {gstin}')
+            if values.setdefault('pan', gstin[2:12]) != gstin[2:12]:
+                raise RowError(f'PAN {values["pan"]} does not match GSTIN {gstin}')
+
+        if 'state_code' in values and 'state' not in values:
+            values['state'] = Config.STATE_CODES[values['state_code']]
+        return values
+
+    # Opening stock
+
+    @classmethod
+    def _import_stock(cls, chunk, result, context):
+        rows = cls._codes(chunk, result, context)
+        existing = cls._existing(Product, [code for _, code, _ in rows])
+
+        # Opening stock only starts a product's history; posting it again
+        # (e.g. the same file uploaded twice) would add to the stock
+        movement = FinancialYearArchive.span(StockMovement)
+        stocked = {product_id for (product_id,) in db.session.query(movement.product_id)
+                   .filter(movement.product_id.in_(list(existing.values()))).distinct()}
+
+        receipts = []
+        for line, code, row in rows:
+            try:
+                if code not in existing:
+                    raise RowError('no product with this code')
+                quantity = _decimal(row, 'quantity', 0)
+                if not quantity:
+                    raise RowError('quantity is required')
+                if existing[code] in stocked:
+                    raise RowError('product already has stock movements; adjust its stock instead')
+                receipts.append((existing[code], quantity, _decimal(row, 'unit_cost', 0)))
+            except RowError as e:
+                cls._error(result, line, code, str(e))
+
+        CostingEngine.post_receipts(receipts, notes='Opening stock (import)')
+        result['updated'] += len(receipts)
@@ -0,0 +1,184 @@
+"""
+Inventory Valuation Service
+Stock value at cost computed in SQL, with an incrementally maintained total
+"""
+import threading
+from decimal import Decimal
+from sqlalchemy import event, func, case, inspect
+from sqlalchemy.orm import Session
+
+from app.models.base import db
+from app.models.product import Product, ProductCategory
+from app.services.metrics import Metrics
+
+
+TWO_PLACES = Decimal('0.01')
+
+# Costed stock value, or stock at the current cost price until costing has run
+STOCK_VALUE = func.coalesce(
+    Product.cost_value,
+    func.coalesce(Product.current_stock, 0) * func.coalesce(Product.cost_price, 0)
+)
+
+
+def _to_decimal(value):
+    return Decimal(str(value or 0))
+
+
+class InventoryValuation:
+    """Inventory value at cost"""
+
+    _total = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def total(cls):
+        """Total value of active stock, kept in memory after the first query"""
+        with cls._lock:
+            if cls._total is not None:
+                Metrics.inc('billpro_cache_hits_total', 'inventory_value')
+            else:
+                Metrics.inc('billpro_cache_misses_total', 'inventory_value')
+                value = db.session.query(func.sum(STOCK_VALUE))\
+                    .filter(Product.is_active == True).scalar()
+                cls._total = _to_decimal(value).quantize(TWO_PLACES)
+            return cls._total
+
+    @classmethod
+    def apply_delta(cls, delta):
+        """Adjust the cached total by a committed change in stock value"""
+        with cls._lock:
+            if cls._total is not None:
+                cls._total = (cls._total + delta).quantize(TWO_PLACES)
+
+    @classmethod
+    def invalidate(cls):
+        """Forget the cached total (after bulk SQL updates to products)"""
+        with cls._lock:
+            cls._total = None
+
+    @staticmethod
+    def summary():
+        """Active and low-stock product counts in one query"""
+        total_products, low_stock_count = db.session.query(
+            func.count(Product.id),
+            func.sum(case((Product.current_stock <= Product.low_stock_threshold, 1), else_=0))
+        ).filter(Product.is_active == True).one()
+        return total_products or 0, low_stock_count or 0
+
+    @staticmethod
+    def by_category():
+        """Product count, quantity and value per category"""
+        rows = db.session.query(
+            ProductCategory.name,
+            func.count(Product.id),
+            func.sum(Product.current_stock),
+            func.sum(STOCK_VALUE)
+        ).outerjoin(ProductCategory, Product.category_id == ProductCategory.id)\
+         .filter(Product.is_active == True)\
+         .group_by(Product.category_id)\
+         .order_by(func.sum(STOCK_VALUE).desc()).all()
+
+        return [{
+            'category': name or 'Uncategorised',
+            'products': count,
+            'quantity': _to_decimal(quantity),
+            'value': _to_decimal(value).quantize(TWO_PLACES),
+        } for name, count, quantity, value in rows]
+
+    @staticmethod
+    def detail(batch_size=500):
+        """Yield per-product valuation rows, fetched in batches"""
+        query = db.session.query(
+            Product.id,
+            Product.name,
+            Product.code,
+            Product.current_stock,
+            Product.unit,
+            func.coalesce(Product.average_cost, Product.cost_price),
+            STOCK_VALUE
+        ).filter(Product.is_active == True).order_by(Product.name)
+
+        for product_id, name, code, stock, unit, unit_cost, value in query.yield_per(batch_size):
+            yield {
+                'id': product_id,
+                'name': name,
+                'code': code,
+                'stock': stock,
+                'unit': unit,
+                'unit_cost': unit_cost,
+                'value': _to_decimal(value).quantize(TWO_PLACES),
+            }
+
+
+def _product_value(stock, cost_price, is_active, cost_value):
+    if not is_active:
+        return Decimal('0')
+    if cost_value is not None:
+        return _to_decimal(cost_value)
+    return _to_decimal(stock) * _to_decimal(cost_price)
+
+
+def _old_value(product):
+    """Stock value as last loaded from the database, or None if it was never loaded"""
+    state = inspect(product)
+    values = []
+    for attr in ('current_stock', 'cost_price', 'is_active', 'cost_value'):
+        history = state.attrs[attr].history
+        if history.deleted:
+            values.append(history.deleted[0])
+        elif history.added:
+            return None
+        else:
+            values.append(getattr(product, attr))
+    return _product_value(*values)
+
+
+@event.listens_for(Session, 'before_flush')
+def _track_stock_value(session, flush_context, instances):
+    """Collect stock value changes made through the ORM until commit"""
+    delta = Decimal('0')
+    stale = False
+
+    for obj in session.new:
+        if isinstance(obj, Product):
+            delta += _product_value(obj.current_stock, obj.cost_price,
+                                    True if obj.is_active is None else obj.is_active,
+                                    obj.cost_value)
+
+    for obj in session.dirty:
+        if isinstance(obj, Product) and session.is_modified(obj):
+            old_value = _old_value(obj)
+            if old_value is None:
+                stale = True
+            else:
+                delta += _product_value(obj.current_stock, obj.cost_price,
+                                        obj.is_active, obj.cost_value) - old_value
+
+    for obj in session.deleted:
+        if isinstance(obj, Product):
+            old_value = _old_value(obj)
+            if old_value is None:
+                stale = True
+            else:
+                delta -= old_value
+
+    if stale:
+        session.info['stock_value_stale'] = True
+    if delta:
+        session.info['stock_value_delta'] = session.info.get('stock_value_delta', Decimal('0')) + delta
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_stock_value(session):
+    delta = session.info.pop('stock_value_delta', None)
+    if session.info.pop('stock_value_stale', False):
+        InventoryValuation.invalidate()
+    elif delta:
+        InventoryValuation.apply_delta(delta)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_stock_value(session, previous_transaction):
+    session.info.pop('stock_value_delta', None)
+    session.info.pop('stock_value_stale', None)
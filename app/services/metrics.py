@@ -0,0 +1,237 @@
+"""
+Metrics
+Billing throughput and latency counters, served at /metrics in the
+Prometheus text format
+"""
+import threading
+import time
+from bisect import bisect_left
+
+from flask import g, has_request_context, request
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from app.models.invoice import Invoice
+from app.models.party import PartyTransaction
+from app.models.product import StockMovement
+
+
+# Upper bounds in seconds; the last bucket (+Inf) is implied
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# name: (help, label names)
+COUNTERS = {
+    'billpro_invoices_created_total': ('Invoices created', ()),
+    'billpro_invoices_cancelled_total': ('Invoices cancelled', ()),
+    'billpro_payments_received_total': ('Receipts recorded against party ledgers', ()),
+    'billpro_stock_movements_total': ('Stock movements recorded', ('type',)),
+    'billpro_print_jobs_total': ('Thermal print jobs', ('result',)),
+    'billpro_sqlite_lock_errors_total': ('Statements that gave up waiting for a SQLite lock', ()),
+    'billpro_cache_hits_total': ('In-process cache lookups answered from memory', ('cache',)),
+    'billpro_cache_misses_total': ('In-process cache lookups that had to query', ('cache',)),
+}
+
+HISTOGRAMS = {
+    'billpro_request_seconds': ('Request latency by endpoint', ('endpoint',)),
+    'billpro_invoice_create_seconds': ('Invoice creation from form post to commit', ()),
+}
+
+GAUGES = {
+    'billpro_startup_seconds': ('Time create_app spent in each startup phase', ('phase',)),
+}
+
+# Requests that are never timed
+SKIPPED_ENDPOINTS = ('static', 'metrics')
+
+# One shard of counters and histograms per thread id. Only the owning thread
+# writes to a shard, so recording takes no lock; a scrape adds the shards up.
+# Thread ids are reused by the OS, so the shard count stays near the pool size.
+_shards = {}
+_shards_lock = threading.Lock()
+
+# Gauges are set rarely and only ever replaced, so they share one dict
+_gauges = {}
+
+
+def _shard():
+    ident = threading.get_ident()
+    shard = _shards.get(ident)
+    if shard is None:
+        with _shards_lock:
+            shard = _shards.setdefault(ident, ({}, {}))
+    return shard
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """Per-thread counters and histograms with a Prometheus text exposition"""
+
+    @staticmethod
+    def inc(name, *labels, amount=1):
+        counters = _shard()[0]
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + amount
+
+    @staticmethod
+    def observe(name, seconds, *labels):
+        histograms = _shard()[1]
+        key = (name, labels)
+        histogram = histograms.get(key)
+        if histogram is None:
+            # One count per bucket, then +Inf, then the sum
+            histogram = histograms[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+        histogram[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        histogram[-1] += seconds
+
+    @staticmethod
+    def set(name, value, *labels):
+        _gauges[(name, labels)] = value
+
+    @staticmethod
+    def on_commit(session, name, *labels, amount=1):
+        """Count something once the session's transaction commits"""
+        session.info.setdefault('metrics', []).append((name, labels, amount))
+
+    @staticmethod
+    def snapshot():
+        """Counters and histograms summed over every thread"""
+        counters, histograms = {}, {}
+        with _shards_lock:
+            shards = list(_shards.values())
+        for shard_counters, shard_histograms in shards:
+            for key, value in dict(shard_counters).items():
+                counters[key] = counters.get(key, 0) + value
+            for key, histogram in dict(shard_histograms).items():
+                total = histograms.setdefault(key, [0] * len(histogram[:-1]) + [0.0])
+                for i, value in enumerate(list(histogram)):
+                    total[i] += value
+        return counters, histograms
+
+    @classmethod
+    def render(cls):
+        """All metrics in the Prometheus text exposition format"""
+        counters, histograms = cls.snapshot()
+        lines = []
+
+        for name, (help_text, label_names) in COUNTERS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            series = sorted((labels, value) for (key, labels), value in counters.items() if key == name)
+            if not series and not label_names:
+                series = [((), 0)]
+            for labels, value in series:
+                lines.append(f'{name}{_labels(label_names, labels)} {_number(value)}')
+
+        lines.append('# HELP billpro_cache_hit_ratio Share of cache lookups answered from memory')
+        lines.append('# TYPE billpro_cache_hit_ratio gauge')
+        caches = sorted({labels for (name, labels) in counters
+                         if name in ('billpro_cache_hits_total', 'billpro_cache_misses_total')})
+        for labels in caches:
+            hits = counters.get(('billpro_cache_hits_total', labels), 0)
+            misses = counters.get(('billpro_cache_misses_total', labels), 0)
+            lines.append(f'billpro_cache_hit_ratio{_labels(("cache",), labels)} '
+                         f'{_number(hits / (hits + misses))}')
+
+        for name, (help_text, label_names) in GAUGES.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            for (key, labels), value in sorted(_gauges.items()):
+                if key == name:
+                    lines.append(f'{name}{_labels(label_names, labels)} {_number(value)}')
+
+        for name, (help_text, label_names) in HISTOGRAMS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            for (key, labels), histogram in sorted(histograms.items()):
+                if key != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), histogram):
+                    cumulative += count
+                    le = _labels(label_names + ('le',), labels + (bound,))
+                    lines.append(f'{name}_bucket{le} {cumulative}')
+                lines.append(f'{name}_sum{_labels(label_names, labels)} {_number(histogram[-1])}')
+                lines.append(f'{name}_count{_labels(label_names, labels)} {cumulative}')
+
+        return '\n'.join(lines) + '\n'
+
+    @classmethod
+    def init_app(cls, app, *engines):
+        """Time requests, count lock errors on the engines and serve /metrics"""
+        if not app.config.get('METRICS'):
+            return
+
+        for engine in engines:
+            event.listen(engine, 'handle_error', _count_lock_error)
+
+        @app.before_request
+        def start_metrics_timer():
+            if request.endpoint not in SKIPPED_ENDPOINTS:
+                g.metrics_started = time.perf_counter()
+
+        @app.after_request
+        def record_request_time(response):
+            started = g.pop('metrics_started', None)
+            if started is not None:
+                elapsed = time.perf_counter() - started
+                cls.observe('billpro_request_seconds', elapsed, request.endpoint or '(unmatched)')
+                if g.pop('metrics_invoice_created', False):
+                    cls.observe('billpro_invoice_create_seconds', elapsed)
+            return response
+
+        app.add_url_rule('/metrics', 'metrics', cls.view)
+
+    @classmethod
+    def view(cls):
+        return cls.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+def _count_lock_error(context):
+    if 'database is locked' in str(context.original_exception):
+        Metrics.inc('billpro_sqlite_lock_errors_total')
+
+
+@event.listens_for(Session, 'before_flush')
+def _track_documents(session, flush_context, instances):
+    """Queue counts for documents written through the ORM until commit"""
+    for obj in session.new:
+        if isinstance(obj, Invoice):
+            Metrics.on_commit(session, 'billpro_invoices_created_total')
+        elif isinstance(obj, StockMovement):
+            Metrics.on_commit(session, 'billpro_stock_movements_total', obj.movement_type)
+        elif isinstance(obj, PartyTransaction) and obj.transaction_type == 'RECEIPT':
+            Metrics.on_commit(session, 'billpro_payments_received_total')
+
+    for obj in session.dirty:
+        if isinstance(obj, Invoice) and 'CANCELLED' in inspect(obj).attrs.status.history.added:
+            Metrics.on_commit(session, 'billpro_invoices_cancelled_total')
+
+
+@event.listens_for(Session, 'after_commit')
+def _count_documents(session):
+    pending = session.info.pop('metrics', None)
+    if not pending:
+        return
+    for name, labels, amount in pending:
+        Metrics.inc(name, *labels, amount=amount)
+        if name == 'billpro_invoices_created_total' and has_request_context():
+            g.metrics_invoice_created = True
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_documents(session, previous_transaction):
+    session.info.pop('metrics', None)
@@ -0,0 +1,248 @@
+"""
+Payroll Service
+Batched monthly payroll processing and salary disbursement
+"""
+import threading
+from datetime import date, datetime
+from decimal import Decimal
+from sqlalchemy import insert, update
+
+from app.models.base import db
+from app.models.employee import Employee, SalarySlip, calculate_salary_components
+from app.models.accounting import Expense, CashTransaction, BankTransaction
+
+
+_progress = {}
+_progress_lock = threading.Lock()
+
+
+class PayrollProcessor:
+    """Monthly payroll run computed and inserted in batches"""
+
+    BATCH_SIZE = 1000
+
+    @staticmethod
+    def _set_progress(month, year, **values):
+        with _progress_lock:
+            _progress.setdefault((year, month), {}).update(values)
+
+    @staticmethod
+    def get_progress(month, year):
+        """Progress of the latest run for a month (status, total, done)"""
+        with _progress_lock:
+            return dict(_progress.get((year, month), {'status': 'idle', 'total': 0, 'done': 0}))
+
+    @classmethod
+    def process_month(cls, month, year, total_days, attendance=None, employee_ids=None):
+        """
+        Create salary slips for every active employee without one for the month.
+        attendance maps employee id -> dict with days_worked, bonus and
+        loan_deduction; employees missing from it worked all total_days.
+        Returns (processed, skipped).
+        """
+        attendance = attendance or {}
+        cls._set_progress(month, year, status='running', total=0, done=0)
+
+        try:
+            existing = {emp_id for (emp_id,) in db.session.query(SalarySlip.employee_id).filter(
+                SalarySlip.salary_month == month,
+                SalarySlip.salary_year == year
+            )}
+
+            query = db.session.query(
+                Employee.id,
+                Employee.basic_salary,
+                Employee.hra,
+                Employee.da,
+                Employee.other_allowances,
+                Employee.pf_deduction,
+                Employee.esi_deduction,
+                Employee.other_deductions
+            ).filter(Employee.is_active == True)
+
+            employees = [emp for emp in query if emp.id not in existing]
+            if employee_ids is not None:
+                selected = set(employee_ids)
+                employees = [emp for emp in employees if emp.id in selected]
+
+            cls._set_progress(month, year, total=len(employees))
+
+            created_at = datetime.utcnow()
+            rows = []
+            done = 0
+
+            for emp in employees:
+                entry = attendance.get(emp.id, {})
+                days_worked = entry.get('days_worked', total_days)
+                bonus = entry.get('bonus', Decimal('0'))
+                loan_deduction = entry.get('loan_deduction', Decimal('0'))
+
+                row = calculate_salary_components(
+                    emp, total_days, days_worked, total_days - days_worked,
+                    bonus=bonus, loan_deduction=loan_deduction
+                )
+                row.update({
+                    'employee_id': emp.id,
+                    'salary_month': month,
+                    'salary_year': year,
+                    'total_working_days': total_days,
+                    'days_worked': days_worked,
+                    'days_absent': total_days - days_worked,
+                    'bonus': bonus,
+                    'overtime': Decimal('0'),
+                    'tds': Decimal('0'),
+                    'loan_deduction': loan_deduction,
+                    'is_paid': False,
+                    'created_at': created_at,
+                })
+                rows.append(row)
+
+                if len(rows) >= cls.BATCH_SIZE:
+                    db.session.execute(insert(SalarySlip), rows)
+                    done += len(rows)
+                    rows = []
+                    cls._set_progress(month, year, done=done)
+
+            if rows:
+                db.session.execute(insert(SalarySlip), rows)
+                done += len(rows)
+
+            db.session.commit()
+            cls._set_progress(month, year, status='done', done=done)
+
+            return done, len(existing)
+
+        except Exception:
+            db.session.rollback()
+            cls._set_progress(month, year, status='failed')
+            raise
+
+
+# Transfers at or above this amount go by RTGS, smaller ones by NEFT
+RTGS_MINIMUM = Decimal('200000')
+
+
+class SalaryDisbursement:
+    """Bulk salary payment and bank transfer file"""
+
+    @staticmethod
+    def pay_slips(slip_ids, payment_mode='BANK', reference='', payment_date=None):
+        """
+        Mark unpaid slips as paid and book their expense and cash/bank entries
+        in one transaction. Returns (slips paid, total amount).
+        """
+        payment_date = payment_date or date.today()
+
+        try:
+            # Claim the slips first: of two overlapping payments only one
+            # sees a slip as unpaid, so its salary is booked once
+            claimed = db.session.execute(
+                update(SalarySlip)
+                .where(SalarySlip.id.in_(slip_ids), SalarySlip.is_paid == False)
+                .values(is_paid=True, payment_date=payment_date,
+                        payment_mode=payment_mode, payment_reference=reference)
+                .returning(SalarySlip.id)
+            ).scalars().all()
+
+            if not claimed:
+                db.session.rollback()
+                return 0, Decimal('0')
+
+            slips = db.session.query(
+                SalarySlip.id,
+                SalarySlip.net_salary,
+                SalarySlip.salary_month,
+                SalarySlip.salary_year,
+                Employee.name
+            ).join(Employee, SalarySlip.employee_id == Employee.id)\
+             .filter(SalarySlip.id.in_(claimed)).all()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        created_at = datetime.utcnow()
+        expenses = []
+        entries = []
+        total = Decimal('0')
+
+        for slip_id, net_salary, month, year, name in slips:
+            net_salary = net_salary or Decimal('0')
+            total += net_salary
+
+            expenses.append({
+                'expense_date': payment_date,
+                'description': f'Salary - {name} ({month}/{year})',
+                'amount': net_salary,
+                'payment_mode': payment_mode,
+                'reference_number': reference,
+                'vendor_name': name,
+                'created_at': created_at,
+            })
+
+            entry = {
+                'transaction_date': payment_date,
+                'description': f'Salary payment - {name}',
+                'reference_type': 'SALARY',
+                'reference_id': slip_id,
+                'reference_number': reference,
+                'created_at': created_at,
+            }
+            if payment_mode == 'CASH':
+                entry.update({'transaction_type': 'PAYMENT', 'payment': net_salary})
+            else:
+                entry.update({'transaction_type': 'WITHDRAWAL', 'withdrawal': net_salary})
+            entries.append(entry)
+
+        try:
+            db.session.execute(insert(Expense), expenses)
+            entry_model = CashTransaction if payment_mode == 'CASH' else BankTransaction
+            db.session.execute(insert(entry_model), entries)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        return len(slips), total
+
+    @staticmethod
+    def bank_transfer_rows(month, year, slip_ids=None, batch_size=1000):
+        """
+        Yield NEFT/RTGS bulk upload rows for a month's unpaid slips, header
+        first. Slips of employees without an account number or IFSC are left out.
+        """
+        query = db.session.query(
+            SalarySlip.id,
+            SalarySlip.net_salary,
+            Employee.employee_code,
+            Employee.name,
+            Employee.bank_account,
+            Employee.ifsc_code
+        ).join(Employee, SalarySlip.employee_id == Employee.id)\
+         .filter(
+            SalarySlip.salary_month == month,
+            SalarySlip.salary_year == year,
+            SalarySlip.is_paid == False,
+            SalarySlip.net_salary > 0,
+            Employee.bank_account.isnot(None), Employee.bank_account != '',
+            Employee.ifsc_code.isnot(None), Employee.ifsc_code != ''
+        ).order_by(SalarySlip.id)
+
+        if slip_ids:
+            query = query.filter(SalarySlip.id.in_(slip_ids))
+
+        yield ['Sr No', 'Transfer Type', 'Beneficiary Name', 'Account Number',
+               'IFSC Code', 'Amount', 'Narration', 'Employee Code']
+
+        narration = f'SALARY {month:02d}/{year}'
+        for serial, (slip_id, net_salary, code, name, account, ifsc) in \
+                enumerate(query.yield_per(batch_size), start=1):
+            yield [
+                serial,
+                'RTGS' if net_salary >= RTGS_MINIMUM else 'NEFT',
+                name,
+                account.strip(),
+                ifsc.strip().upper(),
+                f'{net_salary:.2f}',
+                narration,
+                code or '',
+            ]
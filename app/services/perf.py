@@ -0,0 +1,166 @@
+"""
+Performance Monitor
+Opt-in per-request timings: wall time, SQL statement count and time, the
+slowest statements and template render time, kept in a rolling buffer
+"""
+import math
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from flask import g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+
+from config.settings import Config
+
+
+# Requests that are never recorded
+SKIPPED_ENDPOINTS = ('static', 'perf')
+
+_requests = deque(maxlen=Config.PERF_BUFFER_SIZE)
+_requests_lock = threading.Lock()
+
+
+def _percentile(values, pct):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(pct / 100 * len(values)) - 1)]
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'perf' in g:
+        context._perf_start = time.perf_counter()
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, '_perf_start', None)
+    if start is None or not has_request_context() or 'perf' not in g:
+        return
+    elapsed = (time.perf_counter() - start) * 1000
+    perf = g.perf
+    perf['sql_count'] += 1
+    perf['sql_ms'] += elapsed
+
+    slowest = perf['slowest']
+    if len(slowest) < Config.PERF_SLOWEST_KEPT or elapsed > slowest[-1][0]:
+        slowest.append((elapsed, statement))
+        slowest.sort(key=lambda s: s[0], reverse=True)
+        del slowest[Config.PERF_SLOWEST_KEPT:]
+
+
+def _before_render(sender, template, context, **extra):
+    if 'perf' in g:
+        g.perf['render_started'] = time.perf_counter()
+
+
+def _rendered(sender, template, context, **extra):
+    if 'perf' in g and g.perf.get('render_started'):
+        g.perf['template_ms'] += (time.perf_counter() - g.perf.pop('render_started')) * 1000
+
+
+class PerfMonitor:
+    """Request and SQL timings for finding slow pages"""
+
+    @classmethod
+    def init_app(cls, app, *engines):
+        """Instrument the app and its engines when PERF_MONITOR is on"""
+        if not app.config.get('PERF_MONITOR'):
+            return
+
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', _before_execute)
+            event.listen(engine, 'after_cursor_execute', _after_execute)
+        before_render_template.connect(_before_render, app)
+        template_rendered.connect(_rendered, app)
+
+        @app.before_request
+        def start_timing():
+            if request.endpoint not in SKIPPED_ENDPOINTS:
+                g.perf = {
+                    'started': time.perf_counter(),
+                    'sql_count': 0,
+                    'sql_ms': 0.0,
+                    'template_ms': 0.0,
+                    'slowest': [],
+                }
+
+        @app.after_request
+        def record_timing(response):
+            perf = g.pop('perf', None)
+            if perf is not None:
+                cls.record({
+                    'at': datetime.now(),
+                    'endpoint': request.endpoint or '(unmatched)',
+                    'method': request.method,
+                    'path': request.path,
+                    'status': response.status_code,
+                    'wall_ms': (time.perf_counter() - perf['started']) * 1000,
+                    'sql_count': perf['sql_count'],
+                    'sql_ms': perf['sql_ms'],
+                    'template_ms': perf['template_ms'],
+                    'slowest': perf['slowest'],
+                })
+            return response
+
+        app.add_url_rule('/debug/perf', 'perf', cls.view, methods=['GET', 'POST'])
+
+    @staticmethod
+    def record(entry):
+        with _requests_lock:
+            _requests.append(entry)
+
+    @staticmethod
+    def recent(limit=None):
+        """Recorded requests, newest first"""
+        with _requests_lock:
+            entries = list(_requests)
+        entries.reverse()
+        return entries[:limit] if limit else entries
+
+    @staticmethod
+    def clear():
+        with _requests_lock:
+            _requests.clear()
+
+    @classmethod
+    def summary(cls):
+        """Per-endpoint request count, wall-time percentiles and SQL averages, slowest p95 first"""
+        by_endpoint = {}
+        for entry in cls.recent():
+            by_endpoint.setdefault(entry['endpoint'], []).append(entry)
+
+        rows = []
+        for endpoint, entries in by_endpoint.items():
+            wall = sorted(e['wall_ms'] for e in entries)
+            count = len(entries)
+            rows.append({
+                'endpoint': endpoint,
+                'count': count,
+                'p50': _percentile(wall, 50),
+                'p95': _percentile(wall, 95),
+                'p99': _percentile(wall, 99),
+                'max': wall[-1],
+                'sql_count': sum(e['sql_count'] for e in entries) / count,
+                'sql_ms': sum(e['sql_ms'] for e in entries) / count,
+                'template_ms': sum(e['template_ms'] for e in entries) / count,
+            })
+        return sorted(rows, key=lambda r: r['p95'], reverse=True)
+
+    @classmethod
+    def view(cls):
+        """Debug page with endpoint percentiles and the slowest recent requests"""
+        from flask import render_template, redirect, url_for, jsonify
+
+        if request.method == 'POST':
+            cls.clear()
+            return redirect(url_for('perf'))
+
+        summary = cls.summary()
+        if request.args.get('format') == 'json':
+            return jsonify(summary)
+
+        slow = sorted(cls.recent(), key=lambda e: e['wall_ms'], reverse=True)[:20]
+        return render_template('perf.html', summary=summary, slow=slow,
+                               buffer_size=Config.PERF_BUFFER_SIZE, recorded=len(_requests))
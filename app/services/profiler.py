@@ -0,0 +1,207 @@
+"""
+Request Profiler
+Profiles a single request on demand with cProfile and, optionally,
+tracemalloc. Asked for with the X-Profile header or a _profile query flag
+(1 for CPU, memory for CPU and allocations), from localhost or with the
+profile token.
+"""
+import cProfile
+import hmac
+import json
+import os
+import threading
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+from urllib.parse import parse_qs
+
+from werkzeug.exceptions import HTTPException
+
+from config.settings import Config
+
+
+PROFILE_SUFFIXES = ('.pstats', '.alloc.txt', '.json')
+
+LOCAL_ADDRESSES = ('127.0.0.1', '::1')
+
+# tracemalloc traces the whole process, so memory captures run one at a time
+_memory_lock = threading.Lock()
+
+
+def _requested_mode(environ):
+    """'cpu', 'memory' or None from the X-Profile header or _profile flag"""
+    value = environ.get('HTTP_X_PROFILE')
+    if value is None:
+        value = parse_qs(environ.get('QUERY_STRING', '')).get('_profile', [None])[0]
+    if not value or value == '0':
+        return None
+    return 'memory' if value.lower() == 'memory' else 'cpu'
+
+
+def _allowed(environ):
+    """Profiling is for the shop PC itself or whoever has the token"""
+    if environ.get('REMOTE_ADDR') in LOCAL_ADDRESSES:
+        return True
+    token = environ.get('HTTP_X_PROFILE_TOKEN', '')
+    return bool(Config.PROFILE_TOKEN) and hmac.compare_digest(token, Config.PROFILE_TOKEN)
+
+
+def _allocation_summary(before, after, peak, title):
+    """Top allocation sites by net growth over the request, as text"""
+    ignore = (tracemalloc.Filter(False, tracemalloc.__file__),
+              tracemalloc.Filter(False, __file__))
+    stats = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), 'lineno')
+    net = sum(stat.size_diff for stat in stats)
+
+    lines = [
+        title,
+        f'Peak traced memory: {peak / 1024:.1f} KiB, net growth: {net / 1024:.1f} KiB',
+        '',
+        f'Top {Config.PROFILE_TOP_ALLOCATIONS} allocation sites by net growth:',
+    ]
+    for stat in stats[:Config.PROFILE_TOP_ALLOCATIONS]:
+        frame = stat.traceback[0]
+        lines.append(f'{stat.size_diff / 1024:10.1f} KiB {stat.count_diff:+8d} blocks  '
+                     f'{frame.filename}:{frame.lineno}')
+    return '\n'.join(lines) + '\n'
+
+
+class RequestProfiler:
+    """WSGI middleware that saves a profile for requests that ask for one"""
+
+    def __init__(self, app):
+        self.app = app
+        self.wsgi_app = app.wsgi_app
+
+    @classmethod
+    def init_app(cls, app):
+        app.wsgi_app = cls(app)
+
+        @app.route('/debug/profiles')
+        def profiles():
+            from flask import abort, render_template, request
+            if not _allowed(request.environ):
+                abort(404)
+            return render_template('profiles.html', profiles=cls.profiles(),
+                                   profile_dir=Config.PROFILE_DIR, keep=Config.PROFILE_KEEP)
+
+        @app.route('/debug/profiles/<name>')
+        def download_profile(name):
+            from flask import abort, request, send_file
+            if not _allowed(request.environ):
+                abort(404)
+            try:
+                path = cls.path(name)
+            except ValueError:
+                abort(404)
+            return send_file(path, as_attachment=True, download_name=name)
+
+    def __call__(self, environ, start_response):
+        mode = _requested_mode(environ)
+        if mode is None or not _allowed(environ):
+            return self.wsgi_app(environ, start_response)
+
+        name = self._name(environ)
+
+        def start_profiled_response(status, headers, exc_info=None):
+            return start_response(status, headers + [('X-Profile-Saved', name)], exc_info)
+
+        if mode == 'memory':
+            with _memory_lock:
+                return self._run(environ, start_profiled_response, name, memory=True)
+        return self._run(environ, start_profiled_response, name, memory=False)
+
+    def _name(self, environ):
+        """File name stem: time, endpoint and a short random suffix"""
+        try:
+            endpoint, _ = self.app.url_map.bind_to_environ(environ).match(
+                method=environ.get('REQUEST_METHOD'))
+        except HTTPException:
+            endpoint = 'unmatched'
+        return f'{datetime.now():%Y%m%d-%H%M%S}-{endpoint}-{uuid.uuid4().hex[:6]}'
+
+    def _run(self, environ, start_response, name, memory):
+        """Run the request, body included, under the profilers and save the results"""
+        started_tracing = memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        if memory:
+            tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+
+        profile = cProfile.Profile()
+        started = time.perf_counter()
+        profile.enable()
+        try:
+            result = self.wsgi_app(environ, start_response)
+            try:
+                body = list(result)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+        finally:
+            profile.disable()
+            elapsed = (time.perf_counter() - started) * 1000
+            if memory:
+                after = tracemalloc.take_snapshot()
+                peak = tracemalloc.get_traced_memory()[1]
+                if started_tracing:
+                    tracemalloc.stop()
+
+            title = f"{environ.get('REQUEST_METHOD')} {environ.get('PATH_INFO')}"
+            os.makedirs(Config.PROFILE_DIR, exist_ok=True)
+            stem = os.path.join(Config.PROFILE_DIR, name)
+            profile.dump_stats(stem + '.pstats')
+            if memory:
+                with open(stem + '.alloc.txt', 'w', encoding='utf-8') as f:
+                    f.write(_allocation_summary(before, after, peak, title))
+            with open(stem + '.json', 'w', encoding='utf-8') as f:
+                json.dump({'request': title, 'query': environ.get('QUERY_STRING', ''),
+                           'ms': round(elapsed, 1), 'memory': memory}, f)
+            self.rotate()
+        return body
+
+    @staticmethod
+    def profiles():
+        """Saved profiles, newest first, with their request, time and files"""
+        if not os.path.isdir(Config.PROFILE_DIR):
+            return []
+        rows = []
+        for filename in os.listdir(Config.PROFILE_DIR):
+            if not filename.endswith('.json'):
+                continue
+            name = filename[:-len('.json')]
+            path = os.path.join(Config.PROFILE_DIR, filename)
+            try:
+                with open(path, encoding='utf-8') as f:
+                    info = json.load(f)
+            except (OSError, ValueError):
+                continue
+            info.update({
+                'name': name,
+                'created_at': datetime.fromtimestamp(os.path.getmtime(path)),
+                'files': [name + suffix for suffix in PROFILE_SUFFIXES[:2]
+                          if os.path.exists(os.path.join(Config.PROFILE_DIR, name + suffix))],
+            })
+            rows.append(info)
+        return sorted(rows, key=lambda r: r['created_at'], reverse=True)
+
+    @staticmethod
+    def path(name):
+        """Full path of a profile file, refusing anything outside the profile folder"""
+        if os.path.basename(name) != name or not name.endswith(PROFILE_SUFFIXES):
+            raise ValueError(f'Not a profile file: {name}')
+        path = os.path.join(Config.PROFILE_DIR, name)
+        if not os.path.exists(path):
+            raise ValueError(f'Profile not found: {name}')
+        return path
+
+    @classmethod
+    def rotate(cls):
+        """Delete all but the newest PROFILE_KEEP profiles"""
+        for profile in cls.profiles()[Config.PROFILE_KEEP:]:
+            for suffix in PROFILE_SUFFIXES:
+                path = os.path.join(Config.PROFILE_DIR, profile['name'] + suffix)
+                if os.path.exists(path):
+                    os.remove(path)
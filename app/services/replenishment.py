@@ -0,0 +1,191 @@
+"""
+Replenishment Service
+Sales velocity, days of cover and reorder suggestions computed in batch
+"""
+import math
+import threading
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from sqlalchemy import func, insert, delete
+
+from config.settings import Config
+from app.models.base import db
+from app.models.invoice import Invoice, InvoiceItem
+from app.models.purchase import Purchase, PurchaseItem
+from app.models.party import Party
+from app.models.product import Product, ReorderSuggestion
+
+
+_run_lock = threading.Lock()
+
+
+def _to_decimal(value, places='0.0001'):
+    return Decimal(str(value or 0)).quantize(Decimal(places))
+
+
+class Replenishment:
+    """Reorder suggestions from smoothed daily sales"""
+
+    @staticmethod
+    def last_run():
+        """When the stored suggestions were computed"""
+        return db.session.query(func.max(ReorderSuggestion.computed_at)).scalar()
+
+    @classmethod
+    def run_if_stale(cls):
+        """Recompute unless the suggestions were already computed today"""
+        last = cls.last_run()
+        if last is None or last.date() < date.today():
+            return cls.compute()
+        return None
+
+    @staticmethod
+    def _daily_sales(as_of, days):
+        """{product_id: {days_ago: quantity}} from one grouped query over active invoices"""
+        rows = db.session.query(
+            InvoiceItem.product_id,
+            Invoice.invoice_date,
+            func.sum(InvoiceItem.quantity)
+        ).join(Invoice, InvoiceItem.invoice_id == Invoice.id)\
+         .filter(
+            Invoice.status == 'ACTIVE',
+            Invoice.invoice_date > as_of - timedelta(days=days),
+            Invoice.invoice_date <= as_of
+        ).group_by(InvoiceItem.product_id, Invoice.invoice_date)
+
+        sales = {}
+        for product_id, invoice_date, quantity in rows:
+            sales.setdefault(product_id, {})[(as_of - invoice_date).days] = float(quantity or 0)
+        return sales
+
+    @staticmethod
+    def _last_suppliers():
+        """{product_id: party_id} of each product's most recent purchase"""
+        latest = db.session.query(
+            PurchaseItem.product_id,
+            func.max(PurchaseItem.purchase_id).label('purchase_id')
+        ).join(Purchase, PurchaseItem.purchase_id == Purchase.id)\
+         .filter(Purchase.status == 'ACTIVE')\
+         .group_by(PurchaseItem.product_id).subquery()
+
+        return dict(db.session.query(latest.c.product_id, Purchase.party_id)
+                    .join(Purchase, Purchase.id == latest.c.purchase_id))
+
+    @classmethod
+    def compute(cls, as_of=None):
+        """
+        Recompute and store suggestions for every active product.
+        Daily velocity is an exponentially weighted average of daily sales
+        over the history window (normalised for products younger than the
+        window); stock is reordered once it falls to lead-time demand plus
+        the low-stock threshold. Returns products processed.
+        """
+        as_of = as_of or date.today()
+        days = Config.REORDER_HISTORY_DAYS
+        alpha = Config.REORDER_SMOOTHING
+        lead_days = Config.REORDER_LEAD_DAYS
+        cover_days = Config.REORDER_COVER_DAYS
+
+        # Weight of a day's sales by how many days ago they happened
+        weights = [alpha * (1 - alpha) ** k for k in range(days)]
+
+        with _run_lock:
+            sales = cls._daily_sales(as_of, days)
+            suppliers = cls._last_suppliers()
+
+            products = db.session.query(
+                Product.id,
+                Product.current_stock,
+                Product.low_stock_threshold,
+                Product.created_at
+            ).filter(Product.is_active == True)
+
+            computed_at = datetime.utcnow()
+            rows = []
+
+            for product_id, stock, threshold, created_at in products:
+                stock = float(stock or 0)
+                threshold = float(threshold or 0)
+                age = days
+                if created_at:
+                    age = max(1, min(days, (as_of - created_at.date()).days + 1))
+
+                history = sales.get(product_id, {})
+                average = sum(history.values()) / age
+                smoothed = sum(quantity * weights[k] for k, quantity in history.items() if k < age)
+                smoothed /= 1 - (1 - alpha) ** age
+
+                reorder_point = smoothed * lead_days + threshold
+                suggested = 0
+                if stock <= reorder_point and (smoothed > 0 or stock < threshold):
+                    suggested = math.ceil(smoothed * (lead_days + cover_days) + threshold - stock)
+
+                if smoothed > 0:
+                    days_of_cover = _to_decimal(max(stock, 0) / smoothed, '0.1')
+                else:
+                    days_of_cover = None
+
+                rows.append({
+                    'product_id': product_id,
+                    'supplier_id': suppliers.get(product_id),
+                    'avg_daily_sales': _to_decimal(average),
+                    'smoothed_daily_sales': _to_decimal(smoothed),
+                    'current_stock': _to_decimal(stock, '0.001'),
+                    'days_of_cover': days_of_cover,
+                    'reorder_point': _to_decimal(reorder_point, '0.001'),
+                    'suggested_quantity': _to_decimal(max(suggested, 0), '0.001'),
+                    'computed_at': computed_at,
+                })
+
+            try:
+                db.session.execute(delete(ReorderSuggestion))
+                if rows:
+                    db.session.execute(insert(ReorderSuggestion), rows)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+        return len(rows)
+
+    @staticmethod
+    def by_supplier(include_all=False):
+        """Stored suggestions grouped by supplier, most urgent first"""
+        query = db.session.query(
+            ReorderSuggestion,
+            Product.name,
+            Product.code,
+            Product.unit,
+            func.coalesce(Product.average_cost, Product.cost_price),
+            Party.name
+        ).join(Product, ReorderSuggestion.product_id == Product.id)\
+         .outerjoin(Party, ReorderSuggestion.supplier_id == Party.id)
+
+        if not include_all:
+            query = query.filter(ReorderSuggestion.suggested_quantity > 0)
+
+        query = query.order_by(
+            Party.name,
+            func.coalesce(ReorderSuggestion.days_of_cover, 999999),
+            Product.name
+        )
+
+        groups = {}
+        for suggestion, name, code, unit, unit_cost, supplier in query:
+            group = groups.setdefault(suggestion.supplier_id, {
+                'supplier_id': suggestion.supplier_id,
+                'supplier': supplier or 'No supplier on record',
+                'items': [],
+                'value': Decimal('0'),
+            })
+            value = _to_decimal(suggestion.suggested_quantity) * _to_decimal(unit_cost)
+            group['items'].append({
+                'suggestion': suggestion,
+                'name': name,
+                'code': code,
+                'unit': unit,
+                'value': value.quantize(Decimal('0.01')),
+            })
+            group['value'] += value.quantize(Decimal('0.01'))
+
+        return list(groups.values())
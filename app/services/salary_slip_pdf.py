@@ -0,0 +1,238 @@
+"""
+Salary Slip PDF Service
+Renders a month's salary slips to PDF in a background process pool
+"""
+import json
+import multiprocessing
+import os
+import shutil
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from sqlalchemy import func
+
+from config.settings import Config
+from app.models.base import db
+from app.models.employee import Employee, SalarySlip
+from app.services.slip_render import (
+    AMOUNT_FIELDS, _init_worker, _render_chunk, _render_pdf, _render_separate
+)
+
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def _can_merge():
+    """Chunked PDFs need pypdf to be joined into one document"""
+    try:
+        import pypdf  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _merge_pdfs(parts, path):
+    """Concatenate the chunk PDFs in order"""
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    for part in parts:
+        writer.append(part)
+    with open(path, 'wb') as f:
+        writer.write(f)
+
+
+class SalarySlipPrinter:
+    """Batch salary slip PDFs for a month, cached until the slips change"""
+
+    FORMATS = ('zip', 'pdf')
+    CHUNK_SIZE = 100
+    MAX_WORKERS = min(4, os.cpu_count() or 1)
+
+    @staticmethod
+    def _company_header():
+        """Company name and address lines shared with every worker"""
+        company = {}
+        if os.path.exists(Config.COMPANY_CONFIG):
+            with open(Config.COMPANY_CONFIG, 'r') as f:
+                company = json.load(f)
+
+        address = company.get('address') or {}
+        if isinstance(address, dict):
+            address = ', '.join(filter(None, [
+                address.get('line1'), address.get('line2'), address.get('city'),
+                address.get('state'), address.get('pincode')
+            ]))
+
+        lines = [address] if address else []
+        if company.get('gstin'):
+            lines.append(f"GSTIN: {company['gstin']}")
+
+        return {'name': company.get('name', ''), 'header_lines': lines}
+
+    @staticmethod
+    def signature(month, year):
+        """Fingerprint of a month's slips; changes whenever any slip or its employee does"""
+        row = db.session.query(
+            func.count(SalarySlip.id),
+            func.max(SalarySlip.id),
+            func.max(func.coalesce(SalarySlip.updated_at, SalarySlip.created_at)),
+            func.max(Employee.updated_at),
+            func.sum(SalarySlip.net_salary)
+        ).join(Employee, SalarySlip.employee_id == Employee.id)\
+         .filter(SalarySlip.salary_month == month, SalarySlip.salary_year == year).one()
+
+        company_mtime = os.path.getmtime(Config.COMPANY_CONFIG) \
+            if os.path.exists(Config.COMPANY_CONFIG) else None
+
+        return tuple(str(value) for value in row) + (str(company_mtime),)
+
+    @staticmethod
+    def _slip_rows(month, year):
+        """Plain dicts for every slip of the month, ready to send to workers"""
+        query = db.session.query(
+            SalarySlip,
+            Employee.employee_code,
+            Employee.name,
+            Employee.designation,
+            Employee.department,
+            Employee.bank_account,
+            Employee.pan
+        ).join(Employee, SalarySlip.employee_id == Employee.id)\
+         .filter(SalarySlip.salary_month == month, SalarySlip.salary_year == year)\
+         .order_by(Employee.name)
+
+        rows = []
+        for slip, code, name, designation, department, bank_account, pan in query:
+            row = {field: float(getattr(slip, field) or 0) for field in AMOUNT_FIELDS}
+            row.update({
+                'month': month,
+                'year': year,
+                'code': code,
+                'name': name,
+                'designation': designation,
+                'department': department,
+                'bank_account': bank_account,
+                'pan': pan,
+                'total_working_days': slip.total_working_days,
+                'days_worked': slip.days_worked,
+                'days_absent': slip.days_absent,
+                'filename': f'{slip.id}_{(code or name).replace("/", "-")}.pdf',
+            })
+            rows.append(row)
+        return rows
+
+    @staticmethod
+    def _output_path(month, year, fmt):
+        return os.path.join(Config.EXPORTS_DIR, f'salary_slips_{year}_{month:02d}.{fmt}')
+
+    @classmethod
+    def status(cls, month, year, fmt='zip'):
+        """Job status; 'ready' only while the output still matches the slips"""
+        with _jobs_lock:
+            job = dict(_jobs.get((year, month, fmt), {'status': 'idle', 'total': 0, 'done': 0}))
+
+        job['ready'] = job['status'] == 'done' and \
+            job.get('signature') == cls.signature(month, year) and \
+            os.path.exists(cls._output_path(month, year, fmt))
+        if job['status'] == 'done' and not job['ready']:
+            job['status'] = 'stale'
+        job.pop('signature', None)
+        return job
+
+    @classmethod
+    def output(cls, month, year, fmt='zip'):
+        """Path of the generated file, or None if missing or stale"""
+        job = cls.status(month, year, fmt)
+        return cls._output_path(month, year, fmt) if job['ready'] else None
+
+    @classmethod
+    def start(cls, app, month, year, fmt='zip'):
+        """Start a background render unless one is running or the output is current"""
+        if fmt not in cls.FORMATS:
+            raise ValueError(f'Unknown format: {fmt}')
+
+        job = cls.status(month, year, fmt)
+        if job['ready']:
+            return job
+
+        key = (year, month, fmt)
+        with _jobs_lock:
+            if _jobs.get(key, {}).get('status') == 'running':
+                return dict(_jobs[key])
+            _jobs[key] = {'status': 'running', 'total': 0, 'done': 0}
+
+        threading.Thread(target=cls._run, args=(app, month, year, fmt), daemon=True).start()
+        return cls.status(month, year, fmt)
+
+    @classmethod
+    def _update(cls, key, **values):
+        with _jobs_lock:
+            _jobs[key].update(values)
+
+    @classmethod
+    def _run(cls, app, month, year, fmt):
+        """Background thread: gather the slips and fan rendering out to the pool"""
+        key = (year, month, fmt)
+
+        with app.app_context():
+            try:
+                signature = cls.signature(month, year)
+                slips = cls._slip_rows(month, year)
+                db.session.remove()
+
+                cls._update(key, total=len(slips))
+                os.makedirs(Config.EXPORTS_DIR, exist_ok=True)
+                path = cls._output_path(month, year, fmt)
+                work_dir = path + '.parts'
+                shutil.rmtree(work_dir, ignore_errors=True)
+                os.makedirs(work_dir)
+
+                can_merge = _can_merge()
+
+                # Spawned, not forked: this runs beside the web server's threads,
+                # and the frozen exe on Windows can only spawn anyway
+                with ProcessPoolExecutor(max_workers=cls.MAX_WORKERS,
+                                         mp_context=multiprocessing.get_context('spawn'),
+                                         initializer=_init_worker,
+                                         initargs=(cls._company_header(),)) as pool:
+                    if fmt == 'pdf' and can_merge:
+                        # Chunks are drawn in parallel and concatenated afterwards
+                        futures = [
+                            pool.submit(_render_chunk, slips[i:i + cls.CHUNK_SIZE], work_dir, i)
+                            for i in range(0, len(slips), cls.CHUNK_SIZE)
+                        ]
+                    elif fmt == 'pdf':
+                        # reportlab cannot append to an existing PDF, so without
+                        # pypdf the merged document is drawn by a single worker
+                        futures = [pool.submit(_render_pdf, slips, os.path.join(work_dir, 'slips.pdf'))]
+                    else:
+                        futures = [
+                            pool.submit(_render_separate, slips[i:i + cls.CHUNK_SIZE], work_dir)
+                            for i in range(0, len(slips), cls.CHUNK_SIZE)
+                        ]
+
+                    done = 0
+                    for future in as_completed(futures):
+                        done += future.result()
+                        cls._update(key, done=done)
+
+                if fmt == 'pdf' and can_merge:
+                    parts = [os.path.join(work_dir, f'part_{i:05d}.pdf')
+                             for i in range(0, len(slips), cls.CHUNK_SIZE)]
+                    _merge_pdfs(parts, path + '.tmp')
+                    os.replace(path + '.tmp', path)
+                elif fmt == 'pdf':
+                    os.replace(os.path.join(work_dir, 'slips.pdf'), path)
+                else:
+                    with zipfile.ZipFile(path + '.tmp', 'w', zipfile.ZIP_DEFLATED) as archive:
+                        for slip in slips:
+                            archive.write(os.path.join(work_dir, slip['filename']), slip['filename'])
+                    os.replace(path + '.tmp', path)
+
+                shutil.rmtree(work_dir, ignore_errors=True)
+                cls._update(key, status='done', signature=signature)
+
+            except Exception as e:
+                cls._update(key, status='failed', error=str(e))
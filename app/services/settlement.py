@@ -0,0 +1,212 @@
+"""
+Settlement Service
+Applies customer receipts against open sales invoices
+"""
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import func, update, insert, delete
+
+from app.models.base import db
+from app.models.invoice import Invoice, PaymentAllocation
+from app.models.party import Party, PartyTransaction
+from app.services.ageing import OPEN_INVOICES
+
+
+ZERO = Decimal('0')
+
+
+def _d(value):
+    return Decimal(str(value or 0))
+
+
+class SettlementEngine:
+    """Receipt-to-invoice allocation keeping Invoice.amount_due current"""
+
+    @staticmethod
+    def open_invoices(party_id, invoice_ids=None):
+        """Open invoices for a party, oldest first (served by ix_invoices_open_items)"""
+        query = db.session.query(
+            Invoice.id,
+            Invoice.invoice_number,
+            Invoice.invoice_date,
+            Invoice.due_date,
+            Invoice.total_amount,
+            Invoice.amount_paid,
+            Invoice.amount_due
+        ).filter(Invoice.party_id == party_id, OPEN_INVOICES)
+
+        if invoice_ids:
+            query = query.filter(Invoice.id.in_(invoice_ids))
+
+        return query.order_by(Invoice.invoice_date, Invoice.id).all()
+
+    @staticmethod
+    def _apply(amount, items, receipt_id, party_id, allocation_date):
+        """
+        Apply an amount FIFO over open items (dicts with id, amount_paid,
+        amount_due), mutating them. Returns (allocation rows, unapplied amount).
+        """
+        allocations = []
+        remaining = _d(amount)
+
+        for item in items:
+            if remaining <= 0:
+                break
+            if item['amount_due'] <= 0:
+                continue
+
+            applied = min(remaining, item['amount_due'])
+            item['amount_paid'] += applied
+            item['amount_due'] -= applied
+            item['touched'] = True
+            remaining -= applied
+
+            allocations.append({
+                'party_transaction_id': receipt_id,
+                'invoice_id': item['id'],
+                'party_id': party_id,
+                'amount': applied,
+                'allocation_date': allocation_date,
+                'created_at': datetime.utcnow(),
+            })
+
+        return allocations, remaining
+
+    @staticmethod
+    def _write(items, allocations):
+        """Bulk-update touched invoices and bulk-insert allocation rows"""
+        updates = [{
+            'id': item['id'],
+            'amount_paid': item['amount_paid'],
+            'amount_due': item['amount_due'],
+            'payment_status': 'PAID' if item['amount_due'] <= 0 else (
+                'PARTIAL' if item['amount_paid'] > 0 else 'UNPAID'),
+        } for item in items if item.get('touched')]
+
+        if updates:
+            db.session.execute(update(Invoice), updates)
+        if allocations:
+            db.session.execute(insert(PaymentAllocation), allocations)
+
+    @classmethod
+    def allocate_receipt(cls, party_id, receipt_id, amount, allocation_date, invoice_ids=None):
+        """
+        Settle a receipt against the party's open invoices, oldest first, or
+        only against invoice_ids when the user picked them. Any amount left
+        over stays on account until the party's next credit invoice.
+        Returns (allocated, unallocated). Does not commit.
+        """
+        items = [{
+            'id': row.id,
+            'amount_paid': _d(row.amount_paid),
+            'amount_due': _d(row.amount_due),
+        } for row in cls.open_invoices(party_id, invoice_ids)]
+
+        allocations, remaining = cls._apply(amount, items, receipt_id, party_id, allocation_date)
+        cls._write(items, allocations)
+
+        return _d(amount) - remaining, remaining
+
+    @staticmethod
+    def release_invoice(invoice_id):
+        """
+        Put the money allocated to an invoice back on account, e.g. when it
+        is cancelled, and clear its balance. Does not commit.
+        """
+        db.session.execute(delete(PaymentAllocation).where(PaymentAllocation.invoice_id == invoice_id))
+        db.session.execute(
+            update(Invoice).where(Invoice.id == invoice_id)
+            .values(amount_paid=0, amount_due=0)
+            .execution_options(synchronize_session='fetch')
+        )
+
+    @classmethod
+    def apply_open_credit(cls, party_id, allocation_date):
+        """
+        Settle the party's open invoices from receipts still on account,
+        oldest receipt first, e.g. when a credit invoice follows an advance.
+        Returns the amount applied. Does not commit.
+        """
+        allocated = db.session.query(
+            PaymentAllocation.party_transaction_id,
+            func.sum(PaymentAllocation.amount).label('amount')
+        ).filter(PaymentAllocation.party_id == party_id)\
+         .group_by(PaymentAllocation.party_transaction_id).subquery()
+
+        receipts = [(receipt_id, _d(credit) - _d(applied)) for receipt_id, credit, applied in
+                    db.session.query(PartyTransaction.id, PartyTransaction.credit, allocated.c.amount)
+                    .outerjoin(allocated, allocated.c.party_transaction_id == PartyTransaction.id)
+                    .filter(PartyTransaction.party_id == party_id,
+                            PartyTransaction.transaction_type == 'RECEIPT')
+                    .order_by(PartyTransaction.transaction_date, PartyTransaction.id)]
+        receipts = [(receipt_id, amount) for receipt_id, amount in receipts if amount > 0]
+        if not receipts:
+            return ZERO
+
+        items = [{
+            'id': row.id,
+            'amount_paid': _d(row.amount_paid),
+            'amount_due': _d(row.amount_due),
+        } for row in cls.open_invoices(party_id)]
+
+        allocations = []
+        for receipt_id, amount in receipts:
+            rows, _ = cls._apply(amount, items, receipt_id, party_id, allocation_date)
+            allocations.extend(rows)
+        cls._write(items, allocations)
+
+        return sum((row['amount'] for row in allocations), ZERO)
+
+    @classmethod
+    def reallocate(cls, party_ids=None, chunk_size=500):
+        """
+        Rebuild invoice settlement from the ledger history: reset credit
+        invoices to unpaid and replay every RECEIPT FIFO. Parties are
+        processed in chunks, each chunk in one transaction.
+        Returns the number of parties processed.
+        """
+        if party_ids is None:
+            party_ids = [pid for (pid,) in db.session.query(Party.id)
+                         .filter(Party.party_type == 'customer').order_by(Party.id)]
+
+        for start in range(0, len(party_ids), chunk_size):
+            chunk = party_ids[start:start + chunk_size]
+
+            db.session.execute(delete(PaymentAllocation).where(PaymentAllocation.party_id.in_(chunk)))
+            db.session.execute(
+                update(Invoice)
+                .where(Invoice.party_id.in_(chunk),
+                       Invoice.payment_mode == 'CREDIT',
+                       Invoice.status == 'ACTIVE')
+                .values(amount_paid=0, amount_due=Invoice.total_amount, payment_status='UNPAID')
+                .execution_options(synchronize_session=False)
+            )
+
+            open_items = defaultdict(list)
+            for row in db.session.query(
+                Invoice.id, Invoice.party_id, Invoice.amount_paid, Invoice.amount_due
+            ).filter(Invoice.party_id.in_(chunk), OPEN_INVOICES)\
+             .order_by(Invoice.party_id, Invoice.invoice_date, Invoice.id):
+                open_items[row.party_id].append({
+                    'id': row.id,
+                    'amount_paid': _d(row.amount_paid),
+                    'amount_due': _d(row.amount_due),
+                })
+
+            allocations = []
+            for receipt in db.session.query(
+                PartyTransaction.id, PartyTransaction.party_id,
+                PartyTransaction.transaction_date, PartyTransaction.credit
+            ).filter(PartyTransaction.party_id.in_(chunk),
+                     PartyTransaction.transaction_type == 'RECEIPT')\
+             .order_by(PartyTransaction.party_id, PartyTransaction.transaction_date,
+                       PartyTransaction.id):
+                rows, _ = cls._apply(receipt.credit, open_items[receipt.party_id],
+                                     receipt.id, receipt.party_id, receipt.transaction_date)
+                allocations.extend(rows)
+
+            cls._write([item for items in open_items.values() for item in items], allocations)
+            db.session.commit()
+
+        return len(party_ids)
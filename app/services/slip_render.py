@@ -0,0 +1,152 @@
+"""
+Salary Slip Rendering
+Process pool workers that draw salary slips with reportlab. Workers are
+spawned, so unpickling a task imports the app package (Flask and the
+models) but never run.py; this module must not call create_app or touch
+the database, and workers get plain dicts rather than model objects.
+"""
+import os
+
+
+MONTH_NAMES = ['', 'JANUARY', 'FEBRUARY', 'MARCH', 'APRIL', 'MAY', 'JUNE', 'JULY',
+               'AUGUST', 'SEPTEMBER', 'OCTOBER', 'NOVEMBER', 'DECEMBER']
+
+EARNINGS = (
+    ('Basic Salary', 'basic_salary'),
+    ('HRA', 'hra'),
+    ('DA', 'da'),
+    ('Other Allowances', 'other_allowances'),
+    ('Overtime', 'overtime'),
+    ('Bonus', 'bonus'),
+)
+
+DEDUCTIONS = (
+    ('PF', 'pf_deduction'),
+    ('ESI', 'esi_deduction'),
+    ('TDS', 'tds'),
+    ('Loan Deduction', 'loan_deduction'),
+    ('Other Deductions', 'other_deductions'),
+    ('Absent Deduction', 'absent_deduction'),
+)
+
+AMOUNT_FIELDS = [field for _, field in EARNINGS + DEDUCTIONS] + \
+    ['gross_salary', 'total_deductions', 'net_salary']
+
+
+# Company header, set once in each worker process by _init_worker
+_company = {}
+
+
+def _init_worker(company):
+    """Pool initializer: keep the company header in the worker"""
+    global _company
+    _company = company
+
+
+def _draw_slip(pdf, slip):
+    """Draw one salary slip on the current page"""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import mm
+
+    width, height = A4
+    left, right = 20 * mm, width - 20 * mm
+    y = height - 25 * mm
+
+    pdf.setFont('Helvetica-Bold', 16)
+    pdf.drawCentredString(width / 2, y, _company.get('name', ''))
+    pdf.setFont('Helvetica', 9)
+    for line in _company.get('header_lines', []):
+        y -= 12
+        pdf.drawCentredString(width / 2, y, line)
+
+    y -= 20
+    pdf.setFillGray(0.2)
+    pdf.rect(left, y - 6, right - left, 20, fill=1, stroke=0)
+    pdf.setFillGray(1)
+    pdf.setFont('Helvetica-Bold', 11)
+    pdf.drawCentredString(width / 2, y, f"SALARY SLIP - {MONTH_NAMES[slip['month']]} {slip['year']}")
+    pdf.setFillGray(0)
+
+    pdf.setFont('Helvetica', 10)
+    info = (
+        (f"Employee Name: {slip['name']}", f"Employee Code: {slip['code'] or '-'}"),
+        (f"Designation: {slip['designation'] or '-'}", f"Department: {slip['department'] or '-'}"),
+        (f"Bank A/C: {slip['bank_account'] or '-'}",
+         f"Working Days: {slip['days_worked']} / {slip['total_working_days']}"),
+        (f"PAN: {slip['pan'] or '-'}", f"Days Absent: {slip['days_absent'] or 0}"),
+    )
+    y -= 30
+    for first, second in info:
+        pdf.drawString(left, y, first)
+        pdf.drawString(width / 2 + 5 * mm, y, second)
+        y -= 15
+
+    y -= 10
+    middle = width / 2
+    pdf.setFont('Helvetica-Bold', 10)
+    pdf.drawString(left, y, 'EARNINGS')
+    pdf.drawRightString(middle - 5 * mm, y, 'Amount (Rs.)')
+    pdf.drawString(middle + 5 * mm, y, 'DEDUCTIONS')
+    pdf.drawRightString(right, y, 'Amount (Rs.)')
+    pdf.line(left, y - 4, right, y - 4)
+
+    earnings = [(label, slip[field]) for label, field in EARNINGS if slip[field]]
+    deductions = [(label, slip[field]) for label, field in DEDUCTIONS if slip[field]]
+
+    pdf.setFont('Helvetica', 10)
+    row_y = y - 18
+    for index in range(max(len(earnings), len(deductions))):
+        if index < len(earnings):
+            pdf.drawString(left, row_y, earnings[index][0])
+            pdf.drawRightString(middle - 5 * mm, row_y, f'{earnings[index][1]:,.2f}')
+        if index < len(deductions):
+            pdf.drawString(middle + 5 * mm, row_y, deductions[index][0])
+            pdf.drawRightString(right, row_y, f'{deductions[index][1]:,.2f}')
+        row_y -= 15
+
+    pdf.line(left, row_y + 8, right, row_y + 8)
+    pdf.setFont('Helvetica-Bold', 10)
+    pdf.drawString(left, row_y - 6, 'Gross Earnings')
+    pdf.drawRightString(middle - 5 * mm, row_y - 6, f"{slip['gross_salary']:,.2f}")
+    pdf.drawString(middle + 5 * mm, row_y - 6, 'Total Deductions')
+    pdf.drawRightString(right, row_y - 6, f"{slip['total_deductions']:,.2f}")
+
+    y = row_y - 40
+    pdf.setFont('Helvetica-Bold', 13)
+    pdf.drawCentredString(width / 2, y, f"NET PAYABLE: Rs. {slip['net_salary']:,.2f}")
+
+    y -= 60
+    pdf.setFont('Helvetica', 9)
+    pdf.line(left, y, left + 50 * mm, y)
+    pdf.drawString(left, y - 12, 'Employee Signature')
+    pdf.line(right - 50 * mm, y, right, y)
+    pdf.drawRightString(right, y - 12, 'Authorized Signatory')
+    pdf.setFont('Helvetica', 8)
+    pdf.drawCentredString(width / 2, y - 40, 'This is a computer generated slip and does not require signature.')
+
+
+def _render_pdf(slips, path):
+    """Worker: render slips as pages of one PDF file"""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    pdf = canvas.Canvas(path, pagesize=A4, pageCompression=1)
+    for slip in slips:
+        _draw_slip(pdf, slip)
+        pdf.showPage()
+    pdf.save()
+    return len(slips)
+
+
+def _render_separate(slips, directory):
+    """Worker: render each slip to its own PDF file in directory"""
+    for slip in slips:
+        _render_pdf([slip], os.path.join(directory, slip['filename']))
+    return len(slips)
+
+
+def _render_chunk(slips, directory, index):
+    """Worker: render a run of slips as one part of the merged PDF"""
+    path = os.path.join(directory, f'part_{index:05d}.pdf')
+    _render_pdf(slips, path)
+    return len(slips)
@@ -0,0 +1,147 @@
+"""
+Slow Query Log
+Statements over a time threshold are appended to a JSON-lines log with the
+route that ran them and their query plan, flagging full scans of big tables
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from flask import has_request_context, request
+from sqlalchemy import event
+
+from config.settings import Config
+
+
+# Tables that grow with every bill; a full scan of one is worth an index
+WATCHED_TABLES = ('invoices', 'invoice_items', 'party_transactions', 'stock_movements')
+
+# 'SCAN invoices' or 'SCAN invoices_1' (an alias); index scans say 'USING'
+FULL_SCAN = re.compile(r'^SCAN (\w+?)(?:_\d+)?$')
+
+MAX_PLANS = 2000
+
+_plans = {}
+_lock = threading.Lock()
+
+
+def _parameter_shape(parameters, executemany):
+    """Types of the bound parameters without their values"""
+    if executemany:
+        rows = len(parameters)
+        parameters = parameters[0] if parameters else ()
+        return {'rows': rows, 'types': _parameter_shape(parameters, False)}
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    return [type(value).__name__ for value in parameters or ()]
+
+
+def _full_scans(plan):
+    """Watched tables the plan reads from end to end"""
+    scans = set()
+    for detail in plan:
+        match = FULL_SCAN.match(detail)
+        if match and match.group(1) in WATCHED_TABLES:
+            scans.add(match.group(1))
+    return sorted(scans)
+
+
+def _explain(cursor, statement, parameters, executemany):
+    """EXPLAIN QUERY PLAN for a statement, once per distinct statement"""
+    with _lock:
+        if statement in _plans:
+            return _plans[statement]
+
+    if executemany:
+        parameters = parameters[0] if parameters else ()
+    try:
+        plan_cursor = cursor.connection.cursor()
+        try:
+            plan = [row[3] for row in plan_cursor.execute(f'EXPLAIN QUERY PLAN {statement}', parameters)]
+        finally:
+            plan_cursor.close()
+    except sqlite3.Error as e:
+        plan = [f'(no plan: {e})']
+
+    with _lock:
+        if len(_plans) >= MAX_PLANS:
+            _plans.clear()
+        _plans[statement] = plan
+    return plan
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    context._slow_query_start = time.perf_counter()
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, '_slow_query_start', None)
+    if start is None:
+        return
+    elapsed = (time.perf_counter() - start) * 1000
+    if elapsed < Config.SLOW_QUERY_MS:
+        return
+
+    plan = _explain(cursor, statement, parameters, executemany)
+    SlowQueryLog.write({
+        'at': datetime.now().isoformat(timespec='seconds'),
+        'ms': round(elapsed, 1),
+        'route': request.endpoint if has_request_context() else None,
+        'statement': statement,
+        'parameters': _parameter_shape(parameters, executemany),
+        'plan': plan,
+        'full_scans': _full_scans(plan),
+    })
+
+
+class SlowQueryLog:
+    """Slow statements with their plans, for finding missing indexes"""
+
+    @staticmethod
+    def init_app(app, *engines):
+        """Time every statement on the engines when SLOW_QUERY_MS is set"""
+        if not Config.SLOW_QUERY_MS:
+            return
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', _before_execute)
+            event.listen(engine, 'after_cursor_execute', _after_execute)
+
+        @app.route('/debug/slow-queries')
+        def slow_queries():
+            from flask import render_template
+            return render_template('slow_queries.html',
+                                   entries=SlowQueryLog.entries(),
+                                   threshold=Config.SLOW_QUERY_MS,
+                                   log_path=Config.SLOW_QUERY_LOG)
+
+    @staticmethod
+    def write(entry):
+        """Append an entry, starting a new file once the log is full"""
+        line = json.dumps(entry, default=str) + '\n'
+        path = Config.SLOW_QUERY_LOG
+        with _lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if os.path.exists(path) and os.path.getsize(path) > Config.SLOW_QUERY_LOG_MAX_BYTES:
+                os.replace(path, path + '.1')
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+    @staticmethod
+    def entries(limit=200):
+        """The newest logged statements, newest first"""
+        path = Config.SLOW_QUERY_LOG
+        if not os.path.exists(path):
+            return []
+        with _lock, open(path, encoding='utf-8') as f:
+            lines = f.readlines()[-limit:]
+        entries = []
+        for line in reversed(lines):
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+        return entries
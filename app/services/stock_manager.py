@@ -2,19 +2,24 @@
 Stock Manager Service
 Handles inventory stock operations
 """
-from datetime import datetime
+from datetime import date, datetime
 from decimal import Decimal
 from app.models.base import db
 from app.models.product import Product, StockMovement
+from app.services.inventory_valuation import InventoryValuation
+from app.services.costing import CostingEngine
 
 
 class StockManager:
     """Inventory stock management service"""
     
     @staticmethod
-    def add_stock(product_id, quantity, reference_type=None, reference_id=None, notes=None):
+    def add_stock(product_id, quantity, reference_type=None, reference_id=None, notes=None,
+                  unit_cost=None, movement_date=None):
         """
         Add stock to a product (purchase, adjustment)
+        unit_cost is the purchase rate; other receipts are costed by the costing engine
+        movement_date is the source document's date (default: today)
         """
         product = Product.query.get(product_id)
         if not product:
@@ -24,10 +29,6 @@ class StockManager:
         stock_before = Decimal(str(product.current_stock or 0))
         stock_after = stock_before + quantity
         
-        # Update product stock
-        product.current_stock = stock_after
-        product.updated_at = datetime.utcnow()
-        
         # Create stock movement record
         movement = StockMovement(
             product_id=product_id,
@@ -37,17 +38,25 @@ class StockManager:
             reference_id=reference_id,
             stock_before=stock_before,
             stock_after=stock_after,
-            notes=notes
+            notes=notes,
+            movement_date=movement_date or date.today()
         )
+        CostingEngine.record(product, movement, unit_cost)
         db.session.add(movement)
+        
+        # Update product stock
+        product.current_stock = stock_after
+        product.updated_at = datetime.utcnow()
         db.session.commit()
         
         return stock_after
     
     @staticmethod
-    def deduct_stock(product_id, quantity, reference_type=None, reference_id=None, notes=None):
+    def deduct_stock(product_id, quantity, reference_type=None, reference_id=None, notes=None,
+                     movement_date=None):
         """
         Deduct stock from a product (sale, adjustment)
+        movement_date is the source document's date (default: today)
         """
         product = Product.query.get(product_id)
         if not product:
@@ -61,11 +70,7 @@ class StockManager:
         if stock_after < 0:
             notes = (notes or '') + ' [WARNING: Stock went negative]'
         
-        # Update product stock
-        product.current_stock = stock_after
-        product.updated_at = datetime.utcnow()
-        
-        # Create stock movement record
+        # Create stock movement record (cost of goods sold stamped by the costing engine)
         movement = StockMovement(
             product_id=product_id,
             movement_type='SALE' if reference_type == 'INVOICE' else 'ADJUSTMENT',
@@ -74,9 +79,15 @@ class StockManager:
             reference_id=reference_id,
             stock_before=stock_before,
             stock_after=stock_after,
-            notes=notes
+            notes=notes,
+            movement_date=movement_date or date.today()
         )
+        CostingEngine.record(product, movement)
         db.session.add(movement)
+        
+        # Update product stock
+        product.current_stock = stock_after
+        product.updated_at = datetime.utcnow()
         db.session.commit()
         
         return stock_after
@@ -94,9 +105,6 @@ class StockManager:
         stock_before = Decimal(str(product.current_stock or 0))
         adjustment = new_quantity - stock_before
         
-        product.current_stock = new_quantity
-        product.updated_at = datetime.utcnow()
-        
         movement = StockMovement(
             product_id=product_id,
             movement_type='ADJUSTMENT',
@@ -106,7 +114,11 @@ class StockManager:
             stock_after=new_quantity,
             notes=notes or 'Manual stock adjustment'
         )
+        CostingEngine.record(product, movement)
         db.session.add(movement)
+        
+        product.current_stock = new_quantity
+        product.updated_at = datetime.utcnow()
         db.session.commit()
         
         return new_quantity
@@ -129,8 +141,4 @@ class StockManager:
     @staticmethod
     def get_inventory_value():
         """Calculate total inventory value at cost price"""
-        products = Product.query.filter_by(is_active=True).all()
-        total = Decimal('0')
-        for p in products:
-            total += Decimal(str(p.current_stock or 0)) * Decimal(str(p.cost_price or 0))
-        return total
+        return InventoryValuation.total()
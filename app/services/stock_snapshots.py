@@ -0,0 +1,215 @@
+"""
+Stock Snapshot Service
+Month-end stock positions and stock-as-of-date queries
+"""
+import threading
+from datetime import date, datetime, time, timedelta, timezone
+from decimal import Decimal
+from sqlalchemy import delete, event, func, insert, text
+from sqlalchemy.orm import Session
+
+from app.models.base import db
+from app.models.product import Product, ProductCategory, StockMovement, StockSnapshot
+from app.services.archive import FinancialYearArchive
+
+
+FOUR_PLACES = Decimal('0.0001')
+
+
+def _movement_value(movement):
+    """Movement value at cost; movements written before costing fall back to the cost price"""
+    return func.coalesce(
+        movement.cost_amount,
+        movement.quantity * func.coalesce(Product.cost_price, 0)
+    )
+
+
+CURRENT_VALUE = func.coalesce(
+    Product.cost_value,
+    func.coalesce(Product.current_stock, 0) * func.coalesce(Product.cost_price, 0)
+)
+
+_build_lock = threading.Lock()
+
+
+def _day_end(d):
+    """The UTC instant local day d ends, for comparing with created_at"""
+    local = datetime.combine(d + timedelta(days=1), time.min).astimezone()
+    return local.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _to_decimal(value):
+    return Decimal(str(value or 0))
+
+
+def _month_end(d):
+    return (d.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+
+
+class StockSnapshots:
+    """Month-end stock snapshots and stock positions at any date"""
+
+    @staticmethod
+    def backfill_movement_dates(engine=None):
+        """
+        Date movements saved before movement_date was tracked: sales by their
+        invoice, everything else by the local day they were keyed in. Live
+        snapshots built from the keyed-in dates are dropped to be rebuilt.
+        """
+        with (engine or db.engine).begin() as conn:
+            updated = conn.execute(text("""
+                UPDATE stock_movements
+                SET movement_date = COALESCE(
+                    (SELECT invoice_date FROM invoices
+                     WHERE invoices.id = stock_movements.reference_id
+                     AND stock_movements.reference_type = 'INVOICE'),
+                    date(created_at, 'localtime'))
+                WHERE movement_date IS NULL
+            """)).rowcount
+            if updated and engine is None:
+                conn.execute(text('DELETE FROM stock_snapshots'))
+        return updated
+
+    @staticmethod
+    def latest_on_or_before(as_of):
+        """Date of the newest snapshot not after as_of"""
+        return db.session.query(func.max(StockSnapshot.snapshot_date))\
+            .filter(StockSnapshot.snapshot_date <= as_of).scalar()
+
+    @classmethod
+    def positions(cls, as_of, product_ids=None):
+        """
+        Quantity and value of every product at the end of as_of in one grouped
+        query: the nearest earlier snapshot plus the movements since, or the
+        current stock less later movements when no snapshot is that old.
+        Returns {product_id: (quantity, value)}.
+        """
+        base = cls.latest_on_or_before(as_of)
+
+        if base:
+            movement = FinancialYearArchive.span(StockMovement, base)
+            movements = db.and_(
+                movement.product_id == Product.id,
+                movement.movement_date > base,
+                movement.movement_date <= as_of
+            )
+            query = db.session.query(
+                Product.id,
+                func.coalesce(func.max(StockSnapshot.quantity), 0) +
+                func.coalesce(func.sum(movement.quantity), 0),
+                func.coalesce(func.max(StockSnapshot.value), 0) +
+                func.coalesce(func.sum(_movement_value(movement)), 0)
+            ).outerjoin(StockSnapshot, db.and_(
+                StockSnapshot.product_id == Product.id,
+                StockSnapshot.snapshot_date == base
+            )).outerjoin(movement, movements)
+        else:
+            movement = FinancialYearArchive.span(StockMovement, as_of)
+            movements = db.and_(
+                movement.product_id == Product.id,
+                movement.movement_date > as_of
+            )
+            query = db.session.query(
+                Product.id,
+                func.coalesce(Product.current_stock, 0) -
+                func.coalesce(func.sum(movement.quantity), 0),
+                CURRENT_VALUE - func.coalesce(func.sum(_movement_value(movement)), 0)
+            ).outerjoin(movement, movements)\
+             .filter(Product.created_at < _day_end(as_of))
+
+        if product_ids:
+            query = query.filter(Product.id.in_(product_ids))
+
+        return {
+            product_id: (_to_decimal(quantity), _to_decimal(value).quantize(FOUR_PLACES))
+            for product_id, quantity, value in query.group_by(Product.id)
+        }
+
+    @classmethod
+    def build(cls, through=None):
+        """
+        Store snapshots for every month end up to `through` (default: the
+        last completed month) that is not yet covered. Returns months added.
+        """
+        through = through or date.today().replace(day=1) - timedelta(days=1)
+
+        with _build_lock:
+            last = db.session.query(func.max(StockSnapshot.snapshot_date)).scalar()
+            if last:
+                month_end = _month_end(last + timedelta(days=1))
+            else:
+                movement = FinancialYearArchive.span(StockMovement)
+                first = db.session.query(func.min(movement.movement_date)).scalar()
+                if first is None:
+                    return 0
+                month_end = _month_end(first)
+
+            months = 0
+            try:
+                while month_end <= through:
+                    rows = [{
+                        'product_id': product_id,
+                        'snapshot_date': month_end,
+                        'quantity': quantity,
+                        'value': value,
+                        'created_at': datetime.utcnow(),
+                    } for product_id, (quantity, value) in cls.positions(month_end).items()
+                        if quantity or value]
+
+                    if rows:
+                        db.session.execute(insert(StockSnapshot), rows)
+                    months += 1
+                    month_end = _month_end(month_end + timedelta(days=1))
+
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+        return months
+
+    @classmethod
+    def statement(cls, as_of, include_zero=False):
+        """Closing stock statement rows at as_of, ordered by category and product"""
+        positions = cls.positions(as_of)
+
+        products = db.session.query(
+            Product.id,
+            Product.name,
+            Product.code,
+            Product.hsn_code,
+            Product.unit,
+            ProductCategory.name
+        ).outerjoin(ProductCategory, Product.category_id == ProductCategory.id)\
+         .order_by(ProductCategory.name, Product.name)
+
+        rows = []
+        for product_id, name, code, hsn_code, unit, category in products:
+            quantity, value = positions.get(product_id, (Decimal('0'), Decimal('0')))
+            if not include_zero and not quantity and not value:
+                continue
+            rows.append({
+                'id': product_id,
+                'name': name,
+                'code': code,
+                'hsn_code': hsn_code,
+                'unit': unit,
+                'category': category or 'Uncategorised',
+                'quantity': quantity,
+                'unit_cost': (value / quantity).quantize(Decimal('0.01')) if quantity else Decimal('0'),
+                'value': value.quantize(Decimal('0.01')),
+            })
+        return rows
+
+
+@event.listens_for(Session, 'before_flush')
+def _drop_stale_snapshots(session, flush_context, instances):
+    """
+    A movement dated on or before a snapshot makes that snapshot and every
+    later one wrong; delete them in the same transaction for build() to redo
+    """
+    dates = [obj.movement_date for obj in session.new
+             if isinstance(obj, StockMovement) and obj.movement_date is not None]
+    if dates:
+        session.connection().execute(
+            delete(StockSnapshot.__table__).where(StockSnapshot.snapshot_date >= min(dates)))
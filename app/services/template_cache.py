@@ -0,0 +1,75 @@
+"""
+Template Cache
+Compiled Jinja templates are kept on disk between starts, seeded from the
+copy precompiled into the exe, and the counter's pages are compiled in the
+background at startup so their first visit is as fast as any other
+"""
+import os
+import threading
+from hashlib import sha1
+
+from jinja2 import FileSystemBytecodeCache
+
+from config.settings import Config
+
+
+class TemplateBytecodeCache(FileSystemBytecodeCache):
+    """
+    Keyed by template name alone: the exe unpacks its templates to a
+    different folder on every launch, so keys built from file paths would
+    never match. Jinja still checks each entry against the template source
+    and the Python version before using it.
+    """
+
+    def __init__(self, directory, precompiled_dir=None):
+        os.makedirs(directory, exist_ok=True)
+        super().__init__(directory)
+        self.precompiled_dir = precompiled_dir
+
+    def get_cache_key(self, name, filename=None):
+        return sha1(name.encode('utf-8')).hexdigest()
+
+    def load_bytecode(self, bucket):
+        super().load_bytecode(bucket)
+        if bucket.code is None and self.precompiled_dir:
+            path = os.path.join(self.precompiled_dir, self.pattern % bucket.key)
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    bucket.load_bytecode(f)
+
+
+class TemplateCache:
+    """Persistent template bytecode, precompilation for the build and startup warming"""
+
+    @staticmethod
+    def init_app(app):
+        if not Config.TEMPLATE_CACHE_DIR:
+            return
+        try:
+            app.jinja_env.bytecode_cache = TemplateBytecodeCache(
+                Config.TEMPLATE_CACHE_DIR, Config.TEMPLATE_PRECOMPILED_DIR)
+        except OSError as e:
+            app.logger.warning(f'Template cache disabled: {e}')
+            return
+
+        if Config.TEMPLATE_WARM:
+            threading.Thread(target=TemplateCache.warm, args=(app, Config.TEMPLATE_WARM),
+                             daemon=True).start()
+
+    @staticmethod
+    def warm(app, names):
+        """Load templates into the environment's cache ahead of their first request"""
+        for name in names:
+            try:
+                app.jinja_env.get_template(name)
+            except Exception as e:
+                app.logger.warning(f'Could not warm template {name}: {e}')
+
+    @staticmethod
+    def precompile(app, directory):
+        """Compile every template into directory for bundling; returns how many"""
+        env = app.jinja_env.overlay(bytecode_cache=TemplateBytecodeCache(directory), cache_size=0)
+        names = env.list_templates(extensions=('html',))
+        for name in names:
+            env.get_template(name)
+        return len(names)
@@ -0,0 +1,20 @@
+"""
+BillPro Benchmarks
+Timed scenarios against generated multi-year datasets.
+
+    python -m benchmarks --scale 10k
+    python -m benchmarks --scale 1m --repeat 5 --scenario gst_report
+
+Datasets are generated once per scale and seed into benchmarks/data and
+results are written as JSON to benchmarks/results.
+
+    python -m benchmarks.loadtest --scale 100k --counters 6 --duration 60
+
+runs several billing counters and report readers against one database at
+once and reports throughput, latency, lock errors and invoice-number
+collisions.
+
+Every run is added to benchmarks/results/history.jsonl. --compare checks it
+against the pinned baseline (python -m benchmarks.history baseline <id>)
+or the previous run at the same scale, and exits non-zero on a regression.
+"""
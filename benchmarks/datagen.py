@@ -0,0 +1,534 @@
+"""
+Benchmark Dataset Generator
+Deterministic multi-year shop data written with bulk inserts: products,
+parties, employees and every day's invoices, receipts, purchases, supplier
+payments, expenses, stock movements and ledger rows.
+
+    python -m benchmarks.datagen 10k database/bench-10k.db
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from datetime import date, datetime, time as day_time, timedelta
+from functools import lru_cache
+
+from sqlalchemy import bindparam, create_engine, insert, update
+
+from app.models import (
+    db, Product, ProductCategory, Party, PartyTransaction,
+    Invoice, InvoiceItem, PaymentAllocation, Purchase, PurchaseItem,
+    Expense, ExpenseCategory, JournalEntry, CashTransaction, BankTransaction,
+    Employee, FinancialYear
+)
+from app.models.product import StockMovement
+from app.services.financial_year import get_fy_from_date
+from config.settings import Config
+
+
+SCALES = {
+    '10k': {'invoices': 10_000, 'products': 500, 'customers': 300, 'suppliers': 40,
+            'employees': 25, 'years': 2},
+    '100k': {'invoices': 100_000, 'products': 2_000, 'customers': 1_500, 'suppliers': 100,
+             'employees': 60, 'years': 3},
+    '1m': {'invoices': 1_000_000, 'products': 10_000, 'customers': 5_000, 'suppliers': 250,
+           'employees': 150, 'years': 5},
+}
+
+# Tables in insert order, so every row's references are written before it
+TABLES = (Invoice, InvoiceItem, Purchase, PurchaseItem, PartyTransaction, PaymentAllocation,
+          Expense, CashTransaction, BankTransaction, JournalEntry, StockMovement)
+
+SELLER_STATE = '27'
+GST_RATES = (0, 5, 12, 18, 28)
+GST_WEIGHTS = (5, 20, 20, 45, 10)
+UNITS = ('PCS', 'PCS', 'PCS', 'KG', 'LTR', 'BOX')
+PRODUCT_CATEGORIES = ('Grocery', 'Household', 'Personal Care', 'Stationery', 'Electrical',
+                      'Hardware', 'Beverages', 'Snacks', 'Dairy', 'Frozen')
+EXPENSE_CATEGORIES = ('Rent', 'Electricity', 'Salaries', 'Transport', 'Telephone',
+                      'Repairs', 'Packaging', 'Printing & Stationery')
+REORDER_LEVEL = 20
+PAYMENT_MODES = ('CASH', 'BANK', 'CREDIT')
+PAYMENT_MODE_WEIGHTS = (60, 15, 25)
+
+
+@lru_cache(maxsize=None)
+def _fy(day):
+    return get_fy_from_date(day)
+
+
+def scale_params(scale):
+    """Row counts for a named scale, or for a plain invoice count like '5000'"""
+    if scale in SCALES:
+        return dict(SCALES[scale])
+    invoices = int(scale)
+    return {
+        'invoices': invoices,
+        'products': max(50, min(10_000, invoices // 20)),
+        'customers': max(30, min(5_000, invoices // 30)),
+        'suppliers': max(5, min(250, invoices // 250)),
+        'employees': max(5, min(150, invoices // 400)),
+        'years': 1 if invoices < 5_000 else 2,
+    }
+
+
+class DatasetGenerator:
+    """Writes one deterministic dataset into an empty database file"""
+
+    CHUNK_DAYS = 7
+
+    def __init__(self, path, invoices, products, customers, suppliers, employees, years,
+                 seed=42, today=None):
+        self.path = path
+        self.invoices = invoices
+        self.products = products
+        self.customers = customers
+        self.suppliers = suppliers
+        self.employees = employees
+        self.years = years
+        self.rng = random.Random(seed)
+        self.today = today or date.today()
+
+        self.next_id = defaultdict(lambda: 1)
+        self.rows = defaultdict(list)
+        self.counts = defaultdict(int)
+        self.fy_ids = {}
+        self.counters = defaultdict(lambda: [0, 0])  # FY id -> [invoices, purchases]
+        self.balances = defaultdict(float)
+        self.due = defaultdict(list)  # date -> scheduled receipts and supplier payments
+
+    def _id(self, model):
+        table = model.__tablename__
+        value = self.next_id[table]
+        self.next_id[table] = value + 1
+        return value
+
+    def _add(self, model, **values):
+        values['id'] = self._id(model)
+        self.rows[model].append(values)
+        return values['id']
+
+    def _flush(self, conn):
+        for model in TABLES:
+            rows = self.rows.pop(model, None)
+            if rows:
+                conn.execute(insert(model.__table__), rows)
+                self.counts[model.__tablename__] += len(rows)
+
+    def generate(self, progress=None):
+        """Create the schema and write every row; returns row counts per table"""
+        engine = create_engine(f'sqlite:///{self.path}')
+        db.metadata.create_all(engine)
+        with engine.connect() as conn:
+            conn.exec_driver_sql('PRAGMA journal_mode=WAL')
+            conn.exec_driver_sql('PRAGMA synchronous=OFF')
+            conn.commit()
+
+            fy_start = _fy(self.today)['start_date']
+            first_day = fy_start.replace(year=fy_start.year - (self.years - 1))
+            with conn.begin():
+                self._masters(conn, first_day)
+
+            days = (self.today - first_day).days + 1
+            per_day = [self.invoices // days] * days
+            for i in self.rng.sample(range(days), self.invoices % days):
+                per_day[i] += 1
+
+            for start in range(0, days, self.CHUNK_DAYS):
+                with conn.begin():
+                    for offset in range(start, min(start + self.CHUNK_DAYS, days)):
+                        self._day(first_day + timedelta(days=offset), per_day[offset])
+                    self._flush(conn)
+                if progress:
+                    progress(min(start + self.CHUNK_DAYS, days), days)
+
+            with conn.begin():
+                self._finish(conn)
+        engine.dispose()
+        return dict(self.counts)
+
+    def _masters(self, conn, first_day):
+        rng = self.rng
+
+        fys = []
+        day = first_day
+        while day <= self.today:
+            info = _fy(day)
+            fy_id = len(fys) + 1
+            fys.append({'id': fy_id, 'is_active': info['start_date'] <= self.today <= info['end_date'],
+                        'is_closed': False, **info})
+            self.fy_ids[info['code']] = fy_id
+            day = info['end_date'] + timedelta(days=1)
+        conn.execute(insert(FinancialYear.__table__), fys)
+
+        conn.execute(insert(ProductCategory.__table__),
+                     [{'id': i + 1, 'name': name} for i, name in enumerate(PRODUCT_CATEGORIES)])
+        conn.execute(insert(ExpenseCategory.__table__),
+                     [{'id': i + 1, 'name': name} for i, name in enumerate(EXPENSE_CATEGORIES)])
+
+        self.product_rows = []
+        for i in range(1, self.products + 1):
+            price = round(rng.uniform(10, 2000), 2)
+            self.product_rows.append({
+                'id': i,
+                'name': f'Product {i:05d}',
+                'code': f'P{i:05d}',
+                'category_id': rng.randint(1, len(PRODUCT_CATEGORIES)),
+                'hsn_code': f'{rng.randint(1000, 9999)}',
+                'gst_percent': rng.choices(GST_RATES, GST_WEIGHTS)[0],
+                'cost_price': round(price * 0.7, 2),
+                'selling_price': price,
+                'mrp': round(price * 1.1, 2),
+                'unit': rng.choice(UNITS),
+                'low_stock_threshold': REORDER_LEVEL,
+                'costing_method': 'WAVG',
+                'current_stock': 0,
+                # On the books before its opening stock, so stock-as-of finds it
+                'created_at': datetime.combine(first_day - timedelta(days=1), day_time(12)),
+            })
+        # Popular products sell far more often than the long tail
+        self.product_weights = []
+        total = 0.0
+        for i in range(self.products):
+            total += 1 / (i + 1) ** 0.8
+            self.product_weights.append(total)
+        self.stock = [0.0] * (self.products + 1)
+        conn.execute(insert(Product.__table__), self.product_rows)
+
+        parties = []
+        for i in range(1, self.customers + 1):
+            state = SELLER_STATE if rng.random() < 0.85 else f'{rng.randint(1, 37):02d}'
+            parties.append(self._party(i, f'Customer {i:05d}', 'customer', f'C{i:05d}', state))
+        for i in range(1, self.suppliers + 1):
+            parties.append(self._party(self.customers + i, f'Supplier {i:04d}', 'supplier',
+                                       f'S{i:04d}', SELLER_STATE))
+        self.party_state = {p['id']: p['state_code'] for p in parties}
+        self.party_names = {p['id']: p['name'] for p in parties}
+        conn.execute(insert(Party.__table__), parties)
+
+        employees = []
+        for i in range(1, self.employees + 1):
+            basic = rng.randrange(12_000, 60_000, 500)
+            employees.append({
+                'id': i,
+                'employee_code': f'E{i:04d}',
+                'name': f'Employee {i:04d}',
+                'designation': rng.choice(('Cashier', 'Sales', 'Store Keeper', 'Accountant', 'Helper')),
+                'department': rng.choice(('Counter', 'Store', 'Office')),
+                'date_of_joining': first_day - timedelta(days=rng.randint(0, 2000)),
+                'basic_salary': basic,
+                'hra': round(basic * 0.4, 2),
+                'da': round(basic * 0.1, 2),
+                'other_allowances': rng.randrange(0, 3000, 100),
+                'pf_deduction': round(basic * 0.12, 2),
+                'esi_deduction': round(basic * 0.0075, 2),
+                'other_deductions': 0,
+                'is_active': True,
+            })
+        if employees:
+            conn.execute(insert(Employee.__table__), employees)
+
+        # Opening stock, the first movement of every product
+        for product in self.product_rows:
+            quantity = float(rng.randint(50, 200))
+            self.stock[product['id']] = quantity
+            self._movement(product, quantity, 'ADJUSTMENT', 'OPENING', None, first_day, 'Opening stock')
+        self._flush(conn)
+
+    def _party(self, party_id, name, party_type, code, state):
+        return {
+            'id': party_id, 'name': name, 'party_type': party_type, 'code': code,
+            'gstin': f'{state}ABCDE{party_id % 10000:04d}F1Z5' if self.rng.random() < 0.4 else None,
+            'city': 'Pune', 'state_code': state, 'phone': f'98{party_id:08d}',
+            'credit_days': 30, 'opening_balance': 0, 'credit_limit': 0, 'is_active': True,
+        }
+
+    def _movement(self, product, quantity, movement_type, reference_type, reference_id, day, notes):
+        before = self.stock[product['id']] - quantity
+        cost = product['cost_price']
+        self.rows[StockMovement].append({
+            'product_id': product['id'],
+            'movement_type': movement_type,
+            'quantity': quantity,
+            'reference_type': reference_type,
+            'reference_id': reference_id,
+            'stock_before': before,
+            'stock_after': before + quantity,
+            'unit_cost': cost,
+            'cost_amount': round(quantity * cost, 4),
+            'notes': notes,
+            'movement_date': day,
+            'created_at': datetime.combine(day, day_time(12)),
+        })
+
+    def _number(self, prefix, day, kind):
+        code = _fy(day)['code']
+        fy_id = self.fy_ids[code]
+        self.counters[fy_id][kind] += 1
+        return fy_id, f'{prefix}/{code}/{self.counters[fy_id][kind]:04d}'
+
+    def _day(self, day, invoice_count):
+        rng = self.rng
+        for _ in range(invoice_count):
+            self._invoice(day)
+
+        for kind, values in self.due.pop(day, ()):
+            if kind == 'receipt':
+                self._receipt(day, *values)
+            else:
+                self._supplier_payment(day, *values)
+
+        for _ in range(rng.choices((0, 1, 2, 3), (40, 35, 15, 10))[0]):
+            self._expense(day)
+
+        reorder = [p for p in self.product_rows if self.stock[p['id']] < REORDER_LEVEL]
+        by_supplier = defaultdict(list)
+        for product in reorder:
+            by_supplier[self.customers + 1 + product['id'] % self.suppliers].append(product)
+        for supplier_id, products in sorted(by_supplier.items()):
+            for start in range(0, len(products), 8):
+                self._purchase(day, supplier_id, products[start:start + 8])
+
+    def _invoice(self, day):
+        rng = self.rng
+        party_id = rng.randint(1, self.customers)
+        mode = rng.choices(PAYMENT_MODES, PAYMENT_MODE_WEIGHTS)[0]
+        is_gst = rng.random() < 0.9
+        is_igst = is_gst and self.party_state[party_id] != SELLER_STATE
+        fy_id, number = self._number(Config.INVOICE_PREFIX, day, 0)
+        invoice_id = self._id(Invoice)
+
+        subtotal = cgst = sgst = igst = 0.0
+        picks = rng.choices(self.product_rows, cum_weights=self.product_weights, k=rng.randint(1, 5))
+        for product in picks:
+            quantity = float(rng.randint(1, 5))
+            rate = product['selling_price']
+            discount = 5.0 if rng.random() < 0.1 else 0.0
+            gross = quantity * rate
+            discount_amount = round(gross * discount / 100, 2)
+            taxable = round(gross - discount_amount, 2)
+            gst = product['gst_percent'] if is_gst else 0
+            tax = round(taxable * gst / 100, 2)
+            half = round(taxable * gst / 200, 2)
+            self.rows[InvoiceItem].append({
+                'id': self._id(InvoiceItem), 'invoice_id': invoice_id, 'product_id': product['id'],
+                'description': product['name'], 'hsn_code': product['hsn_code'],
+                'quantity': quantity, 'unit': product['unit'], 'rate': rate,
+                'discount_percent': discount, 'discount_amount': discount_amount,
+                'taxable_amount': taxable, 'gst_percent': gst,
+                'cgst_percent': 0 if is_igst else gst / 2, 'cgst_amount': 0 if is_igst else half,
+                'sgst_percent': 0 if is_igst else gst / 2, 'sgst_amount': 0 if is_igst else half,
+                'igst_percent': gst if is_igst else 0, 'igst_amount': tax if is_igst else 0,
+                'total_amount': round(taxable + (tax if is_igst else 2 * half), 2),
+            })
+            subtotal += taxable
+            if is_igst:
+                igst += tax
+            else:
+                cgst += half
+                sgst += half
+
+            self.stock[product['id']] -= quantity
+            self._movement(product, -quantity, 'SALE', 'INVOICE', invoice_id, day, f'Sale: {number}')
+
+        tax_amount = round(cgst + sgst + igst, 2)
+        exact = subtotal + tax_amount
+        total = float(round(exact))
+        paid_on = None
+        if mode == 'CREDIT' and rng.random() < 0.8:
+            paid_on = day + timedelta(days=rng.randint(3, 45))
+            if paid_on > self.today:
+                paid_on = None
+        paid = mode != 'CREDIT' or paid_on is not None
+
+        self.rows[Invoice].append({
+            'id': invoice_id, 'invoice_number': number, 'invoice_date': day,
+            'due_date': day + timedelta(days=30) if mode == 'CREDIT' else None,
+            'financial_year_id': fy_id, 'party_id': party_id,
+            'is_gst_invoice': is_gst, 'is_igst': is_igst,
+            'subtotal': round(subtotal, 2), 'cgst_amount': round(cgst, 2), 'sgst_amount': round(sgst, 2),
+            'igst_amount': round(igst, 2), 'tax_amount': tax_amount, 'discount_amount': 0,
+            'round_off': round(total - exact, 2), 'total_amount': total,
+            'payment_mode': mode, 'payment_status': 'PAID' if paid else 'UNPAID',
+            'amount_paid': total if paid else 0, 'amount_due': 0 if paid else total,
+            'status': 'ACTIVE', 'created_at': datetime.combine(day, day_time(12)),
+        })
+        self._add(JournalEntry, entry_date=day, entry_number=None, account_type='SALES',
+                  account_name='Sales', party_id=None, debit=0, credit=round(subtotal, 2),
+                  reference_type='INVOICE', reference_id=invoice_id, reference_number=number,
+                  narration=f'Sale to {self.party_names[party_id]}', financial_year_id=fy_id)
+
+        if mode == 'CREDIT':
+            self._party_entry(party_id, day, 'SALE', 'INVOICE', invoice_id, number, total, 0,
+                              f'Sale Invoice {number}')
+            if paid_on:
+                self.due[paid_on].append(('receipt', (party_id, invoice_id, total)))
+        else:
+            self._money(mode, day, party_id, total, 0, 'INVOICE', invoice_id, number,
+                        f'{mode.title()} sale to {self.party_names[party_id]}')
+
+    def _receipt(self, day, party_id, invoice_id, amount):
+        mode = 'CASH' if self.rng.random() < 0.6 else 'BANK'
+        txn_id = self._party_entry(party_id, day, 'RECEIPT', 'RECEIPT', None, None, 0, amount,
+                                   f'Payment received via {mode}')
+        self._add(PaymentAllocation, party_transaction_id=txn_id, invoice_id=invoice_id,
+                  party_id=party_id, amount=amount, allocation_date=day)
+        self._money(mode, day, party_id, amount, 0, None, None, None,
+                    f'Payment from {self.party_names[party_id]}')
+
+    def _purchase(self, day, supplier_id, products):
+        rng = self.rng
+        mode = 'CREDIT' if rng.random() < 0.5 else 'CASH'
+        fy_id, number = self._number(Config.PURCHASE_PREFIX, day, 1)
+        purchase_id = self._id(Purchase)
+
+        subtotal = tax = 0.0
+        for product in products:
+            quantity = float(rng.randint(100, 250))
+            rate = product['cost_price']
+            taxable = round(quantity * rate, 2)
+            gst = product['gst_percent']
+            half = round(taxable * gst / 200, 2)
+            self.rows[PurchaseItem].append({
+                'id': self._id(PurchaseItem), 'purchase_id': purchase_id, 'product_id': product['id'],
+                'description': product['name'], 'hsn_code': product['hsn_code'],
+                'quantity': quantity, 'unit': product['unit'], 'rate': rate,
+                'discount_percent': 0, 'discount_amount': 0, 'taxable_amount': taxable,
+                'gst_percent': gst, 'cgst_percent': gst / 2, 'cgst_amount': half,
+                'sgst_percent': gst / 2, 'sgst_amount': half, 'igst_percent': 0, 'igst_amount': 0,
+                'total_amount': round(taxable + 2 * half, 2),
+            })
+            subtotal += taxable
+            tax += 2 * half
+            self.stock[product['id']] += quantity
+            self._movement(product, quantity, 'PURCHASE', 'PURCHASE', purchase_id, day,
+                           f'Purchase: {number}')
+
+        exact = subtotal + tax
+        total = float(round(exact))
+        self.rows[Purchase].append({
+            'id': purchase_id, 'purchase_number': number, 'purchase_date': day,
+            'due_date': day + timedelta(days=30) if mode == 'CREDIT' else None,
+            'supplier_invoice_number': f'SI-{purchase_id}', 'supplier_invoice_date': day,
+            'financial_year_id': fy_id, 'party_id': supplier_id,
+            'is_gst_invoice': True, 'is_igst': False,
+            'subtotal': round(subtotal, 2), 'cgst_amount': round(tax / 2, 2), 'sgst_amount': round(tax / 2, 2),
+            'igst_amount': 0, 'tax_amount': round(tax, 2), 'discount_amount': 0,
+            'round_off': round(total - exact, 2), 'total_amount': total,
+            'payment_mode': mode, 'payment_status': 'PAID', 'amount_paid': total, 'amount_due': 0,
+            'status': 'ACTIVE', 'created_at': datetime.combine(day, day_time(12)),
+        })
+        self._add(JournalEntry, entry_date=day, entry_number=None, account_type='PURCHASE',
+                  account_name='Purchases', party_id=supplier_id, debit=round(subtotal, 2), credit=0,
+                  reference_type='PURCHASE', reference_id=purchase_id, reference_number=number,
+                  narration=f'Purchase from {self.party_names[supplier_id]}', financial_year_id=fy_id)
+
+        if mode == 'CREDIT':
+            self._party_entry(supplier_id, day, 'PURCHASE', 'PURCHASE', purchase_id, number, 0, total,
+                              f'Purchase Invoice {number}')
+            paid_on = day + timedelta(days=rng.randint(7, 30))
+            if paid_on <= self.today:
+                self.due[paid_on].append(('payment', (supplier_id, total)))
+            else:
+                # Not yet paid: leave it open
+                row = self.rows[Purchase][-1]
+                row.update(payment_status='UNPAID', amount_paid=0, amount_due=total)
+        else:
+            self._money('CASH', day, supplier_id, 0, total, 'PURCHASE', purchase_id, number,
+                        f'Purchase from {self.party_names[supplier_id]}')
+
+    def _supplier_payment(self, day, supplier_id, amount):
+        self._party_entry(supplier_id, day, 'PAYMENT', 'PAYMENT', None, None, amount, 0,
+                          'Payment made via BANK')
+        self._money('BANK', day, supplier_id, 0, amount, None, None, None,
+                    f'Payment to {self.party_names[supplier_id]}')
+
+    def _expense(self, day):
+        rng = self.rng
+        amount = float(rng.randrange(100, 20_000, 10))
+        is_gst = rng.random() < 0.3
+        mode = 'CASH' if rng.random() < 0.7 else 'BANK'
+        category = rng.randint(1, len(EXPENSE_CATEGORIES))
+        description = EXPENSE_CATEGORIES[category - 1]
+        expense_id = self._add(Expense, expense_date=day, category_id=category, description=description,
+                               amount=amount, is_gst_expense=is_gst,
+                               gst_amount=round(amount * 18 / 118, 2) if is_gst else 0,
+                               payment_mode=mode, reference_number=None, vendor_name=None, notes=None)
+        self._money(mode, day, None, 0, amount, 'EXPENSE', expense_id, None, description,
+                    narration=f'Expense: {description}')
+
+    def _party_entry(self, party_id, day, kind, reference_type, reference_id, number, debit, credit,
+                     narration):
+        self.balances[party_id] += debit - credit
+        return self._add(PartyTransaction, party_id=party_id, transaction_date=day, transaction_type=kind,
+                         reference_type=reference_type, reference_id=reference_id,
+                         reference_number=number, debit=debit, credit=credit,
+                         balance=round(self.balances[party_id], 2), narration=narration)
+
+    def _money(self, mode, day, party_id, money_in, money_out, reference_type, reference_id, number,
+               description, narration=None):
+        """Cash book or bank book entry"""
+        if mode == 'CASH':
+            self._add(CashTransaction, transaction_date=day, party_id=party_id, description=description,
+                      transaction_type='RECEIPT' if money_in else 'PAYMENT',
+                      receipt=money_in, payment=money_out, reference_type=reference_type,
+                      reference_id=reference_id, reference_number=number, narration=narration)
+        else:
+            self._add(BankTransaction, transaction_date=day, party_id=party_id, description=description,
+                      transaction_type='DEPOSIT' if money_in else 'WITHDRAWAL',
+                      deposit=money_in, withdrawal=money_out, reference_type=reference_type,
+                      reference_id=reference_id, reference_number=number, narration=narration)
+
+    def _finish(self, conn):
+        """Final stock and balances on the masters, and the FY number counters"""
+        conn.execute(
+            update(Product.__table__).where(Product.id == bindparam('product_id')).values(
+                current_stock=bindparam('stock'), average_cost=bindparam('cost'),
+                cost_value=bindparam('value')),
+            [{'product_id': p['id'], 'stock': self.stock[p['id']], 'cost': p['cost_price'],
+              'value': round(self.stock[p['id']] * p['cost_price'], 4)} for p in self.product_rows])
+        conn.execute(
+            update(Party.__table__).where(Party.id == bindparam('party_id'))
+            .values(current_balance=bindparam('balance')),
+            [{'party_id': party_id, 'balance': round(balance, 2)}
+             for party_id, balance in self.balances.items()])
+
+        for fy_id, (invoices, purchases) in self.counters.items():
+            conn.execute(update(FinancialYear.__table__).where(FinancialYear.id == fy_id)
+                         .values(invoice_counter=invoices, purchase_counter=purchases))
+
+        self.counts.update(products=self.products, parties=self.customers + self.suppliers,
+                           employees=self.employees)
+
+
+def generate(path, scale, seed=42, progress=None):
+    """Write the dataset for a scale to path (which must not exist); returns row counts"""
+    if os.path.exists(path):
+        raise FileExistsError(path)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    return DatasetGenerator(path, seed=seed, **scale_params(scale)).generate(progress)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a benchmark dataset')
+    parser.add_argument('scale', help='10k, 100k, 1m or an invoice count')
+    parser.add_argument('path', help='database file to create')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    def progress(done, total):
+        print(f'\r  {done}/{total} days', end='', file=sys.stderr)
+
+    started = time.perf_counter()
+    counts = generate(args.path, args.scale, args.seed, progress)
+    print(file=sys.stderr)
+    for table, count in sorted(counts.items()):
+        print(f'{table:24} {count:>10}')
+    print(f'Generated in {time.perf_counter() - started:.1f}s')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
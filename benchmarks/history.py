@@ -0,0 +1,238 @@
+"""
+Benchmark History
+Keeps every benchmark and load-test result in one JSON-lines file and
+compares a run against a baseline, so a slower billing.create or GST report
+shows up before an upgrade goes out.
+
+    python -m benchmarks --scale 100k --compare
+    python -m benchmarks.history list
+    python -m benchmarks.history baseline 12
+    python -m benchmarks.history compare benchmarks/results/20250101-120000-100k.json
+"""
+import argparse
+import json
+import os
+import sys
+
+from benchmarks.runner import RESULTS_DIR
+
+
+HISTORY_FILE = os.path.join(RESULTS_DIR, 'history.jsonl')
+BASELINES_FILE = os.path.join(RESULTS_DIR, 'baselines.json')
+
+# metric: (label, option, default allowed increase in percent)
+METRICS = {
+    'p50_ms': ('p50 ms', '--max-p50', 20.0),
+    'p95_ms': ('p95 ms', '--max-p95', 30.0),
+    'queries_per_request': ('queries', '--max-queries', 0.0),
+    'peak_rss_mb': ('RSS MB', '--max-rss', 15.0),
+}
+
+# Timing changes smaller than this are noise, whatever the percentage
+MIN_DELTA_MS = 5.0
+
+
+def _key(document):
+    """Runs are only comparable with the same kind of run at the same scale"""
+    run = document['run']
+    return run.get('kind', 'scenarios'), str(run['scale'])
+
+
+def load(path=HISTORY_FILE):
+    """All recorded runs, oldest first"""
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def record(document, path=HISTORY_FILE):
+    """Append a results document to the history; returns its run id"""
+    runs = load(path)
+    run_id = runs[-1]['id'] + 1 if runs else 1
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({'id': run_id, 'run': document['run'],
+                            'scenarios': document['scenarios']}) + '\n')
+    return run_id
+
+
+def _baselines(path=BASELINES_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def set_baseline(run_id, history_path=HISTORY_FILE, path=BASELINES_FILE):
+    """Pin a recorded run as the baseline for its kind and scale"""
+    run = next((r for r in load(history_path) if r['id'] == run_id), None)
+    if run is None:
+        raise ValueError(f'No run {run_id} in the history')
+    baselines = _baselines(path)
+    baselines['/'.join(_key(run))] = run_id
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(baselines, f, indent=2)
+    return run
+
+
+def find_baseline(document, spec=None, history_path=HISTORY_FILE):
+    """
+    The run to compare against: a results file, a run id, a commit, or by
+    default the pinned baseline for this kind and scale, else the latest
+    earlier run of it.
+    """
+    if spec and os.path.exists(spec):
+        with open(spec, encoding='utf-8') as f:
+            return json.load(f)
+
+    key = _key(document)
+    current_id = document.get('id')
+    runs = [r for r in load(history_path) if _key(r) == key and r['id'] != current_id]
+    if spec:
+        if spec.isdigit():
+            return next((r for r in runs if r['id'] == int(spec)), None)
+        matches = [r for r in runs if (r['run'].get('commit') or '').startswith(spec)]
+        return matches[-1] if matches else None
+
+    pinned = _baselines().get('/'.join(key))
+    for run in runs:
+        if run['id'] == pinned:
+            return run
+    if current_id is not None:
+        runs = [r for r in runs if r['id'] < current_id]
+    return runs[-1] if runs else None
+
+
+def compare(current, baseline, thresholds=None):
+    """
+    One row per scenario and metric present in both runs. A row regresses
+    when the metric grew by more than its allowed percentage (and, for
+    timings, by more than MIN_DELTA_MS).
+    """
+    thresholds = {**{m: pct for m, (_, _, pct) in METRICS.items()}, **(thresholds or {})}
+    before = {s['scenario']: s for s in baseline['scenarios']}
+    rows = []
+    for scenario in current['scenarios']:
+        old = before.get(scenario['scenario'])
+        if old is None:
+            continue
+        for metric in METRICS:
+            new_value, old_value = scenario.get(metric), old.get(metric)
+            if new_value is None or old_value is None:
+                continue
+            change = (new_value - old_value) / old_value * 100 if old_value else (100.0 if new_value else 0.0)
+            regressed = change > thresholds[metric]
+            if metric.endswith('_ms') and new_value - old_value < MIN_DELTA_MS:
+                regressed = False
+            rows.append({
+                'scenario': scenario['scenario'],
+                'metric': metric,
+                'baseline': old_value,
+                'current': new_value,
+                'change_pct': round(change, 1),
+                'regressed': regressed,
+            })
+    return rows
+
+
+def print_table(rows, current, baseline, out=sys.stdout):
+    def describe(document):
+        run = document['run']
+        label = f"run {document['id']}" if 'id' in document else 'file'
+        return f"{label} ({run.get('commit') or 'no commit'}, {run.get('started_at', '')})"
+
+    print(f'Baseline: {describe(baseline)}', file=out)
+    print(f'Current:  {describe(current)}', file=out)
+    print(f"{'Scenario':<24} {'Metric':<8} {'Baseline':>10} {'Current':>10} {'Change':>9}", file=out)
+    for row in rows:
+        flag = '  REGRESSION' if row['regressed'] else ''
+        print(f"{row['scenario']:<24} {METRICS[row['metric']][0]:<8} {row['baseline']:>10} "
+              f"{row['current']:>10} {row['change_pct']:>+8.1f}%{flag}", file=out)
+    regressions = sum(row['regressed'] for row in rows)
+    print(f'{regressions} regression(s)' if regressions else 'No regressions', file=out)
+
+
+def add_threshold_arguments(parser):
+    group = parser.add_argument_group('regression thresholds (allowed increase in percent)')
+    for metric, (label, option, pct) in METRICS.items():
+        group.add_argument(option, dest=metric, type=float, default=pct,
+                           help=f'{label} (default {pct:g})')
+
+
+def thresholds_from(args):
+    return {metric: getattr(args, metric) for metric in METRICS}
+
+
+def check(document, spec=None, thresholds=None, out=sys.stdout):
+    """Compare a run with its baseline and print the table; True when nothing regressed"""
+    baseline = find_baseline(document, spec)
+    if baseline is None:
+        print('No baseline to compare with yet; this run will serve as one.', file=out)
+        return True
+    rows = compare(document, baseline, thresholds)
+    print_table(rows, document, baseline, out)
+    return not any(row['regressed'] for row in rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.history',
+                                     description='Benchmark run history and regression checks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('list', help='list recorded runs')
+
+    pin = commands.add_parser('baseline', help='pin a run as the baseline for its scale')
+    pin.add_argument('run_id', type=int)
+
+    add = commands.add_parser('record', help='add a results file to the history')
+    add.add_argument('results')
+
+    diff = commands.add_parser('compare', help='compare a run with its baseline')
+    diff.add_argument('current', nargs='?',
+                      help='results file or run id (default: the latest recorded run)')
+    diff.add_argument('--baseline', help='results file, run id or commit (default: pinned or previous run)')
+    add_threshold_arguments(diff)
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'list':
+        pinned = set(_baselines().values())
+        for run in load():
+            info = run['run']
+            mark = '*' if run['id'] in pinned else ' '
+            print(f"{mark}{run['id']:>4}  {info.get('started_at', ''):<19}  {info.get('commit') or '-':<8}  "
+                  f"{info.get('kind', 'scenarios'):<9}  {info['scale']}")
+        return 0
+
+    if args.command == 'baseline':
+        try:
+            run = set_baseline(args.run_id)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 2
+        print(f"Run {run['id']} is now the {'/'.join(_key(run))} baseline")
+        return 0
+
+    if args.command == 'record':
+        with open(args.results, encoding='utf-8') as f:
+            print(f'Recorded as run {record(json.load(f))}')
+        return 0
+
+    runs = load()
+    if args.current and os.path.exists(args.current):
+        with open(args.current, encoding='utf-8') as f:
+            current = json.load(f)
+    elif args.current:
+        current = next((r for r in runs if str(r['id']) == args.current), None)
+    else:
+        current = runs[-1] if runs else None
+    if current is None:
+        print('Nothing to compare', file=sys.stderr)
+        return 2
+    return 0 if check(current, args.baseline, thresholds_from(args)) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,335 @@
+"""
+Multi-counter Load Test
+Serves a scratch copy of a benchmark dataset from a separate process and
+has several billing counters post invoices at once while others read
+reports, the way a busy shop shares one SQLite file.
+
+    python -m benchmarks.loadtest --scale 100k --counters 6 --readers 2 --duration 60
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import re
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime
+from html import unescape
+from urllib.parse import urlencode
+
+from benchmarks.runner import DATA_DIR, RESULTS_DIR, _percentile, git_commit, prepare
+from benchmarks.workdir import configure
+
+
+FLASH_ERROR = re.compile(r'Error creating invoice: ([^<]*)')
+
+# Failed invoice posts by the error they flashed
+LOCKED = 'database is locked'
+COLLISION = 'UNIQUE constraint failed: invoices.invoice_number'
+
+
+def serve(work_dir, processes):
+    """Server process: run the app on a free port and print it"""
+    from werkzeug.serving import make_server
+
+    # One access log line per request would swamp the summary
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    configure(work_dir)
+    from app import create_app
+    app = create_app()
+    server = make_server('127.0.0.1', 0, app, threaded=processes == 1, processes=processes)
+    print(f'PORT {server.server_port}', flush=True)
+    server.serve_forever()
+
+
+def _request(port, method, path, form=None, cookie=None):
+    """One request on its own connection; returns (status, headers, body)"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+    headers = {}
+    body = None
+    if form is not None:
+        body = urlencode(form, doseq=True)
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+    if cookie:
+        headers['Cookie'] = cookie
+    try:
+        conn.request(method, path, body, headers)
+        response = conn.getresponse()
+        return response.status, response.headers, response.read()
+    finally:
+        conn.close()
+
+
+class Shop:
+    """Customers, products and dates to build realistic requests from"""
+
+    def __init__(self, path):
+        conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+        try:
+            self.customers = [row[0] for row in conn.execute(
+                "SELECT id FROM parties WHERE party_type = 'customer' ORDER BY id")]
+            self.products = conn.execute('SELECT id, selling_price FROM products ORDER BY id').fetchall()
+            self.years = [int(row[0]) for row in conn.execute(
+                "SELECT DISTINCT strftime('%Y', invoice_date) FROM invoices")]
+        finally:
+            conn.close()
+        # Popular products sell far more often than the long tail
+        self.weights = []
+        total = 0.0
+        for i in range(len(self.products)):
+            total += 1 / (i + 1) ** 0.8
+            self.weights.append(total)
+
+    def invoice_form(self, rng):
+        lines = rng.choices(self.products, cum_weights=self.weights, k=rng.randint(1, 8))
+        return {
+            'party_id': rng.choice(self.customers),
+            'invoice_date': date.today().isoformat(),
+            'is_gst_invoice': 'on',
+            'payment_mode': rng.choices(('CASH', 'BANK', 'CREDIT'), (60, 15, 25))[0],
+            'product_id[]': [product_id for product_id, _ in lines],
+            'quantity[]': [str(rng.randint(1, 5)) for _ in lines],
+            'rate[]': [str(price) for _, price in lines],
+            'discount[]': ['5' if rng.random() < 0.1 else '0' for _ in lines],
+        }
+
+    def report_path(self, rng):
+        today = date.today()
+        month_start = today.replace(day=1).isoformat()
+        return rng.choice((
+            f'/reports/gst-report?date_from={month_start}&date_to={today.isoformat()}',
+            f'/reports/sales-report?date_from={month_start}&date_to={today.isoformat()}',
+            f'/billing/?search={rng.randint(1, 999):03d}',
+            f'/ledgers/{rng.choice(self.customers)}',
+            f'/accounting/monthly-summary?year={rng.choice(self.years or [today.year])}',
+        ))
+
+
+class LoadTest:
+    """Counters posting invoices and readers opening reports until the time is up"""
+
+    def __init__(self, port, shop, counters, readers, duration, think, seed):
+        self.port = port
+        self.shop = shop
+        self.counters = counters
+        self.readers = readers
+        self.deadline = None
+        self.duration = duration
+        self.think = think
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.create_ms = []
+        self.read_ms = []
+        self.failures = Counter()
+        self.read_errors = 0
+        self.created_ids = []
+
+    def _counter(self, index):
+        rng = random.Random(self.seed * 1000 + index)
+        while time.perf_counter() < self.deadline:
+            form = self.shop.invoice_form(rng)
+            started = time.perf_counter()
+            status, headers, _ = _request(self.port, 'POST', '/billing/create', form)
+            elapsed = (time.perf_counter() - started) * 1000
+            location = headers.get('Location', '')
+
+            if status == 302 and not location.endswith('/new'):
+                with self.lock:
+                    self.create_ms.append(elapsed)
+                    self.created_ids.append(int(location.rstrip('/').rsplit('/', 1)[-1]))
+            else:
+                reason = self._failure_reason(headers)
+                with self.lock:
+                    self.failures[reason] += 1
+            if self.think:
+                time.sleep(rng.uniform(0, 2 * self.think))
+
+    def _failure_reason(self, headers):
+        """The error the server flashed for a failed invoice post"""
+        cookie = headers.get('Set-Cookie', '').split(';', 1)[0]
+        _, _, body = _request(self.port, 'GET', '/billing/new', cookie=cookie)
+        match = FLASH_ERROR.search(body.decode('utf-8', 'replace'))
+        message = unescape(match.group(1)) if match else 'unknown'
+        if LOCKED in message:
+            return 'locked'
+        if COLLISION in message:
+            return 'number_collision'
+        return message.strip()[:120]
+
+    def _reader(self, index):
+        rng = random.Random(self.seed * 1000 + 500 + index)
+        while time.perf_counter() < self.deadline:
+            path = self.shop.report_path(rng)
+            started = time.perf_counter()
+            status, _, _ = _request(self.port, 'GET', path)
+            elapsed = (time.perf_counter() - started) * 1000
+            with self.lock:
+                self.read_ms.append(elapsed)
+                if status != 200:
+                    self.read_errors += 1
+
+    def run(self):
+        threads = [threading.Thread(target=self._counter, args=(i,)) for i in range(self.counters)]
+        threads += [threading.Thread(target=self._reader, args=(i,)) for i in range(self.readers)]
+        started = time.perf_counter()
+        self.deadline = started + self.duration
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
+
+
+def _latency(name, endpoint, timings, errors, elapsed):
+    timings = sorted(timings)
+    return {
+        'scenario': name,
+        'endpoint': endpoint,
+        'requests': len(timings) + errors,
+        'errors': errors,
+        'throughput_per_s': round(len(timings) / elapsed, 2),
+        'p50_ms': round(_percentile(timings, 50), 2) if timings else None,
+        'p95_ms': round(_percentile(timings, 95), 2) if timings else None,
+        'p99_ms': round(_percentile(timings, 99), 2) if timings else None,
+        'max_ms': round(timings[-1], 2) if timings else None,
+    }
+
+
+def number_check(path, invoice_ids):
+    """Duplicate numbers among the invoices created, and gaps in this FY's numbering"""
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        numbers = []
+        for start in range(0, len(invoice_ids), 500):
+            chunk = invoice_ids[start:start + 500]
+            numbers += [row[0] for row in conn.execute(
+                f"SELECT invoice_number FROM invoices WHERE id IN ({','.join('?' * len(chunk))})", chunk)]
+        duplicates = len(numbers) - len(set(numbers))
+
+        fy_id, counter = conn.execute(
+            'SELECT id, invoice_counter FROM financial_years WHERE is_active = 1').fetchone()
+        issued = {int(row[0].rsplit('/', 1)[-1]) for row in conn.execute(
+            'SELECT invoice_number FROM invoices WHERE financial_year_id = ?', (fy_id,))}
+        gaps = len(set(range(1, counter + 1)) - issued)
+    finally:
+        conn.close()
+    return duplicates, gaps
+
+
+def main(argv=None):
+    from benchmarks import history
+
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.loadtest',
+                                     description='Concurrent billing counters against one SQLite file')
+    parser.add_argument('--scale', default='10k', help='dataset: 10k, 100k, 1m or an invoice count')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--counters', type=int, default=4, help='billing counters posting invoices')
+    parser.add_argument('--readers', type=int, default=1, help='clients opening reports meanwhile')
+    parser.add_argument('--duration', type=float, default=30, help='seconds to run')
+    parser.add_argument('--think', type=float, default=0,
+                        help='average seconds a counter waits between bills (0 = flat out)')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='server worker processes (1 = one threaded process; more needs fork)')
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--output', help='results file (default benchmarks/results/<time>-load-<scale>.json)')
+    parser.add_argument('--no-history', action='store_true', help='do not add this run to the history')
+    parser.add_argument('--compare', action='store_true',
+                        help='compare with the baseline and exit non-zero on a regression')
+    parser.add_argument('--baseline', help='results file, run id or commit to compare with')
+    history.add_threshold_arguments(parser)
+    parser.add_argument('--serve', metavar='WORK_DIR', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        serve(args.serve, args.processes)
+        return 0
+
+    path = prepare(args.scale, args.seed, args.data_dir)
+    work_dir = os.path.dirname(path)
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.loadtest', '--serve', work_dir, '--processes', str(args.processes)],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        stdout=subprocess.PIPE, text=True)
+    try:
+        line = server.stdout.readline()
+        if not line.startswith('PORT '):
+            print('The server did not start', file=sys.stderr)
+            return 2
+        port = int(line.split()[1])
+
+        print(f'Load test: {args.counters} counters, {args.readers} readers, {args.duration:g}s '
+              f'against the {args.scale} dataset', file=sys.stderr)
+        test = LoadTest(port, Shop(path), args.counters, args.readers, args.duration, args.think, args.seed)
+        elapsed = test.run()
+
+        server_lock_errors = None
+        if args.processes == 1:
+            status, _, body = _request(port, 'GET', '/metrics')
+            match = re.search(rb'^billpro_sqlite_lock_errors_total (\d+)', body, re.M)
+            if status == 200 and match:
+                server_lock_errors = int(match.group(1))
+    finally:
+        server.terminate()
+        server.wait()
+
+    duplicates, gaps = number_check(path, test.created_ids)
+    failures = dict(test.failures)
+    document = {
+        'run': {
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'kind': 'load',
+            'scale': args.scale,
+            'seed': args.seed,
+            'counters': args.counters,
+            'readers': args.readers,
+            'processes': args.processes,
+            'think_s': args.think,
+            'duration_s': round(elapsed, 1),
+        },
+        'scenarios': [
+            _latency('load_billing_create', 'billing.create', test.create_ms,
+                     sum(failures.values()), elapsed),
+            _latency('load_report_reads', 'reports', test.read_ms, test.read_errors, elapsed),
+        ],
+        'invoices': {
+            'created': len(test.created_ids),
+            'failed': failures,
+            'locked_errors': failures.get('locked', 0),
+            'number_collisions': failures.get('number_collision', 0) + duplicates,
+            'number_gaps': gaps,
+            'server_lock_errors': server_lock_errors,
+        },
+    }
+
+    create, reads = document['scenarios']
+    print(f"Invoices: {create['requests']} posted, {len(test.created_ids)} created, "
+          f"{create['throughput_per_s']}/s, p50 {create['p50_ms']} ms, p95 {create['p95_ms']} ms, "
+          f"p99 {create['p99_ms']} ms")
+    print(f"Reports:  {reads['requests']} read, {reads['throughput_per_s']}/s, p50 {reads['p50_ms']} ms, "
+          f"p95 {reads['p95_ms']} ms, {reads['errors']} errors")
+    print(f"Failures: {failures or 'none'}; 'database is locked': {failures.get('locked', 0)}; "
+          f"number collisions: {document['invoices']['number_collisions']}; number gaps: {gaps}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-load-{args.scale}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(document, f, indent=2)
+    print(f'Results written to {output}', file=sys.stderr)
+    if not args.no_history:
+        document['id'] = history.record(document)
+
+    failed = bool(failures or duplicates)
+    if args.compare or args.baseline:
+        failed = not history.check(document, args.baseline, history.thresholds_from(args)) or failed
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
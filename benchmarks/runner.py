@@ -0,0 +1,251 @@
+"""
+Benchmark Runner
+Loads a generated dataset into a scratch copy, times each scenario through
+the Flask test client and writes the results as JSON.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from benchmarks.datagen import generate, scale_params
+from benchmarks.workdir import configure
+
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BENCH_DIR, 'data')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+_queries = [0]
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    _queries[0] += 1
+
+
+def _percentile(values, pct):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return None
+    return values[max(0, math.ceil(pct / 100 * len(values)) - 1)]
+
+
+def peak_rss_mb(children=False):
+    """Peak resident memory of this process (or its largest child), where the platform reports it"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    peak = resource.getrusage(who).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR,
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def dataset_path(scale, seed, data_dir=DATA_DIR):
+    return os.path.join(data_dir, f'billpro-{scale}-seed{seed}.db')
+
+
+def prepare(scale, seed, data_dir=DATA_DIR, regenerate=False):
+    """
+    Generate the dataset once per scale and seed, then run against a fresh
+    copy in a scratch folder so writes never change the next run's data.
+    Returns the scratch database path.
+    """
+    source = dataset_path(scale, seed, data_dir)
+    if regenerate and os.path.exists(source):
+        os.remove(source)
+    if not os.path.exists(source):
+        print(f'Generating {scale} dataset (seed {seed})...', file=sys.stderr)
+        started = time.perf_counter()
+        partial = source + '.partial'
+        for stale in (partial, partial + '-wal', partial + '-shm'):
+            if os.path.exists(stale):
+                os.remove(stale)
+        generate(partial, scale, seed)
+        os.replace(partial, source)
+        print(f'  done in {time.perf_counter() - started:.1f}s', file=sys.stderr)
+
+    work_dir = os.path.join(data_dir, 'run')
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir)
+    shutil.copyfile(source, os.path.join(work_dir, 'billpro.db'))
+    return configure(work_dir)
+
+
+# Run in a fresh interpreter so the imports are timed too
+COLD_START_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+from benchmarks.workdir import configure
+configure(sys.argv[1])
+from app import create_app
+app = create_app()
+print(json.dumps(dict(app.extensions['billpro_startup'], process=time.perf_counter() - started)))
+"""
+
+
+def measure_cold_start(work_dir, repeat, warmup=1):
+    """
+    Time create_app from interpreter start. The warmup run also brings the
+    dataset's schema up to date, as the first start after an upgrade does.
+    """
+    timings, phases, errors = [], {}, 0
+    for i in range(warmup + repeat):
+        result = subprocess.run([sys.executable, '-c', COLD_START_SCRIPT, work_dir],
+                                cwd=os.path.dirname(BENCH_DIR), capture_output=True, text=True)
+        if i < warmup:
+            continue
+        if result.returncode != 0:
+            errors += 1
+            continue
+        startup = json.loads(result.stdout.strip().splitlines()[-1])
+        timings.append(startup.pop('process') * 1000)
+        for phase, seconds in startup.items():
+            phases.setdefault(phase, []).append(seconds * 1000)
+
+    timings.sort()
+    return {
+        'scenario': 'cold_start',
+        'endpoint': 'create_app',
+        'requests': repeat,
+        'errors': errors,
+        'p50_ms': round(_percentile(timings, 50), 2) if timings else None,
+        'p95_ms': round(_percentile(timings, 95), 2) if timings else None,
+        'mean_ms': round(sum(timings) / len(timings), 2) if timings else None,
+        'min_ms': round(timings[0], 2) if timings else None,
+        'max_ms': round(timings[-1], 2) if timings else None,
+        'phases_p50_ms': {phase: round(_percentile(sorted(values), 50), 2) for phase, values in phases.items()},
+        'peak_rss_mb': peak_rss_mb(children=True),
+    }
+
+
+def run_scenario(client, scenario, dataset, repeat, warmup=1):
+    """Time repeat requests after warmup untimed ones"""
+    timings, queries, errors = [], [], 0
+    for i in range(warmup + repeat):
+        method, url, data = scenario.request(dataset, i)
+        _queries[0] = 0
+        started = time.perf_counter()
+        response = client.open(url, method=method, data=data)
+        response.get_data()
+        elapsed = (time.perf_counter() - started) * 1000
+        if i < warmup:
+            continue
+        timings.append(elapsed)
+        queries.append(_queries[0])
+        if not scenario.ok(response):
+            errors += 1
+
+    timings.sort()
+    return {
+        'scenario': scenario.name,
+        'endpoint': scenario.endpoint,
+        'requests': repeat,
+        'errors': errors,
+        'p50_ms': round(_percentile(timings, 50), 2),
+        'p95_ms': round(_percentile(timings, 95), 2),
+        'mean_ms': round(sum(timings) / len(timings), 2),
+        'min_ms': round(timings[0], 2),
+        'max_ms': round(timings[-1], 2),
+        'queries_per_request': round(sum(queries) / len(queries), 1),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def run(scale, seed=42, repeat=10, names=None, data_dir=DATA_DIR, regenerate=False):
+    """Run the scenarios against a scale and return the results document"""
+    path = prepare(scale, seed, data_dir, regenerate)
+
+    results = []
+    if not names or 'cold_start' in names:
+        print('  cold_start...', end='', flush=True, file=sys.stderr)
+        result = measure_cold_start(os.path.dirname(path), max(3, repeat // 2))
+        print(f" p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms", file=sys.stderr)
+        results.append(result)
+
+    from app import create_app
+    from benchmarks.scenarios import SCENARIOS, Dataset
+
+    app = create_app()
+    client = app.test_client()
+    event.listen(Engine, 'before_cursor_execute', _count_query)
+
+    with app.app_context():
+        dataset = Dataset(seed)
+
+    scenarios = [s for s in SCENARIOS if not names or s.name in names]
+    for scenario in scenarios:
+        print(f'  {scenario.name}...', end='', flush=True, file=sys.stderr)
+        result = run_scenario(client, scenario, dataset, repeat)
+        print(f" p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms", file=sys.stderr)
+        results.append(result)
+
+    return {
+        'run': {
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'scale': scale,
+            'seed': seed,
+            'repeat': repeat,
+        },
+        'dataset': scale_params(scale),
+        'scenarios': results,
+    }
+
+
+def main(argv=None):
+    from benchmarks import history
+    from benchmarks.scenarios import SCENARIOS
+
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Run the BillPro benchmarks')
+    parser.add_argument('--scale', default='10k', help='10k, 100k, 1m or an invoice count (default 10k)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=10, help='timed requests per scenario')
+    parser.add_argument('--scenario', action='append', choices=['cold_start'] + [s.name for s in SCENARIOS],
+                        help='run only this scenario (repeatable)')
+    parser.add_argument('--data-dir', default=DATA_DIR, help='where datasets are generated and kept')
+    parser.add_argument('--regenerate', action='store_true', help='generate the dataset again')
+    parser.add_argument('--output', help='results file (default benchmarks/results/<time>-<scale>.json)')
+    parser.add_argument('--no-history', action='store_true', help='do not add this run to the history')
+    parser.add_argument('--compare', action='store_true',
+                        help='compare with the baseline and exit non-zero on a regression')
+    parser.add_argument('--baseline', help='results file, run id or commit to compare with')
+    history.add_threshold_arguments(parser)
+    args = parser.parse_args(argv)
+
+    print(f'BillPro benchmarks, scale {args.scale}', file=sys.stderr)
+    document = run(args.scale, args.seed, args.repeat, args.scenario, args.data_dir, args.regenerate)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{args.scale}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(document, f, indent=2)
+    print(f'Results written to {output}', file=sys.stderr)
+    if not args.no_history:
+        document['id'] = history.record(document)
+
+    failed = any(r['errors'] for r in document['scenarios'])
+    if args.compare or args.baseline:
+        failed = not history.check(document, args.baseline, history.thresholds_from(args)) or failed
+    return 1 if failed else 0
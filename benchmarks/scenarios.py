@@ -0,0 +1,125 @@
+"""
+Benchmark Scenarios
+Each scenario builds its i-th request from the dataset, so every run of a
+scale and seed sends the same requests in the same order.
+"""
+import random
+from collections import namedtuple
+from datetime import date, timedelta
+
+from sqlalchemy import func
+
+from app.models import db, Invoice, Party, Product
+
+
+# request(dataset, i) returns (method, url, data); ok(response) says whether it worked
+Scenario = namedtuple('Scenario', ['name', 'endpoint', 'request', 'ok'])
+
+
+class Dataset:
+    """What the scenarios need to know about the loaded data"""
+
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+        self.customers = [row for row in db.session.query(Party.id, Party.name)
+                          .filter(Party.party_type == 'customer').order_by(Party.id)]
+        self.products = [row for row in db.session.query(Product.id, Product.selling_price)
+                         .order_by(Product.id)]
+        first, last = db.session.query(func.min(Invoice.invoice_date), func.max(Invoice.invoice_date)).one()
+        self.first_day, self.last_day = first, last
+
+        # Whole months with invoices, newest first
+        self.months = []
+        month = last.replace(day=1)
+        while month >= first.replace(day=1):
+            self.months.append(month)
+            month = (month - timedelta(days=1)).replace(day=1)
+        self.years = sorted({month.year for month in self.months}, reverse=True)
+
+    def month_range(self, i):
+        start = self.months[i % len(self.months)]
+        end = (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+        return start.isoformat(), end.isoformat()
+
+
+def _redirects_to(fragment):
+    return lambda response: response.status_code == 302 and fragment in response.headers.get('Location', '')
+
+
+def _is_ok(response):
+    return response.status_code == 200
+
+
+def _invoice_created(response):
+    # Failures go back to the new invoice form
+    return response.status_code == 302 and not response.headers.get('Location', '').endswith('/new')
+
+
+def _billing_create(data, i):
+    rng = data.rng
+    customer_id, _ = rng.choice(data.customers)
+    lines = rng.sample(data.products, min(3, len(data.products)))
+    return 'POST', '/billing/create', {
+        'party_id': customer_id,
+        'invoice_date': date.today().isoformat(),
+        'is_gst_invoice': 'on',
+        'payment_mode': rng.choice(('CASH', 'CASH', 'BANK', 'CREDIT')),
+        'product_id[]': [product_id for product_id, _ in lines],
+        'quantity[]': [str(rng.randint(1, 5)) for _ in lines],
+        'rate[]': [str(price) for _, price in lines],
+        'discount[]': ['0' for _ in lines],
+    }
+
+
+def _billing_search(data, i):
+    if i % 2:
+        _, name = data.customers[i * 7919 % len(data.customers)]
+        return 'GET', f'/billing/?search={name[-4:]}', None
+    year = data.months[i % len(data.months)]
+    return 'GET', f'/billing/?search=/{str(year.year)[-2:]}', None
+
+
+def _gst_report(data, i):
+    date_from, date_to = data.month_range(i)
+    return 'GET', f'/reports/gst-report?date_from={date_from}&date_to={date_to}', None
+
+
+def _sales_report_csv(data, i):
+    date_from, date_to = data.month_range(i)
+    return 'GET', f'/reports/sales-report/csv?date_from={date_from}&date_to={date_to}', None
+
+
+def _sales_report_pdf(data, i):
+    date_from, date_to = data.month_range(i)
+    return 'GET', f'/reports/sales-report/pdf?date_from={date_from}&date_to={date_to}', None
+
+
+def _ledger(data, i):
+    customer_id, _ = data.customers[i * 104729 % len(data.customers)]
+    return 'GET', f'/ledgers/{customer_id}', None
+
+
+def _monthly_summary(data, i):
+    return 'GET', f'/accounting/monthly-summary?year={data.years[i % len(data.years)]}', None
+
+
+def _process_payroll(data, i):
+    # A different, not yet processed month every time, counting back from this one
+    month = date.today().replace(day=1)
+    for _ in range(i):
+        month = (month - timedelta(days=1)).replace(day=1)
+    return 'POST', '/payroll/process', {'month': month.month, 'year': month.year, 'total_days': 30}
+
+
+# Read-only scenarios first, so the writes do not change what they read
+SCENARIOS = [
+    Scenario('billing_index_search', 'billing.index', _billing_search, _is_ok),
+    Scenario('gst_report', 'reports.gst_report', _gst_report, _is_ok),
+    Scenario('sales_report_csv', 'reports.sales_report_csv', _sales_report_csv, _is_ok),
+    Scenario('sales_report_pdf', 'reports.sales_report_pdf', _sales_report_pdf, _is_ok),
+    Scenario('ledger_view', 'ledgers.view', _ledger, _is_ok),
+    Scenario('monthly_summary', 'accounting.monthly_summary', _monthly_summary, _is_ok),
+    Scenario('billing_create', 'billing.create', _billing_create, _invoice_created),
+    Scenario('process_payroll', 'payroll.process_payroll', _process_payroll,
+             _redirects_to('/payroll/salary-slips')),
+]
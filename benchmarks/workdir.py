@@ -0,0 +1,27 @@
+"""
+Benchmark Working Folder
+Points the app's Config at a scratch copy of a dataset. Imports nothing but
+the settings, so a fresh interpreter can use it before timing a cold start.
+"""
+import os
+
+from config.settings import Config
+
+
+def configure(work_dir):
+    """Point the app's Config at a scratch folder; returns its database path"""
+    path = os.path.join(work_dir, 'billpro.db')
+    Config.DATABASE_DIR = work_dir
+    Config.DATABASE_PATH = path
+    Config.SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+    Config.BACKUP_DIR = os.path.join(work_dir, 'backups')
+    Config.ARCHIVE_DIR = os.path.join(work_dir, 'archive')
+    Config.PROFILE_DIR = os.path.join(work_dir, 'profiles')
+    Config.EXPORTS_DIR = os.path.join(work_dir, 'exports')
+    Config.TEMPLATE_CACHE_DIR = os.path.join(work_dir, 'template_cache')
+    Config.SLOW_QUERY_LOG = os.path.join(work_dir, 'slow_queries.jsonl')
+    Config.SLOW_QUERY_MS = 0
+    Config.PERF_MONITOR = False
+    Config.BACKGROUND_JOBS = False
+    Config.DEBUG = False
+    return path
@@ -27,13 +27,18 @@ a = Analysis(
         ('bill_templates', 'bill_templates'),
         # Create empty database folder
         ('database', 'database'),
-    ],
+    ] + (
+        # Templates precompiled by `python run.py precompile-templates`
+        [('build/template_cache', 'template_cache')]
+        if os.path.isdir(os.path.join(BASE_DIR, 'build', 'template_cache')) else []
+    ),
     hiddenimports=[
         'flask',
         'flask_sqlalchemy',
         'sqlalchemy',
         'jinja2',
         'werkzeug',
+        'waitress',
         'reportlab',
         'reportlab.lib',
         'reportlab.lib.colors',
@@ -49,6 +54,7 @@ a = Analysis(
         'win32ui',
         'escpos',
         'escpos.printer',
+        'pypdf',
     ],
     hookspath=[],
     hooksconfig={},
@@ -13,7 +13,7 @@ if errorlevel 1 (
 )
 
 REM Install PyInstaller if not present
-echo [1/4] Checking PyInstaller...
+echo [1/5] Checking PyInstaller...
 pip show pyinstaller > nul 2>&1
 if errorlevel 1 (
     echo Installing PyInstaller...
@@ -21,16 +21,20 @@ if errorlevel 1 (
 )
 
 REM Install dependencies
-echo [2/4] Installing dependencies...
+echo [2/5] Installing dependencies...
 pip install -r requirements.txt
 
 REM Clean previous builds
-echo [3/4] Cleaning previous builds...
+echo [3/5] Cleaning previous builds...
 if exist "dist" rmdir /s /q dist
 if exist "build" rmdir /s /q build
 
+REM Precompile templates into the bundle
+echo [4/5] Precompiling templates...
+python run.py precompile-templates build\template_cache
+
 REM Build the executable
-echo [4/4] Building executable...
+echo [5/5] Building executable...
 echo This may take a few minutes...
 echo.
 pyinstaller billpro.spec --clean
@@ -15,6 +15,8 @@ class Config:
     DATABASE_PATH = os.path.join(BASE_DIR, 'database', 'billpro.db')
     SQLALCHEMY_DATABASE_URI = f'sqlite:///{DATABASE_PATH}'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # URI filenames let FY archives be attached read-only
+    SQLALCHEMY_ENGINE_OPTIONS = {'connect_args': {'uri': True}}
     
     # Application
     SECRET_KEY = 'billpro-local-key-change-in-production'
@@ -24,6 +26,9 @@ class Config:
     CONFIG_DIR = os.path.join(BASE_DIR, 'config')
     BILL_TEMPLATES_DIR = os.path.join(BASE_DIR, 'bill_templates')
     DATABASE_DIR = os.path.join(BASE_DIR, 'database')
+    EXPORTS_DIR = os.path.join(BASE_DIR, 'exports')
+    BACKUP_DIR = os.path.join(BASE_DIR, 'database', 'backups')
+    ARCHIVE_DIR = os.path.join(BASE_DIR, 'database', 'archive')
     
     # Company config file
     COMPANY_CONFIG = os.path.join(CONFIG_DIR, 'company.json')
@@ -37,6 +42,66 @@ class Config:
     INVOICE_PREFIX = 'INV'
     PURCHASE_PREFIX = 'PUR'
     
+    # Read-only reporting connections
+    REPORT_POOL_SIZE = 2  # Reports running at once; further ones wait
+    REPORT_POOL_TIMEOUT = 30  # Seconds a report waits for a connection
+    
+    # Request performance monitor (/debug/perf); off unless BILLPRO_PERF=1
+    PERF_MONITOR = os.environ.get('BILLPRO_PERF') == '1'
+    PERF_BUFFER_SIZE = 5000  # Most recent requests kept
+    PERF_SLOWEST_KEPT = 3  # Slowest statements kept per request
+    
+    # On-demand request profiles (?_profile=1 or X-Profile header) from
+    # localhost, or from elsewhere with BILLPRO_PROFILE_TOKEN in X-Profile-Token
+    PROFILE_DIR = os.path.join(BASE_DIR, 'database', 'profiles')
+    PROFILE_TOKEN = os.environ.get('BILLPRO_PROFILE_TOKEN', '')
+    PROFILE_TOP_ALLOCATIONS = 30  # Allocation sites listed per memory profile
+    PROFILE_KEEP = 50  # Newest profiles kept on disk
+    
+    # Prometheus metrics (/metrics); BILLPRO_METRICS=0 turns them off
+    METRICS = os.environ.get('BILLPRO_METRICS', '1') == '1'
+    
+    # Slow query log with query plans (0 turns it off)
+    SLOW_QUERY_MS = 250
+    SLOW_QUERY_LOG = os.path.join(BASE_DIR, 'database', 'slow_queries.jsonl')
+    SLOW_QUERY_LOG_MAX_BYTES = 5 * 1024 * 1024  # Older entries move to .1 past this size
+    
+    # Web server: 'production' runs the threaded waitress server, 'development'
+    # Flask's debug server. The exe always runs production.
+    SERVER_MODE = os.environ.get('BILLPRO_SERVER', 'development')
+    SERVER_HOST = os.environ.get('BILLPRO_HOST', '127.0.0.1')  # 0.0.0.0 serves other counters on the LAN
+    SERVER_PORT = int(os.environ.get('BILLPRO_PORT', '5000'))
+    SERVER_THREADS = 8  # Requests handled at once
+    SERVER_CONNECTION_LIMIT = 100  # Open connections before new ones wait
+    SERVER_CHANNEL_TIMEOUT = 120  # Seconds before an idle or stalled connection is closed
+    
+    # Compiled templates kept between starts ('' turns the cache off), seeded
+    # from the copy `run.py precompile-templates` builds into the exe
+    TEMPLATE_CACHE_DIR = os.path.join(BASE_DIR, 'database', 'template_cache')
+    TEMPLATE_PRECOMPILED_DIR = os.path.join(BASE_DIR, 'template_cache')
+    # Counter pages compiled in the background at startup
+    TEMPLATE_WARM = [
+        'base.html', 'dashboard.html',
+        'billing/index.html', 'billing/new.html', 'billing/view.html',
+        'bills/invoice_a4.html', 'bills/thermal_preview.html',
+        'inventory/index.html', 'ledgers/view.html',
+    ]
+    
+    # Hourly background jobs: scheduled backups, stock snapshots, reorder batch
+    BACKGROUND_JOBS = True  # Off for benchmark runs
+    
+    # Database backups
+    BACKUP_INTERVAL_HOURS = 24  # 0 turns scheduled backups off
+    BACKUP_KEEP = 14  # Newest backups kept on disk
+    BACKUP_KEEP_LABELLED = 10  # Newest pre-restore/pre-archive copies, kept apart from the above
+    BACKUP_COMPRESS = True  # gzip backups
+    
+    # Reorder suggestions
+    REORDER_HISTORY_DAYS = 90  # Sales history used for velocity
+    REORDER_SMOOTHING = 0.1  # Exponential smoothing factor (higher reacts faster)
+    REORDER_LEAD_DAYS = 7  # Days from order to receipt
+    REORDER_COVER_DAYS = 30  # Days of sales to order for
+    
     # Default GST rates
     DEFAULT_GST_RATES = [0, 5, 12, 18, 28]
     
@@ -2,8 +2,10 @@
 BillPro - Enterprise Billing & Accounting System
 Entry point for the Flask application
 """
+import argparse
 import os
 import sys
+import multiprocessing
 import webbrowser
 import threading
 import time
@@ -20,23 +22,101 @@ else:
 # Add the project root to Python path
 sys.path.insert(0, BASE_DIR)
 
-from app import create_app
+from config.settings import Config
 
-app = create_app()
+# Created in __main__ after freeze_support(): process pool workers spawned by
+# the exports re-import this file, and must not start a second app
+app = None
 
 
-def open_browser():
+def run_command(args):
+    """Command line maintenance: `backup`, `restore <backup file>` or `precompile-templates [folder]`"""
+    from app.services.backup import DatabaseBackup
+    
+    with app.app_context():
+        if args[0] == 'precompile-templates' and len(args) <= 2:
+            from app.services.template_cache import TemplateCache
+            directory = args[1] if len(args) == 2 else os.path.join('build', 'template_cache')
+            count = TemplateCache.precompile(app, directory)
+            print(f"{count} templates compiled into {directory}")
+        elif args[0] == 'backup':
+            print(f"Backup saved as {DatabaseBackup.create()}")
+        elif args[0] == 'restore' and len(args) == 2:
+            path = args[1]
+            if not os.path.exists(path):
+                path = DatabaseBackup.path(path)
+            safety = DatabaseBackup.restore(path)
+            print(f"Database restored from {args[1]}")
+            if safety:
+                print(f"Previous data saved as {safety}")
+        else:
+            print("Usage: run.py [backup | restore <backup file> | precompile-templates [folder]]")
+            return 1
+    return 0
+
+
+def open_browser(port):
     """Open browser after a short delay"""
     time.sleep(1.5)
-    webbrowser.open('http://localhost:5000')
+    webbrowser.open(f'http://localhost:{port}')
+
+
+def serve_production(host, port, threads):
+    """Serve with waitress, or Werkzeug's threaded server where it is not installed"""
+    try:
+        from waitress import serve
+    except ImportError:
+        from werkzeug.serving import make_server
+        print("  waitress is not installed; using the threaded Werkzeug server")
+        print("  (no connection limit or timeouts: pip install waitress)")
+        make_server(host, port, app, threaded=True).serve_forever()
+        return
+    
+    serve(app, host=host, port=port, threads=threads,
+          connection_limit=app.config['SERVER_CONNECTION_LIMIT'],
+          channel_timeout=app.config['SERVER_CHANNEL_TIMEOUT'],
+          ident='BillPro')
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='run.py', description='BillPro server and maintenance commands')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--production', dest='mode', action='store_const', const='production',
+                      help='serve with the multi-threaded production server')
+    mode.add_argument('--development', dest='mode', action='store_const', const='development',
+                      help="serve with Flask's debug server")
+    parser.add_argument('--host', default=Config.SERVER_HOST)
+    parser.add_argument('--port', type=int, default=Config.SERVER_PORT)
+    parser.add_argument('--threads', type=int, default=Config.SERVER_THREADS,
+                        help='requests handled at once in production mode')
+    parser.add_argument('command', nargs='*',
+                        help='backup | restore <backup file> | precompile-templates [folder]')
+    return parser.parse_args(argv)
 
 
 if __name__ == '__main__':
+    # Needed for the process pools used by batch exports in the frozen exe
+    multiprocessing.freeze_support()
+    
+    frozen = getattr(sys, 'frozen', False)
+    args = parse_args(sys.argv[1:])
+    
+    from app import create_app
+    app = create_app()
+    
+    if args.command:
+        sys.exit(run_command(args.command))
+    
+    mode = 'production' if frozen else args.mode or app.config['SERVER_MODE']
+    
     print("=" * 50)
     print("  BillPro - Billing & Accounting Software")
     print("=" * 50)
     print()
-    print("  Starting server at http://localhost:5000")
+    print(f"  Starting server at http://localhost:{args.port}")
+    print(f"  Started in {app.extensions['billpro_startup']['total']:.2f}s")
+    if mode == 'production':
+        print(f"  Production server, {args.threads} threads, listening on {args.host}")
     print()
     print("  The application will open in your browser...")
     print("  Press Ctrl+C to stop the server")
@@ -44,9 +124,10 @@ if __name__ == '__main__':
     print("=" * 50)
     
     # Auto-open browser in exe mode
-    if getattr(sys, 'frozen', False):
-        threading.Thread(target=open_browser, daemon=True).start()
+    if frozen:
+        threading.Thread(target=open_browser, args=(args.port,), daemon=True).start()
     
-    # Run without debug mode in production/exe
-    debug_mode = not getattr(sys, 'frozen', False)
-    app.run(host='127.0.0.1', port=5000, debug=debug_mode)
+    if mode == 'production':
+        serve_production(args.host, args.port, args.threads)
+    else:
+        app.run(host=args.host, port=args.port, debug=True)